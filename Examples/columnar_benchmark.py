@@ -0,0 +1,96 @@
+"""
+Columnar capture benchmark.
+
+Records synthetic cyclic traffic (counters, slowly changing signals, a few event IDs) as a
+fixed-width capture segment, a candump log and a columnar capture, then reports the size of
+each, with and without zlib over the whole file, and how fast a full decode and a scan of the
+ID column alone run.
+
+Run from the repository root:
+    python -m Examples.columnar_benchmark
+"""
+import math
+import os
+import random
+import tempfile
+import time
+import zlib
+from lib.CanFrame import CanFrame
+from lib.CaptureReader import CaptureReader
+from lib.CaptureWriter import CaptureWriter
+from lib.ColumnarCapture import ColumnarReader, ColumnarWriter
+from lib.LogFormats import write_log
+
+
+def make_frames(seconds, seed=1):
+    """
+    Yields the frames of a bus with 40 cyclic IDs (10-1000 ms) and sporadic event frames, in time order
+    """
+    _random = random.Random(seed)
+    _cyclic = [(_random.randrange(0x800), False, _random.choice((0.01, 0.02, 0.05, 0.1, 0.1, 0.5, 1.0))) for _ in range(32)]
+    _cyclic += [(_random.randrange(1 << 29), True, _random.choice((0.01, 0.1, 1.0))) for _ in range(8)]
+    _start = 1700000000.0
+    _events = []
+    for _id, _ext, _period in _cyclic:
+        _phase = _random.random() * _period
+        _n = int((seconds - _phase) / _period)
+        _events += [(_start + _phase + i * _period + _random.gauss(0, 0.0002), _id, _ext, i) for i in range(_n)]
+    _events += [(_start + _random.random() * seconds, 0x7DF, False, -1) for _ in range(int(seconds))]
+    _events.sort()
+    for _ts, _id, _ext, i in _events:
+        if i < 0:
+            yield CanFrame(_id, _ext, False, 8, bytes([2, 1, _random.randrange(256), 0, 0, 0, 0, 0]), _ts)
+            continue
+        _signal = int(1000 + 800 * math.sin(i / 500 + _id))
+        _data = bytes([i & 0xFF, (i >> 8) & 0x0F, _signal & 0xFF, _signal >> 8, _id & 0xFF, 0, 0xFF, 0xFF])
+        yield CanFrame(_id, _ext, False, 8, _data, _ts)
+
+
+def size_line(name, path):
+    with open(path, 'rb') as f:
+        _data = f.read()
+    _zlib = len(zlib.compress(_data, 6))
+    print("  {:<10} {:8.2f} MB   zlib {:8.2f} MB".format(name, len(_data) / (1 << 20), _zlib / (1 << 20)))
+    return len(_data)
+
+
+def run(directory, frames):
+    _writer = CaptureWriter(directory, 'bench', 0, 0, fsync_interval=0)
+    _writer.write(frames)
+    _writer.close()
+    _capture = _writer.segments[0]
+    _log = os.path.join(directory, 'bench.log')
+    write_log(iter(frames), _log, 'candump')
+    _columnar = os.path.join(directory, 'bench.ccap')
+    with CaptureReader(_capture, persist_index=False) as _reader, ColumnarWriter(_columnar) as _archive:
+        _start = time.perf_counter()
+        for _records in _reader.slice():
+            _archive.write_array(_records)
+    _write = time.perf_counter() - _start
+
+    _cap_size = size_line('capture', _capture)
+    size_line('candump', _log)
+    _col_size = size_line('columnar', _columnar)
+    print("  columnar is {:.1f}x smaller than the capture, written at {:.0f} frames/s".format(
+        _cap_size / _col_size, len(frames) / _write))
+
+    with ColumnarReader(_columnar) as _reader:
+        _start = time.perf_counter()
+        _count = sum(len(r) for r in _reader.select())
+        _full = time.perf_counter() - _start
+        _start = time.perf_counter()
+        sum(len(r) for r in _reader.select(fields=('id',)))
+        _ids = time.perf_counter() - _start
+        _start = time.perf_counter()
+        _one = len(_reader.frames_for(frames[0].id, frames[0].ext))
+        _for = time.perf_counter() - _start
+    print("  decode all columns {:8.0f} frames/s, ID column only {:8.0f} frames/s, one ID ({} frames) in {:.3f} s".format(
+        _count / _full, _count / _ids, _one, _for))
+
+
+if __name__ == '__main__':
+    _seconds = 600
+    _frames = list(make_frames(_seconds))
+    print("----------COLUMNAR CAPTURE ({} frames, {} s of traffic)-----------".format(len(_frames), _seconds))
+    with tempfile.TemporaryDirectory() as _directory:
+        run(_directory, _frames)
@@ -0,0 +1,103 @@
+"""
+ISO-TP throughput benchmark against the PCAN emulator.
+
+Sends multi-kilobyte payloads to an emulated ECU and compares one serial write per
+consecutive frame with batched writes per block.
+
+Run from the repository root:
+    python -m Examples.isotp_benchmark
+"""
+import time
+from lib.CanFrame import CanFrame
+from lib.ISOTP import ISOTP
+from lib.PCAN_Emulator import PCAN_Emulator
+
+
+class ISOTPNode:
+    """
+    Emulated ISO-TP receiver for PCAN_Emulator. Reassembles payloads sent to rx_id,
+    answers with flow control on tx_id and replies to each payload with a single frame.
+    """
+
+    def __init__(self, rx_id, tx_id, block_size=0, st_min=0, on_payload=None):
+        """
+        :param on_payload called with each received payload, returns the reply (at most 7 bytes),
+                          a list of replies or None
+        """
+        self.rx_id = rx_id
+        self.tx_id = tx_id
+        self.block_size = block_size
+        self.st_min = st_min
+        self.on_payload = on_payload
+        self.received = 0
+        self._buffer = None
+        self._length = 0
+        self._block = 0
+
+    def __call__(self, frame):
+        if frame.id != self.rx_id or not frame.data:
+            return None
+        _pci = frame.data[0] >> 4
+        if _pci == 0: # Single frame
+            return self._complete(frame.data[1:1 + (frame.data[0] & 0x0F)])
+        if _pci == 1: # First frame
+            self._length = (frame.data[0] & 0x0F) << 8 | frame.data[1]
+            self._buffer = bytearray(frame.data[2:])
+            if self._length == 0:
+                self._length = int.from_bytes(frame.data[2:6], 'big')
+                self._buffer = bytearray(frame.data[6:])
+            self._block = 0
+            return [self._flow_control()]
+        if _pci == 2 and self._buffer is not None: # Consecutive frame
+            self._buffer += frame.data[1:]
+            if len(self._buffer) >= self._length:
+                _payload = bytes(self._buffer[:self._length])
+                self._buffer = None
+                return self._complete(_payload)
+            self._block += 1
+            if self.block_size and self._block == self.block_size:
+                self._block = 0
+                return [self._flow_control()]
+        return None
+
+    def _flow_control(self):
+        return CanFrame(self.tx_id, False, False, 8, bytes((0x30, self.block_size, self.st_min, 0, 0, 0, 0, 0)))
+
+    def _complete(self, payload):
+        self.received += 1
+        _reply = self.on_payload(payload) if self.on_payload else None
+        if _reply is None:
+            return None
+        if not isinstance(_reply, list):
+            _reply = [_reply]
+        return [CanFrame(self.tx_id, False, False, len(r) + 1, bytes((len(r),)) + r) for r in _reply]
+
+
+def run(baudrate, size, block_size, batch, repeats=3):
+    _node = ISOTPNode(0x7E0, 0x7E8, block_size=block_size)
+    _pcan = PCAN_Emulator(baudrate=baudrate, latency=0.002, nodes=[_node])
+    _pcan.open_channel()
+    _isotp = ISOTP(_pcan)
+    _session = _isotp.open_session(0x7E0, 0x7E8, batch=batch)
+    _payload = bytes(i & 0xFF for i in range(size))
+
+    _start = time.perf_counter()
+    for _ in range(repeats):
+        if _session.send(_payload) != 1:
+            print("  send FAILED")
+            break
+    _elapsed = time.perf_counter() - _start
+
+    _isotp.close()
+    _pcan.close()
+    _frames = 1 + -(-(size - 6) // 7) # First frame + consecutive frames
+    print("  {:>7} baud  BS={:<3} {:<8} {:8.0f} B/s  {:7.0f} frames/s".format(
+        baudrate, block_size, "batched" if batch else "single", size * repeats / _elapsed, _frames * repeats / _elapsed))
+
+
+if __name__ == '__main__':
+    print("----------ISO-TP THROUGHPUT (4096 byte payloads)-----------")
+    for _baud in (57600, 115200):
+        for _bs in (0, 8):
+            for _batch in (False, True):
+                run(_baud, 4096, _bs, _batch)
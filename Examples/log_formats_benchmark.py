@@ -0,0 +1,70 @@
+"""
+Log conversion throughput benchmark.
+
+Writes a synthetic capture in every text format, reads it back and reports the frames and
+megabytes per second of each direction. The candump reader is also compared with a naive
+line-by-line parser to show what the chunked regex path gains.
+
+Run from the repository root:
+    python -m Examples.log_formats_benchmark
+"""
+import os
+import random
+import tempfile
+import time
+from lib.CanFrame import CanFrame
+from lib.LogFormats import READERS, WRITERS, read_log, write_log
+
+
+def make_frames(count, seed=1):
+    _random = random.Random(seed)
+    _ids = [(_random.randrange(0x800), False) for _ in range(40)] + [(_random.randrange(1 << 29), True) for _ in range(10)]
+    _ts = 1700000000.0
+    for _ in range(count):
+        _id, _ext = _ids[_random.randrange(len(_ids))]
+        _dlc = _random.randrange(9)
+        _ts += _random.random() * 0.0005
+        yield CanFrame(_id, _ext, False, _dlc, bytes(_random.randrange(256) for _ in range(_dlc)), _ts)
+
+
+def read_candump_naive(path):
+    """
+    One readline, split and int() per line, for comparison
+    """
+    with open(path) as f:
+        for _line in f:
+            _ts, _interface, _frame = _line.split()
+            _id, _data = _frame.split('#')
+            _bytes = bytes.fromhex(_data)
+            yield CanFrame(int(_id, 16), len(_id) > 3, False, len(_bytes), _bytes, float(_ts[1:-1]))
+
+
+def run(directory, frames, count):
+    for _format in sorted(WRITERS):
+        _path = os.path.join(directory, 'bench.' + _format)
+        _start = time.perf_counter()
+        write_log(iter(frames), _path, _format)
+        _write = time.perf_counter() - _start
+        _mb = os.path.getsize(_path) / (1 << 20)
+
+        _start = time.perf_counter()
+        _read = sum(1 for _ in read_log(_path, _format))
+        _elapsed = time.perf_counter() - _start
+        print("  {:<8} {:6.1f} MB  write {:8.0f} frames/s {:6.1f} MB/s   read {:8.0f} frames/s {:6.1f} MB/s{}".format(
+            _format, _mb, count / _write, _mb / _write, _read / _elapsed, _mb / _elapsed,
+            '' if _read == count else "  ({} frames read back)".format(_read)))
+
+    _path = os.path.join(directory, 'bench.candump')
+    _start = time.perf_counter()
+    _read = sum(1 for _ in read_candump_naive(_path))
+    _elapsed = time.perf_counter() - _start
+    print("  {:<8} {:6.1f} MB  {:>40}   read {:8.0f} frames/s {:6.1f} MB/s".format(
+        'naive', os.path.getsize(_path) / (1 << 20), '', _read / _elapsed, os.path.getsize(_path) / (1 << 20) / _elapsed))
+
+
+if __name__ == '__main__':
+    _count = 500000
+    _frames = list(make_frames(_count))
+    print("----------LOG FORMAT THROUGHPUT ({} frames, formats: {})-----------".format(_count, ', '.join(sorted(READERS))))
+    with tempfile.TemporaryDirectory() as _directory:
+        run(_directory, _frames, _count)
@@ -0,0 +1,67 @@
+"""
+UDS flashing throughput benchmark against the PCAN emulator.
+
+Downloads a firmware image into an emulated ECU with RequestDownload/TransferData/
+RequestTransferExit and reports the achieved bytes/s for a few block lengths.
+
+Run from the repository root:
+    python -m Examples.uds_flash_benchmark
+"""
+from Examples.isotp_benchmark import ISOTPNode
+from lib.ISOTP import ISOTP
+from lib.PCAN_Emulator import PCAN_Emulator
+from lib.UDSClient import PROGRAMMING_SESSION, UDSClient
+
+
+class FlashECU:
+    """
+    Emulated bootloader answering the services used for flashing
+    """
+
+    def __init__(self, max_block_length=0xFFF):
+        self.max_block_length = max_block_length
+        self.memory = bytearray()
+
+    def __call__(self, payload):
+        _sid = payload[0]
+        if _sid == 0x10:
+            return bytes((0x50, payload[1], 0x00, 0x32, 0x01, 0xF4))
+        if _sid == 0x34:
+            self.memory = bytearray()
+            return bytes((0x74, 0x20)) + self.max_block_length.to_bytes(2, 'big')
+        if _sid == 0x36:
+            self.memory += payload[2:]
+            return bytes((0x76, payload[1]))
+        if _sid == 0x37: # Checking the image takes a while
+            return [bytes((0x7F, 0x37, 0x78)), bytes((0x77,))]
+        if _sid == 0x3E:
+            return None
+        return bytes((0x7F, _sid, 0x11)) # Service not supported
+
+
+def run(baudrate, size, block_length):
+    _ecu = FlashECU()
+    _pcan = PCAN_Emulator(baudrate=baudrate, latency=0.002, nodes=[ISOTPNode(0x7E0, 0x7E8, on_payload=_ecu)])
+    _pcan.open_channel()
+    _isotp = ISOTP(_pcan)
+    _uds = UDSClient(_isotp.open_session(0x7E0, 0x7E8))
+    _uds.start_tester_present()
+
+    _image = bytes(i * 7 & 0xFF for i in range(size))
+    _uds.diagnostic_session_control(PROGRAMMING_SESSION)
+    _rate = _uds.download(0x08000000, _image, block_length=block_length)
+
+    _uds.stop_tester_present()
+    _isotp.close()
+    _pcan.close()
+    if _rate == -1 or bytes(_ecu.memory) != _image:
+        print("  {:>7} baud  block {:>5}  FAILED".format(baudrate, block_length))
+    else:
+        print("  {:>7} baud  block {:>5}  {:8.0f} B/s".format(baudrate, block_length, _rate))
+
+
+if __name__ == '__main__':
+    print("----------UDS DOWNLOAD THROUGHPUT (16 kB image)-----------")
+    for _baud in (57600, 115200):
+        for _block in (130, 1026, 4095):
+            run(_baud, 16384, _block)
@@ -1,8 +1,11 @@
 from widgets.MessageFrame import MessageFrame
 from widgets.ConsoleFrame import ConsoleFrame
+from widgets.TraceFrame import TraceFrame
 from widgets.PCANSettingsWindow import PCANSettingsWindow
 from lib.PCAN_RS_232 import PCAN_RS_232
+from lib.CommandExecutor import CommandExecutor
 from tkinter import *
+from tkinter.ttk import Notebook
 from widgets.InformationFrame import InformationFrame
 from widgets.ButtonFrame import ButtonFrame
 from serial import SerialException
@@ -16,7 +19,11 @@ class App(Tk):
         
         # Create main containers
         self.button_frame = ButtonFrame(self, bg="#004080", pady=3)
-        self.center_frame = ConsoleFrame(self, padx=3, pady=3)
+        self.center_frame = Notebook(self)
+        self.console_frame = ConsoleFrame(self.center_frame, padx=3, pady=3)
+        self.trace_frame = TraceFrame(self.center_frame, padx=3, pady=3)
+        self.center_frame.add(self.console_frame, text="Console")
+        self.center_frame.add(self.trace_frame, text="Trace")
         self.can_msg_frame = MessageFrame(self, bg="#004080", pady=3)
         self.btm_frame = InformationFrame(self, bg="#004080", pady=3)
 
@@ -30,137 +37,188 @@ class App(Tk):
         self._PORT = StringVar(value="COM1")        # Default: COM1
         self._BAUDRATE = StringVar(value="57600")   # Default: 57600
         self._TIMEOUT = StringVar(value="1")        # Default: 1 (s)
+        self.executor = CommandExecutor(self)       # Runs device commands off the Tk thread
+        self.bind('<Escape>', lambda e: self.cancel_commands())
         try:
             self.pcan = PCAN_RS_232(self._PORT.get(), int(self._BAUDRATE.get()), int(self._TIMEOUT.get()))
-            self.center_frame.begin(self.pcan)
+            self.console_frame.begin(self.pcan)
+            self.trace_frame.begin(self.pcan)
         except SerialException: # Default device not found
             self.pcan_window = PCANSettingsWindow(self) # Open a window to configure PCAN settings
 
     # ===PCAN INTERACTION FUNCTIONS===
 
-    def update_pcan_settings(self):
-        try:
-            self.pcan = PCAN_RS_232(self._PORT.get(), int(self._BAUDRATE.get()), int(self._TIMEOUT.get()))
-            self.center_frame.begin(self.pcan)
-            return True
-        except SerialException:
-            return False
+    def update_pcan_settings(self, done=None):
+        """
+        Closes the current device and opens the one set in the settings variables on the executor
+
+        :param done called on the Tk thread with True if the device was opened
+        """
+        _previous = getattr(self, 'pcan', None)
+        _port, _baudrate, _timeout = self._PORT.get(), self._BAUDRATE.get(), self._TIMEOUT.get()
+        def _reopen(): # Runs after the command in flight, which returns within the serial timeout
+            if _previous is not None:
+                _previous.stop_receiver()
+                _previous.close()
+            return PCAN_RS_232(_port, int(_baudrate), int(_timeout))
+        def _feedback(_pcan):
+            if _pcan != -1:
+                self.pcan = _pcan
+                self.console_frame.begin(_pcan)
+                self.trace_frame.begin(_pcan)
+                self.btm_frame.cmd_feedback.set("Opened " + _port)
+            else: # SerialException or invalid settings
+                self.btm_frame.cmd_feedback.set("FAILED to open " + _port)
+            if done is not None: done(_pcan != -1)
+        self.executor.cancel() # Commands queued for the previous device
+        self.run_command("Opening " + _port, _feedback, _reopen, key='settings')
+
+    def run_command(self, description, feedback, fn, *args, key=None):
+        """
+        Runs a device command on the executor and reports its progress in cmd_feedback
+
+        :param description the text shown while the command is queued or running
+        :param feedback called on the Tk thread with the result of fn, -1 if an ERROR occurred
+        :param key commands with the same key replace each other while queued
+        """
+        self.executor.submit(fn, *args, done=feedback, key=key, description=description)
+        _queued = self.executor.queued - 1
+        self.btm_frame.cmd_feedback.set(description + "..." + (" ({} queued)".format(_queued) if _queued > 0 else ""))
+
+    def cancel_commands(self):
+        _n = self.executor.cancel()
+        if _n:
+            self.btm_frame.cmd_feedback.set("Cancelled {} command{}".format(_n, '' if _n == 1 else 's'))
 
     # ===WIDGET INTERFACE FUNCTIONS===
-    
+    # Device commands run on the executor; their results are passed to the optional done callbacks on the Tk thread
+
     def update_pcan_status(self):
-        _stat = self.pcan.get_status_flags()
-        if _stat != -1:
-            self.btm_frame.pcan_status.set(_stat)
-            self.btm_frame.cmd_feedback.set("Received PCAN status")
-        else:
-            self.btm_frame.cmd_feedback.set("FAILED to get PCAN status")
-
-    def update_pcan_open(self, open):
-        _res = self.pcan.open_channel() if open else self.pcan.close_channel()
-        if _res != -1: # Channel successfully opened/closed
-            _text = "Opened CAN Channel" if open else "Closed CAN channel"
+        def _feedback(_stat):
+            if _stat != -1:
+                self.btm_frame.pcan_status.set(_stat)
+                self.btm_frame.cmd_feedback.set("Received PCAN status")
+            else:
+                self.btm_frame.cmd_feedback.set("FAILED to get PCAN status")
+        self.run_command("Getting PCAN status", _feedback, lambda: self.pcan.get_status_flags(), key='status')
+
+    def update_pcan_open(self, open, done=None):
+        def _feedback(_res):
+            if _res != -1: # Channel successfully opened/closed
+                _text = "Opened CAN Channel" if open else "Closed CAN channel"
+            else:
+                _text = "FAILED to open CAN channel" if open else "FAILED to close CAN channel"
             self.btm_frame.cmd_feedback.set(_text)
-            return True
-        else:
-            _text = "FAILED to open CAN channel" if open else "FAILED to close CAN channel"
-            self.btm_frame.cmd_feedback.set(_text)
-            return False
-    
+            if done is not None: done(_res != -1)
+        _fn = self.pcan.open_channel if open else self.pcan.close_channel
+        self.run_command("Opening CAN channel" if open else "Closing CAN channel", _feedback, _fn, key='open')
+
     def update_pcan_info(self):
-        _sn = self.pcan.get_serial_number()
-        _info = self.pcan.get_version_info()
-        print(_info) # DEBUG
-        if _info != -1:
-            self.btm_frame.pcan_sn.set(_sn)
-            self.btm_frame.pcan_hw_version.set(_info[0])
-            self.btm_frame.pcan_sw_version.set(_info[1])
-            self.btm_frame.cmd_feedback.set("Received PCAN info")
-        else:
-            self.btm_frame.cmd_feedback.set("FAILED to get PCAN info")
-
-    def update_acceptance_mask(self, mask):
-        _res = self.pcan.set_acceptance_mask_register(mask)
-        if _res != -1: # Acceptance mask register successfuly set
-            self.btm_frame.cmd_feedback.set("Set mask to " + mask)
-        else:
-            self.btm_frame.cmd_feedback.set("FAILED to set acceptance mask")
-        return _res
-
-    def update_acceptance_code(self, code):
-        _res = self.pcan.set_acceptance_code_register(code)
-        if _res != -1: # Acceptance code register successfuly set
-            self.btm_frame.cmd_feedback.set("Set code to "+ code)
-        else:
-            self.btm_frame.cmd_feedback.set("FAILED to set acceptance code")
-        return _res
-
-    def update_auto_poll(self, en: bool):
-        _res = self.pcan.set_auto_poll(en)
-        if _res != -1: # Auto poll successfully set
-            _text = "ENABLED auto poll feature" if en else "DISABLED auto poll feature"
-            self.btm_frame.cmd_feedback.set(_text)
-        else:
-            self.btm_frame.cmd_feedback.set("FAILED to set auto poll")
-        return _res
-
-    def update_auto_startup(self, en: bool):
-        _res = self.pcan.set_auto_startup(en)
-        if _res != -1: # Auto startup successfully set
-            _text = "ENABLED auto startup feature" if en else "DISABLED auto startup feature"
-            self.btm_frame.cmd_feedback.set(_text)
-        else:
-            self.btm_frame.cmd_feedback.set("FAILED to set auto startup")
-        return _res
-
-    def update_can_baudrate(self, n: str):
-        _res = self.pcan.set_can_bitrate(n)
-        if _res != -1: # CAN baudrate successfully set
-            self.btm_frame.cmd_feedback.set("Set CAN baudrate") # TODO: Include baudrate
-        else:
-            self.btm_frame.cmd_feedback.set("FAILED to set CAN baudrate")
-        return _res
-
-    def update_uart_baudrate(self, n: str):
-        _res = self.pcan.set_uart_bitrate(n)
+        def _feedback(_res):
+            _sn, _info = _res if _res != -1 else (-1, -1)
+            if _info != -1:
+                self.btm_frame.pcan_sn.set(_sn)
+                self.btm_frame.pcan_hw_version.set(_info[0])
+                self.btm_frame.pcan_sw_version.set(_info[1])
+                self.btm_frame.cmd_feedback.set("Received PCAN info")
+            else:
+                self.btm_frame.cmd_feedback.set("FAILED to get PCAN info")
+        self.run_command("Getting PCAN info", _feedback, lambda: (self.pcan.get_serial_number(), self.pcan.get_version_info()), key='info')
+
+    def update_acceptance_mask(self, mask, done=None):
+        def _feedback(_res):
+            if _res != -1: # Acceptance mask register successfuly set
+                self.btm_frame.cmd_feedback.set("Set mask to " + mask)
+            else:
+                self.btm_frame.cmd_feedback.set("FAILED to set acceptance mask")
+            if done is not None: done(_res)
+        self.run_command("Setting acceptance mask", _feedback, self.pcan.set_acceptance_mask_register, mask, key='mask')
+
+    def update_acceptance_code(self, code, done=None):
+        def _feedback(_res):
+            if _res != -1: # Acceptance code register successfuly set
+                self.btm_frame.cmd_feedback.set("Set code to "+ code)
+            else:
+                self.btm_frame.cmd_feedback.set("FAILED to set acceptance code")
+            if done is not None: done(_res)
+        self.run_command("Setting acceptance code", _feedback, self.pcan.set_acceptance_code_register, code, key='code')
+
+    def update_auto_poll(self, en: bool, done=None):
+        def _feedback(_res):
+            if _res != -1: # Auto poll successfully set
+                _text = "ENABLED auto poll feature" if en else "DISABLED auto poll feature"
+                self.btm_frame.cmd_feedback.set(_text)
+            else:
+                self.btm_frame.cmd_feedback.set("FAILED to set auto poll")
+            if done is not None: done(_res)
+        self.run_command("Setting auto poll", _feedback, self.pcan.set_auto_poll, en, key='auto_poll')
+
+    def update_auto_startup(self, en: bool, done=None):
+        def _feedback(_res):
+            if _res != -1: # Auto startup successfully set
+                _text = "ENABLED auto startup feature" if en else "DISABLED auto startup feature"
+                self.btm_frame.cmd_feedback.set(_text)
+            else:
+                self.btm_frame.cmd_feedback.set("FAILED to set auto startup")
+            if done is not None: done(_res)
+        self.run_command("Setting auto startup", _feedback, self.pcan.set_auto_startup, en, key='auto_startup')
+
+    def update_can_baudrate(self, n: str, done=None):
+        def _feedback(_res):
+            if _res != -1: # CAN baudrate successfully set
+                self.btm_frame.cmd_feedback.set("Set CAN baudrate") # TODO: Include baudrate
+            else:
+                self.btm_frame.cmd_feedback.set("FAILED to set CAN baudrate")
+            if done is not None: done(_res)
+        self.run_command("Setting CAN baudrate", _feedback, self.pcan.set_can_bitrate, n, key='can_baudrate')
+
+    def update_uart_baudrate(self, n: str, done=None):
         # TODO: Edit application baudrate to reflect new set baudrate!!!!!!!!!!
-        if _res != -1: # UART baudrate successfully set
-            self.btm_frame.cmd_feedback.set("Set UART baudrate") # TODO: Include baudrate
-        else:
-            self.btm_frame.cmd_feedback.set("FAILED to set UART baudrate")
-        return _res
-    
-    def update_filter_mode(self, n: bool):
-        _res = self.pcan.set_filter_mode(n)
-        if _res != -1: # Filter mode successfully set
-            _text = "Set mode to Single Filter" if n else "Set mode to Dual Filter"
-            self.btm_frame.cmd_feedback.set(_text)
-        else:
-            self.btm_frame.cmd_feedback.set("FAILED to set filter mode")
-        return _res
-
-    def update_timestamp(self, n: bool):
-        _res = self.pcan.enable_timestamps(n)
-        if _res != -1: # Filter mode successfully set
-            _text = "Enabled timestamp feature" if n else "Disabled timestamp feature"
-            self.btm_frame.cmd_feedback.set(_text)
-        else:
-            self.btm_frame.cmd_feedback.set("FAILED to timestamp feature")
-        return _res
+        def _feedback(_res):
+            if _res != -1: # UART baudrate successfully set
+                self.btm_frame.cmd_feedback.set("Set UART baudrate") # TODO: Include baudrate
+            else:
+                self.btm_frame.cmd_feedback.set("FAILED to set UART baudrate")
+            if done is not None: done(_res)
+        self.run_command("Setting UART baudrate", _feedback, self.pcan.set_uart_bitrate, n, key='uart_baudrate')
+
+    def update_filter_mode(self, n: bool, done=None):
+        def _feedback(_res):
+            if _res != -1: # Filter mode successfully set
+                _text = "Set mode to Single Filter" if n else "Set mode to Dual Filter"
+                self.btm_frame.cmd_feedback.set(_text)
+            else:
+                self.btm_frame.cmd_feedback.set("FAILED to set filter mode")
+            if done is not None: done(_res)
+        self.run_command("Setting filter mode", _feedback, self.pcan.set_filter_mode, n, key='filter_mode')
+
+    def update_timestamp(self, n: bool, done=None):
+        def _feedback(_res):
+            if _res != -1: # Filter mode successfully set
+                _text = "Enabled timestamp feature" if n else "Disabled timestamp feature"
+                self.btm_frame.cmd_feedback.set(_text)
+            else:
+                self.btm_frame.cmd_feedback.set("FAILED to timestamp feature")
+            if done is not None: done(_res)
+        self.run_command("Setting timestamp feature", _feedback, self.pcan.enable_timestamps, n, key='timestamp')
 
     def update_eeprom(self, n: str):
-        if self.pcan.write_to_eeprom(n) != -1:
-            if n == '0':    self.btm_frame.cmd_feedback.set("Saved settings to EEPROM")
-            elif n == '1':  self.btm_frame.cmd_feedback.set("Reloaded factory settings")
-            elif n == '2':  self.btm_frame.cmd_feedback.set("Deleted all settings")
-        else:
-            self.btm_frame.cmd_feedback.set("FAILED to command EEPROM")
+        def _feedback(_res):
+            if _res != -1:
+                if n == '0':    self.btm_frame.cmd_feedback.set("Saved settings to EEPROM")
+                elif n == '1':  self.btm_frame.cmd_feedback.set("Reloaded factory settings")
+                elif n == '2':  self.btm_frame.cmd_feedback.set("Deleted all settings")
+            else:
+                self.btm_frame.cmd_feedback.set("FAILED to command EEPROM")
+        self.run_command("Commanding EEPROM", _feedback, self.pcan.write_to_eeprom, n, key='eeprom')
 
     def transmit_message(self, msg):
-        if self.pcan.send_message(msg) != -1: # Message successfully sent
-            self.btm_frame.cmd_feedback.set("Sent message")
-        else:
-            self.btm_frame.cmd_feedback.set("FAILED to send message")
+        def _feedback(_res):
+            if _res != -1: # Message successfully sent
+                self.btm_frame.cmd_feedback.set("Sent message")
+            else:
+                self.btm_frame.cmd_feedback.set("FAILED to send message")
+        self.run_command("Sending message", _feedback, self.pcan.send_message, msg)
 
 _app = App()
 
@@ -169,7 +227,8 @@ try:
         _app.mainloop() # Begin interface application
 finally: # On app close
     try:
-        _app.update_pcan_open(False) # Close CAN connection
-        _app.update_eeprom('1') # Reset to factory-default settings
+        _app.executor.close()
+        _app.pcan.close_channel() # Close CAN connection
+        _app.pcan.write_to_eeprom('1') # Reset to factory-default settings
     except:
         pass
\ No newline at end of file
@@ -0,0 +1,510 @@
+import configparser
+import struct
+import threading
+import time
+from collections import deque
+from queue import Empty, Queue
+from typing import NamedTuple
+from lib.CanFrame import CanFrame
+
+# NMT commands
+NMT_START               = 0x01
+NMT_STOP                = 0x02
+NMT_PRE_OPERATIONAL     = 0x80
+NMT_RESET_NODE          = 0x81
+NMT_RESET_COMMUNICATION = 0x82
+
+# NMT states reported by heartbeats
+STATE_BOOTUP            = 0x00
+STATE_STOPPED           = 0x04
+STATE_OPERATIONAL       = 0x05
+STATE_PRE_OPERATIONAL   = 0x7F
+
+# Function codes (COB-ID base)
+COB_NMT                 = 0x000
+COB_EMCY                = 0x080
+COB_SDO_TX              = 0x580 # Server -> client
+COB_SDO_RX              = 0x600 # Client -> server
+COB_HEARTBEAT           = 0x700
+
+SDO_ABORT               = 0x80
+
+# CANopen data types -> (struct format, size in bits)
+DATA_TYPES = {
+    0x0001: ('?', 8),   # BOOLEAN
+    0x0002: ('b', 8),   # INTEGER8
+    0x0003: ('h', 16),  # INTEGER16
+    0x0004: ('i', 32),  # INTEGER32
+    0x0005: ('B', 8),   # UNSIGNED8
+    0x0006: ('H', 16),  # UNSIGNED16
+    0x0007: ('I', 32),  # UNSIGNED32
+    0x0008: ('f', 32),  # REAL32
+    0x0011: ('d', 64),  # REAL64
+    0x0015: ('q', 64),  # INTEGER64
+    0x001B: ('Q', 64),  # UNSIGNED64
+}
+_UNSIGNED = {8: 'B', 16: 'H', 32: 'I', 64: 'Q'}
+
+
+class EmergencyMessage(NamedTuple):
+    node_id: int
+    error_code: int
+    error_register: int
+    data: bytes
+    timestamp: float
+
+
+class PDOMessage(NamedTuple):
+    cob_id: int
+    node_id: int
+    values: dict
+    timestamp: float
+
+
+def _parse_int(value, node_id=0):
+    """
+    Parses an EDS number (decimal, 0x hex or octal), including $NODEID+ expressions
+    """
+    value = value.strip().upper().replace('$NODEID', str(node_id))
+    return sum(_parse_term(v.strip()) for v in value.split('+') if v.strip())
+
+
+def _parse_term(v):
+    if len(v) > 1 and v[0] == '0' and v[1].isdigit(): # Octal, e.g. 017 (int(v, 0) rejects it)
+        return int(v, 8)
+    return int(v, 0)
+
+
+class ObjectDictionary:
+    """
+    Object dictionary entries and PDO mappings loaded from an EDS file
+    """
+
+    def __init__(self, path=None, node_id=0):
+        """
+        :param path the EDS file to load
+        :param node_id the node ID substituted for $NODEID in COB-IDs
+        """
+        self.entries = {}   # (index, subindex) -> (name, data type)
+        self.tpdos = {}     # COB-ID -> list of (name, data type, length in bits), in mapping order
+        if path is not None:
+            self.load(path, node_id)
+
+    def load(self, path, node_id=0):
+        _eds = configparser.ConfigParser(strict=False, interpolation=None)
+        _eds.read(path, encoding='latin-1')
+
+        for _section in _eds.sections():
+            _key = self._section_key(_section)
+            if _key is None:
+                continue
+            _name = _eds.get(_section, 'ParameterName', fallback=_section)
+            _type = _parse_int(_eds.get(_section, 'DataType', fallback='0'))
+            self.entries[_key] = (_name, _type)
+
+        for _n in range(512): # TPDO communication parameters 0x1800-0x19FF, mappings 0x1A00-0x1BFF
+            _comm = '{:04X}sub1'.format(0x1800 + _n)
+            _map = '{:04X}'.format(0x1A00 + _n)
+            if not _eds.has_section(_comm) or not _eds.has_section(_map + 'sub0'):
+                continue
+            _cob_id = _parse_int(_eds.get(_comm, 'DefaultValue', fallback='0'), node_id)
+            if _cob_id & 0x80000000: # PDO not valid
+                continue
+            _count = _parse_int(_eds.get(_map + 'sub0', 'DefaultValue', fallback='0'))
+            _mapping = []
+            for _sub in range(1, _count + 1):
+                _value = _parse_int(_eds.get('{}sub{}'.format(_map, _sub), 'DefaultValue', fallback='0'))
+                _index, _subindex, _bits = _value >> 16, (_value >> 8) & 0xFF, _value & 0xFF
+                _name, _type = self.entries.get((_index, _subindex), ('{:04X}sub{}'.format(_index, _subindex), 0))
+                _mapping.append((_name, _type, _bits))
+            self.tpdos[_cob_id & 0x7FF] = _mapping
+
+    @staticmethod
+    def _section_key(section):
+        """
+        :return (index, subindex) for '1018' or '1018sub2' sections, None for others
+        """
+        _parts = section.upper().split('SUB')
+        try:
+            _index = int(_parts[0], 16)
+            _sub = int(_parts[1], 16) if len(_parts) > 1 else 0
+        except ValueError:
+            return None
+        return (_index, _sub)
+
+
+def compile_pdo(mapping):
+    """
+    Precompiles a PDO decoder from a mapping
+
+    :param mapping a list of (name, data type, length in bits) in mapping order
+
+    :return a closure taking the PDO payload and returning a tuple of values
+    """
+    _names = [m[0] for m in mapping]
+    _fmts = []
+    for _name, _type, _bits in mapping:
+        _fmt, _size = DATA_TYPES.get(_type, (_UNSIGNED.get(_bits), _bits))
+        _fmts.append(_fmt if _fmt is not None and _size == _bits else None)
+
+    if all(_fmts): # Byte aligned, one struct.Struct does the whole PDO
+        _unpack_from = struct.Struct('<' + ''.join(_fmts)).unpack_from
+        _size = struct.calcsize('<' + ''.join(_fmts))
+        def _decode(data):
+            return _unpack_from(data.ljust(_size, b'\0'))
+    else: # Bit mapped, extract each value from the payload as an integer
+        _fields = []
+        _pos = 0
+        for _name, _type, _bits in mapping:
+            _signed = DATA_TYPES.get(_type, ('B',))[0] in 'bhiq'
+            _fields.append((_pos, (1 << _bits) - 1, 1 << (_bits - 1) if _signed else 0, 1 << _bits))
+            _pos += _bits
+        def _decode(data):
+            _raw = int.from_bytes(data, 'little')
+            _values = []
+            for _shift, _mask, _sign, _wrap in _fields:
+                _v = (_raw >> _shift) & _mask
+                _values.append(_v - _wrap if _sign and _v & _sign else _v)
+            return tuple(_values)
+    _decode.names = _names
+    return _decode
+
+
+class SDOClient:
+    """
+    SDO client for one node. Transfers return -1 when an ERROR occurs (timeout or abort, the
+    abort code is kept in last_abort_code).
+    """
+
+    def __init__(self, network, node_id, timeout=1, block_size=127, max_batch=32):
+        """
+        :param network the CANopen network the node is on
+        :param node_id the node ID (1-127)
+        :param timeout seconds to wait for each server response
+        :param block_size the number of segments per block requested in block uploads
+        :param max_batch the maximum number of block segments joined into one serial write,
+                         keep it within the PCAN transmit FIFO
+        """
+        self.network = network
+        self.node_id = node_id
+        self.timeout = timeout
+        self.block_size = block_size
+        self.max_batch = max_batch
+        self.last_abort_code = None
+        self._responses = Queue()
+        self._lock = threading.Lock()
+
+    # =====UPLOAD=====
+
+    def upload(self, index, subindex):
+        """
+        Reads an object with an expedited or segmented upload
+
+        :return -1 if an ERROR occurs
+        :return the object value as bytes
+        """
+        with self._lock:
+            _res = self._request(bytes((0x40,)) + self._mux(index, subindex))
+            if _res == -1:
+                return -1
+            if _res[0] & 0x02: # Expedited
+                _n = 4 - ((_res[0] >> 2) & 0x03) if _res[0] & 0x01 else 4
+                return bytes(_res[4:4 + _n])
+
+            _size = int.from_bytes(_res[4:8], 'little') if _res[0] & 0x01 else None
+            _data = bytearray()
+            _toggle = 0
+            while True:
+                _res = self._request(bytes((0x60 | _toggle,)) + bytes(7))
+                if _res == -1:
+                    return -1
+                _data += _res[1:8 - ((_res[0] >> 1) & 0x07)]
+                if _res[0] & 0x01: # Last segment
+                    return bytes(_data[:_size] if _size is not None else _data)
+                _toggle ^= 0x10
+
+    def block_upload(self, index, subindex):
+        """
+        Reads an object with a block upload: the server streams up to block_size segments per
+        acknowledgement instead of one per request
+
+        :return -1 if an ERROR occurs
+        :return the object value as bytes
+        """
+        with self._lock:
+            _res = self._request(bytes((0xA0,)) + self._mux(index, subindex) + bytes((self.block_size, 0, 0, 0)))
+            if _res == -1:
+                return -1
+            if _res[0] & 0xE0 != 0xC0: # Server fell back to a normal upload
+                self._abort(index, subindex, 0x05040001)
+                return -1
+            _size = int.from_bytes(_res[4:8], 'little') if _res[0] & 0x02 else None
+
+            _data = bytearray()
+            self._send(bytes((0xA3,)) + bytes(7)) # Start the transfer
+            while True:
+                _seq = 0
+                _last = False
+                while not _last and _seq < self.block_size:
+                    _seg = self._receive()
+                    if _seg == -1:
+                        return -1
+                    if _seg[0] & 0x7F != _seq + 1: # Out of sequence, acknowledge what we have
+                        break
+                    _seq += 1
+                    _data += _seg[1:8]
+                    _last = bool(_seg[0] & 0x80)
+                self._send(bytes((0xA2, _seq, self.block_size)) + bytes(5))
+                if _last:
+                    break
+
+            _end = self._receive()
+            if _end == -1 or _end[0] & 0xE3 != 0xC1:
+                return -1
+            _unused = (_end[0] >> 2) & 0x07 # Bytes of the last segment that are not data
+            if _unused:
+                del _data[-_unused:]
+            self._send(bytes((0xA1,)) + bytes(7))
+            return bytes(_data[:_size] if _size is not None else _data)
+
+    # =====DOWNLOAD=====
+
+    def download(self, index, subindex, data):
+        """
+        Writes an object with an expedited (up to 4 bytes) or segmented download
+
+        :return -1 if an ERROR occurs
+        :return 1 if the object was written
+        """
+        data = bytes(data)
+        with self._lock:
+            if len(data) <= 4:
+                _cmd = 0x23 | (4 - len(data)) << 2
+                _res = self._request(bytes((_cmd,)) + self._mux(index, subindex) + data.ljust(4, b'\0'))
+                return _res if _res == -1 else 1
+
+            _res = self._request(bytes((0x21,)) + self._mux(index, subindex) + len(data).to_bytes(4, 'little'))
+            if _res == -1:
+                return -1
+            _toggle = 0
+            for i in range(0, len(data), 7):
+                _part = data[i:i + 7]
+                _last = i + 7 >= len(data)
+                _cmd = _toggle | (7 - len(_part)) << 1 | _last
+                if self._request(bytes((_cmd,)) + _part.ljust(7, b'\0')) == -1:
+                    return -1
+                _toggle ^= 0x10
+            return 1
+
+    def block_download(self, index, subindex, data):
+        """
+        Writes an object with a block download. All segments of a block go out in as few serial
+        writes as max_batch allows, and only one acknowledgement per block is waited for.
+
+        :return -1 if an ERROR occurs
+        :return 1 if the object was written
+        """
+        data = bytes(data)
+        with self._lock:
+            _res = self._request(bytes((0xC2,)) + self._mux(index, subindex) + len(data).to_bytes(4, 'little'))
+            if _res == -1:
+                return -1
+            _block_size = _res[4] or 1
+
+            _segments = [data[i:i + 7] for i in range(0, len(data), 7)] or [b'']
+            _pos = 0
+            while _pos < len(_segments):
+                _block = _segments[_pos:_pos + _block_size]
+                _frames = []
+                for _seq, _part in enumerate(_block, 1):
+                    _last = 0x80 if _pos + _seq == len(_segments) else 0
+                    _frames.append(self._frame(bytes((_last | _seq,)) + _part.ljust(7, b'\0')))
+                for i in range(0, len(_frames), self.max_batch):
+                    if self.network.pcan.transmit_frames(_frames[i:i + self.max_batch]) == -1:
+                        return -1
+                _ack = self._receive()
+                if _ack == -1 or _ack[0] & 0xE3 != 0xA2:
+                    return -1
+                _pos += _ack[1] # Segments acknowledged, the rest of the block is resent
+                _block_size = _ack[2] or _block_size
+
+            _unused = 7 - len(_segments[-1])
+            _res = self._request(bytes((0xC1 | _unused << 2,)) + bytes(7))
+            return _res if _res == -1 else 1
+
+    # =====UTILITY=====
+
+    def _request(self, payload):
+        """
+        Sends a request and waits for the server response
+
+        :return -1 if an ERROR occurs (timeout or abort)
+        :return the response payload
+        """
+        self._drain()
+        if self._send(payload) == -1:
+            return -1
+        return self._receive()
+
+    def _send(self, payload):
+        return self.network.pcan.transmit_frames([self._frame(payload)])
+
+    def _receive(self):
+        try:
+            _res = self._responses.get(timeout=self.timeout)
+        except Empty:
+            return -1
+        if _res[0] == SDO_ABORT:
+            self.last_abort_code = int.from_bytes(_res[4:8], 'little')
+            return -1
+        return _res
+
+    def _abort(self, index, subindex, code):
+        self._send(bytes((SDO_ABORT,)) + self._mux(index, subindex) + code.to_bytes(4, 'little'))
+
+    def _drain(self):
+        while not self._responses.empty():
+            try: self._responses.get_nowait()
+            except Empty: break
+
+    def _frame(self, payload):
+        return CanFrame(COB_SDO_RX + self.node_id, False, False, 8, payload.ljust(8, b'\0'))
+
+    @staticmethod
+    def _mux(index, subindex):
+        return bytes((index & 0xFF, index >> 8, subindex))
+
+
+class CANopen:
+    """
+    CANopen master functions on top of a PCAN_RS_232.
+
+    Frames from the PCAN receiver thread are routed by COB-ID: SDO responses to the SDO client of
+    the node, heartbeats and emergencies to the node monitor, and TPDOs to a decoder precompiled
+    from the node's EDS mapping (see compile_pdo()). The latest PDO values are kept in pdo_values.
+
+    Example:
+        canopen = CANopen(pcan)
+        drive = canopen.add_node(5, 'drive.eds')
+        drive.block_download(0x1F50, 1, parameter_file)
+        canopen.nmt(NMT_START)
+    """
+
+    def __init__(self, pcan, emergency_history=64):
+        """
+        :param pcan the PCAN_RS_232 to use. Its receiver thread is started if needed.
+        :param emergency_history the number of emergency messages kept per node
+        """
+        self.pcan = pcan
+        self.emergency_history = emergency_history
+        self.sdo = {}           # node ID -> SDOClient
+        self.heartbeats = {}    # node ID -> (NMT state, time.monotonic() of the last heartbeat)
+        self.emergencies = {}   # node ID -> deque of EmergencyMessage
+        self.pdo_values = {}    # COB-ID -> dict of name -> latest value
+        self._pdos = {}         # COB-ID -> (node ID, compiled decoder)
+        self._pdo_listeners = []
+        self._emcy_listeners = []
+        self.pcan.add_listener(self._on_frames)
+        self.pcan.start_receiver()
+
+    def add_node(self, node_id, eds=None, **kwargs):
+        """
+        Adds a node to the network. See SDOClient for the keyword arguments.
+
+        :param eds the EDS file (or ObjectDictionary) describing the node, used for PDO decoding
+
+        :return the SDOClient of the node
+        """
+        _client = SDOClient(self, node_id, **kwargs)
+        _sdo = dict(self.sdo) # Copy on write for the receiver thread
+        _sdo[node_id] = _client
+        self.sdo = _sdo
+        if eds is not None:
+            _od = eds if isinstance(eds, ObjectDictionary) else ObjectDictionary(eds, node_id)
+            for _cob_id, _mapping in _od.tpdos.items():
+                self.add_pdo(_cob_id, _mapping, node_id)
+        return _client
+
+    def add_pdo(self, cob_id, mapping, node_id=0):
+        """
+        Adds a PDO decoder
+
+        :param cob_id the COB-ID the PDO is received on
+        :param mapping a list of (name, data type, length in bits) in mapping order
+        """
+        _pdos = dict(self._pdos) # Copy on write for the receiver thread
+        _pdos[cob_id] = (node_id, compile_pdo(mapping))
+        self._pdos = _pdos
+
+    def add_pdo_listener(self, callback):
+        """
+        :param callback called from the receiver thread with a list of PDOMessage objects
+        """
+        self._pdo_listeners = self._pdo_listeners + [callback]
+
+    def add_emergency_listener(self, callback):
+        """
+        :param callback called from the receiver thread with each EmergencyMessage
+        """
+        self._emcy_listeners = self._emcy_listeners + [callback]
+
+    def close(self):
+        self.pcan.remove_listener(self._on_frames)
+
+    # =====NMT=====
+
+    def nmt(self, command, node_id=0):
+        """
+        Sends an NMT command
+
+        :param command NMT_START, NMT_STOP, NMT_PRE_OPERATIONAL, NMT_RESET_NODE or NMT_RESET_COMMUNICATION
+        :param node_id the target node, 0 for all nodes
+
+        :return -1 if an ERROR occurs
+        :return 1 if the command was sent
+        """
+        return self.pcan.transmit_frames([CanFrame(COB_NMT, False, False, 2, bytes((command, node_id)))])
+
+    def missing_nodes(self, timeout):
+        """
+        :param timeout seconds without a heartbeat after which a node is considered missing
+
+        :return a list of the node IDs that have sent heartbeats before but not within timeout
+        """
+        _limit = time.monotonic() - timeout
+        return [n for n, (_state, _seen) in self.heartbeats.items() if _seen < _limit]
+
+    # =====RECEIVE=====
+
+    def _on_frames(self, frames):
+        _pdos = self._pdos
+        _pdo_messages = []
+        for _frame in frames:
+            if _frame.ext or _frame.rtr:
+                continue
+            _id = _frame.id
+            _pdo = _pdos.get(_id)
+            if _pdo is not None:
+                _values = dict(zip(_pdo[1].names, _pdo[1](_frame.data)))
+                self.pdo_values[_id] = _values
+                _pdo_messages.append(PDOMessage(_id, _pdo[0], _values, _frame.timestamp))
+                continue
+            _function, _node = _id & 0x780, _id & 0x7F
+            if _function == COB_SDO_TX:
+                _client = self.sdo.get(_node)
+                if _client is not None:
+                    _client._responses.put(_frame.data)
+            elif _function == COB_HEARTBEAT and _frame.data:
+                self.heartbeats[_node] = (_frame.data[0] & 0x7F, time.monotonic())
+            elif _function == COB_EMCY and _node and len(_frame.data) >= 3:
+                _emcy = EmergencyMessage(_node, _frame.data[0] | _frame.data[1] << 8, _frame.data[2], _frame.data[3:], _frame.timestamp)
+                _history = self.emergencies.get(_node)
+                if _history is None:
+                    _history = self.emergencies[_node] = deque(maxlen=self.emergency_history)
+                _history.append(_emcy)
+                for _listener in self._emcy_listeners:
+                    _listener(_emcy)
+
+        if _pdo_messages:
+            for _listener in self._pdo_listeners:
+                _listener(_pdo_messages)
@@ -0,0 +1,68 @@
+from typing import NamedTuple, Optional
+
+
+class CanFrame(NamedTuple):
+    """
+    A single CAN frame as seen on (or sent to) the bus.
+
+    :param id the CAN identifier as an int (11-bit or 29-bit)
+    :param ext True if the frame uses an extended (29-bit) identifier
+    :param rtr True if the frame is a remote transmission request
+    :param dlc the data length code (0-8)
+    :param data the frame payload as bytes (empty for RTR frames)
+    :param timestamp host reception time in seconds (time.time()), 0 if unknown
+    :param device_timestamp the PCAN millisecond timestamp (rolls over every minute), None if disabled
+    """
+    id: int
+    ext: bool = False
+    rtr: bool = False
+    dlc: int = 0
+    data: bytes = b''
+    timestamp: float = 0.0
+    device_timestamp: Optional[int] = None
+
+    @classmethod
+    def from_message(cls, msg: bytes, timestamp=0.0):
+        """
+        Parses a frame record sent from the PCAN module over the serial bus (without the trailing CR)
+        Example: b't1234DEADBEEF'     - standard (11-bit) identifier message frame
+                 b'R123456784'        - extended (29-bit) identifier request frame
+                 b't1234DEADBEEF4D67' - standard message frame with a device timestamp appended
+
+        :param msg the raw frame record as bytes
+        :param timestamp the host reception time to attach to the frame
+
+        :return the parsed CanFrame
+        :raise ValueError if the record is not a valid frame
+        """
+        _type = msg[0]                      # 't', 'T', 'r' or 'R' as an int
+        _ext = _type == 84 or _type == 82   # 'T' or 'R'
+        _rtr = _type == 114 or _type == 82  # 'r' or 'R'
+        _n = 9 if _ext else 4               # Index of the DLC character
+        if len(msg) <= _n:
+            raise ValueError("Truncated frame record: {}".format(msg))
+        _id = int(msg[1:_n], 16)
+        _dlc = msg[_n] - 48                 # ASCII digit to int
+        if not 0 <= _dlc <= 8:
+            raise ValueError("Invalid DLC in frame record: {}".format(msg))
+        _end = _n + 1 if _rtr else _n + 1 + _dlc * 2
+        _data = b'' if _rtr else bytes.fromhex(msg[_n + 1:_end].decode('ascii'))
+        if len(_data) != _dlc and not _rtr:
+            raise ValueError("Frame record has {} data bytes for DLC {}: {}".format(len(_data), _dlc, msg))
+        _ts = int(msg[_end:_end + 4], 16) if len(msg) >= _end + 4 else None # Optional device timestamp
+        return cls(_id, _ext, _rtr, _dlc, _data, timestamp, _ts)
+
+    def to_message(self):
+        """
+        Encodes the frame as a PCAN transmit command
+
+        :return the UTF-8 encoded command, including the trailing CR
+        """
+        if self.ext:
+            _head = b'R%08X%d' if self.rtr else b'T%08X%d'
+        else:
+            _head = b'r%03X%d' if self.rtr else b't%03X%d'
+        _msg = _head % (self.id, self.dlc)
+        if not self.rtr:
+            _msg += self.data[:self.dlc].hex().upper().encode('ascii')
+        return _msg + b'\r'
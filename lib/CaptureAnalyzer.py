@@ -0,0 +1,383 @@
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+from lib.CaptureFile import list_segments, read_segment_info
+from lib.DBCDecoder import DBCDecoder
+from lib.FrameArray import FLAG_EXT, FLAG_RTR, FRAME_DTYPE, np, require_numpy
+from lib.IdStats import IdStats, merge
+
+CHUNK_RECORDS = 1 << 22 # Records per chunk (~92 MB)
+
+
+class Chunk(NamedTuple):
+    """
+    A run of whole records of one capture segment
+
+    :param path the segment file
+    :param offset byte offset of the first record
+    :param count number of records
+    """
+    path: str
+    offset: int
+    count: int
+
+
+def split_chunks(path, chunk_records=CHUNK_RECORDS, prefix=''):
+    """
+    Splits capture segments into chunks aligned to record boundaries, in time order
+
+    :param path a capture segment, or a directory of segments
+    :param prefix only use the segments whose name starts with prefix (directories only)
+
+    :return a list of Chunk
+    """
+    _chunks = []
+    for _path in list_segments(path, prefix) if os.path.isdir(path) else [path]:
+        with open(_path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                continue
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as _map:
+                _info = read_segment_info(_map)
+        for _first in range(0, _info.count, chunk_records):
+            _chunks.append(Chunk(_path, _info.header_size + _first * FRAME_DTYPE.itemsize,
+                                 min(chunk_records, _info.count - _first)))
+    return _chunks
+
+
+def _group_by_id(records):
+    """
+    Groups records by (id, ext), keeping the record order within each group
+
+    :return (keys, order, starts, counts, same): the unique id | ext << 32 keys, the sorting
+            permutation, the start and length of each group in sorted order, and for every pair of
+            consecutive sorted records whether they belong to the same group
+    """
+    _keys = records['id'].astype(np.uint64) | ((records['flags'] & FLAG_EXT).astype(np.uint64) << np.uint64(32))
+    _order = np.argsort(_keys, kind='stable')
+    _sorted = _keys[_order]
+    _unique, _starts, _counts = np.unique(_sorted, return_index=True, return_counts=True)
+    return _unique, _order, _starts, _counts, _sorted[1:] == _sorted[:-1]
+
+
+def _key_id(key):
+    """
+    :return the (id, ext) of a _group_by_id() key
+    """
+    return key & 0xFFFFFFFF, bool(key >> 32)
+
+
+# =====ANALYSES=====
+
+class Analysis:
+    """
+    One analysis run by a CaptureAnalyzer, in three steps:
+
+        map(records)    computes a partial result for a chunk (a FRAME_DTYPE array), in a worker process
+        reduce(a, b)    merges the partial results of two consecutive stretches of the capture, a before b.
+                        It must be associative: partials are merged in capture order, in any grouping.
+        result(partial) turns the merged partial into the final result
+
+    Analyses are pickled into the worker processes, so they hold only plain settings; anything
+    expensive to build (e.g. a DBC decoder) is built on first use in each worker.
+    """
+
+    def map(self, records):
+        raise NotImplementedError
+
+    def reduce(self, a, b):
+        raise NotImplementedError
+
+    def result(self, partial):
+        return partial
+
+
+class IdStatistics(Analysis):
+    """
+    Per-ID counts, bytes, period, jitter, gaps, DLC and payload changes (see lib.IdStats)
+
+    result: a list of IdStats sorted by (ext, id)
+    """
+
+    def map(self, records):
+        _keys, _order, _starts, _counts, _same = _group_by_id(records)
+        _n = len(_keys)
+        _ts = records['timestamp'][_order]
+        _dlc = records['dlc'][_order].astype(np.int64)
+        _rtr = (records['flags'][_order] & FLAG_RTR) != 0
+        _group = np.repeat(np.arange(_n), _counts)
+        _bytes = np.bincount(_group, np.where(_rtr, 0, _dlc), _n)
+
+        _gap_group = _group[1:][_same]
+        _gaps = np.diff(_ts)[_same]
+        _ngaps = _counts - 1
+        _mean = np.bincount(_gap_group, _gaps, _n) / np.maximum(_ngaps, 1)
+        _m2 = np.bincount(_gap_group, (_gaps - _mean[_gap_group]) ** 2, _n)
+        _min = np.full(_n, np.inf)
+        _max = np.zeros(_n)
+        np.minimum.at(_min, _gap_group, _gaps)
+        np.maximum.at(_max, _gap_group, _gaps)
+        _changes = np.bincount(_gap_group, (_dlc[1:] != _dlc[:-1])[_same], _n)
+        _data = records['data'][_order]
+        _changed = np.zeros(_n, np.uint8)
+        np.bitwise_or.at(_changed, _gap_group, np.packbits(_data[1:] != _data[:-1], axis=1, bitorder='little')[_same, 0])
+        _ends = _starts + _counts - 1
+        _first_dlc = _dlc[_starts].tolist()
+        _last_dlc = _dlc[_ends].tolist()
+        _first_data = [b'' if r else bytes(d[:n]) for d, n, r in zip(_data[_starts], _first_dlc, _rtr[_starts].tolist())]
+        _last_data = [b'' if r else bytes(d[:n]) for d, n, r in zip(_data[_ends], _last_dlc, _rtr[_ends].tolist())]
+
+        return {_key_id(k): IdStats(*_key_id(k), count, int(nbytes), first, last, gaps, mean, m2, low, high,
+                                    first_dlc, dlc, int(changes), first_data, data, changed, rtr)
+                for k, count, nbytes, first, last, gaps, mean, m2, low, high, first_dlc, dlc, changes,
+                    first_data, data, changed, rtr in zip(
+                    _keys.tolist(), _counts.tolist(), _bytes.tolist(), _ts[_starts].tolist(), _ts[_ends].tolist(),
+                    _ngaps.tolist(), _mean.tolist(), _m2.tolist(), _min.tolist(), _max.tolist(),
+                    _first_dlc, _last_dlc, _changes.tolist(), _first_data, _last_data, _changed.tolist(),
+                    _rtr[_ends].tolist())}
+
+    def reduce(self, a, b):
+        _merged = dict(a)
+        for _key, _stats in b.items():
+            _merged[_key] = merge(_merged[_key], _stats) if _key in _merged else _stats
+        return _merged
+
+    def result(self, partial):
+        return sorted(partial.values(), key=lambda s: (s.ext, s.id))
+
+
+class _DBCAnalysis(Analysis):
+    """
+    Base of the analyses decoding signals with a DBC file, built once per worker process
+    """
+
+    def __init__(self, dbc):
+        """
+        :param dbc the DBC file path
+        """
+        self.dbc = dbc
+        self._decoder = None
+
+    def __getstate__(self):
+        _state = dict(self.__dict__)
+        _state['_decoder'] = None # Compiled closures do not pickle
+        return _state
+
+    @property
+    def decoder(self):
+        if self._decoder is None:
+            self._decoder = DBCDecoder(self.dbc)
+        return self._decoder
+
+
+class SignalExtraction(_DBCAnalysis):
+    """
+    Decodes DBC signals into columns
+
+    result: a dict of message name -> dict of NumPy columns ('timestamp' and one per signal, see DBCDecoder.decode_batch)
+    """
+
+    def __init__(self, dbc, messages=None):
+        """
+        :param messages names of the messages to keep, None for all (the columns are held in memory)
+        """
+        super().__init__(dbc)
+        self.messages = set(messages) if messages is not None else None
+
+    def map(self, records):
+        _columns = self.decoder.decode_batch(records)
+        if self.messages is not None:
+            _columns = {name: cols for name, cols in _columns.items() if name in self.messages}
+        return _columns
+
+    def reduce(self, a, b):
+        _merged = dict(a)
+        for _name, _cols in b.items():
+            _prev = _merged.get(_name)
+            _merged[_name] = _cols if _prev is None else {k: np.concatenate((_prev[k], v)) for k, v in _cols.items()}
+        return _merged
+
+
+class RangeViolation(NamedTuple):
+    """
+    Values of a signal outside its DBC [minimum, maximum] range
+
+    :param first timestamp of the first violation
+    """
+    message: str
+    signal: str
+    count: int
+    first: float
+    lowest: float
+    highest: float
+
+
+class RangeCheck(_DBCAnalysis):
+    """
+    Counts the decoded signal values outside the range declared in the DBC file (signals declaring
+    an empty range, e.g. [0|0], are not checked)
+
+    result: a list of RangeViolation
+    """
+
+    def map(self, records):
+        _violations = {}
+        _decoder = self.decoder
+        _messages = {m.name: m for m in _decoder.messages.values()}
+        for _name, _cols in _decoder.decode_batch(records).items():
+            for _signal in _messages[_name].signals:
+                if _signal.maximum <= _signal.minimum:
+                    continue
+                _values = _cols[_signal.name]
+                _bad = (_values < _signal.minimum) | (_values > _signal.maximum) # NaN (other multiplexer value) passes
+                if _bad.any():
+                    _out = _values[_bad]
+                    _violations[(_name, _signal.name)] = RangeViolation(
+                        _name, _signal.name, int(_bad.sum()), float(_cols['timestamp'][_bad][0]),
+                        float(_out.min()), float(_out.max()))
+        return _violations
+
+    def reduce(self, a, b):
+        _merged = dict(a)
+        for _key, _v in b.items():
+            _prev = _merged.get(_key)
+            _merged[_key] = _v if _prev is None else _prev._replace(
+                count=_prev.count + _v.count, lowest=min(_prev.lowest, _v.lowest), highest=max(_prev.highest, _v.highest))
+        return _merged
+
+    def result(self, partial):
+        return sorted(partial.values(), key=lambda v: v.first)
+
+
+class PeriodViolation(NamedTuple):
+    """
+    A gap between two frames of a cyclic ID longer than allowed
+
+    :param previous timestamp of the frame before the gap
+    :param next timestamp of the frame after the gap
+    """
+    id: int
+    ext: bool
+    previous: float
+    next: float
+
+    @property
+    def gap(self):
+        return self.next - self.previous
+
+
+class PeriodCheck(Analysis):
+    """
+    Finds the gaps longer than allowed between frames of cyclic IDs (missing or late messages)
+
+    result: a list of PeriodViolation in capture order of each ID
+    """
+
+    def __init__(self, limits):
+        """
+        :param limits a dict of (id, ext) -> largest allowed gap in seconds
+        """
+        self.limits = dict(limits)
+
+    def map(self, records):
+        _keys, _order, _starts, _counts, _same = _group_by_id(records)
+        _ts = records['timestamp'][_order]
+        _edges = {}         # (id, ext) -> (first, last) timestamps, to check the gaps across chunks
+        _violations = []
+        for _key, _start, _count in zip(_keys.tolist(), _starts.tolist(), _counts.tolist()):
+            _id = _key_id(_key)
+            _limit = self.limits.get(_id)
+            if _limit is None:
+                continue
+            _times = _ts[_start:_start + _count]
+            _edges[_id] = (float(_times[0]), float(_times[-1]))
+            for i in np.nonzero(np.diff(_times) > _limit)[0].tolist():
+                _violations.append(PeriodViolation(_id[0], _id[1], float(_times[i]), float(_times[i + 1])))
+        return _edges, _violations
+
+    def reduce(self, a, b):
+        _edges = dict(a[0])
+        _violations = list(a[1])
+        for _id, (_first, _last) in b[0].items():
+            _prev = _edges.get(_id)
+            if _prev is not None and _first - _prev[1] > self.limits[_id]:
+                _violations.append(PeriodViolation(_id[0], _id[1], _prev[1], _first))
+            _edges[_id] = (_prev[0] if _prev is not None else _first, _last)
+        _violations.extend(b[1])
+        return _edges, _violations
+
+    def result(self, partial):
+        return sorted(partial[1], key=lambda v: (v.ext, v.id, v.previous))
+
+
+# =====RUNNER=====
+
+_worker_analyses = None # Analyses of a worker process, sent once by the pool initializer
+
+
+def _init_worker(analyses):
+    global _worker_analyses
+    _worker_analyses = analyses
+
+
+def _analyze_chunk(chunk, analyses=None):
+    """
+    :return the partial results of every analysis for one chunk
+    """
+    _records = np.memmap(chunk.path, FRAME_DTYPE, 'r', chunk.offset, (chunk.count,))
+    try:
+        return [a.map(_records) for a in (analyses if analyses is not None else _worker_analyses)]
+    finally:
+        del _records
+
+
+class CaptureAnalyzer:
+    """
+    Runs analyses over large captures on all CPU cores.
+
+    The capture segments are split into chunks of whole records; every chunk is memory-mapped and
+    analyzed in a worker process, and the partial results are merged in capture order with each
+    analysis' associative reduce() as they come in, so the memory used does not grow with the
+    capture size (except for what an analysis keeps, e.g. extracted signal columns).
+
+    Example:
+        analyzer = CaptureAnalyzer([IdStatistics(), PeriodCheck({(0x100, False): 0.015}), RangeCheck('car.dbc')])
+        stats, late, out_of_range = analyzer.run('logs')
+    """
+
+    def __init__(self, analyses, processes=None, chunk_records=CHUNK_RECORDS):
+        """
+        :param analyses a list of Analysis objects
+        :param processes number of worker processes, None for one per CPU, 1 to run in this process
+        :param chunk_records records per chunk
+        """
+        require_numpy()
+        self.analyses = list(analyses)
+        self.processes = processes if processes is not None else os.cpu_count() or 1
+        self.chunk_records = chunk_records
+
+    def run(self, path, prefix=''):
+        """
+        :param path a capture segment, or a directory of segments
+        :param prefix only use the segments whose name starts with prefix (directories only)
+
+        :return the result of every analysis, in the order of the analyses
+        """
+        _chunks = split_chunks(path, self.chunk_records, prefix)
+        _merged = None
+        if self.processes == 1 or len(_chunks) < 2:
+            for _chunk in _chunks:
+                _merged = self._reduce(_merged, _analyze_chunk(_chunk, self.analyses))
+        else:
+            with ProcessPoolExecutor(min(self.processes, len(_chunks)), initializer=_init_worker,
+                                     initargs=(self.analyses,)) as _pool:
+                for _partials in _pool.map(_analyze_chunk, _chunks): # In chunk order
+                    _merged = self._reduce(_merged, _partials)
+        if _merged is None: # Empty capture
+            _merged = [a.map(np.zeros(0, FRAME_DTYPE)) for a in self.analyses]
+        return [a.result(p) for a, p in zip(self.analyses, _merged)]
+
+    def _reduce(self, merged, partials):
+        if merged is None:
+            return partials
+        return [a.reduce(m, p) for a, m, p in zip(self.analyses, merged, partials)]
@@ -0,0 +1,83 @@
+import json
+import os
+import struct
+from typing import NamedTuple
+from lib.FrameArray import RECORD_SIZE
+
+# Capture segment layout:
+#   header  HEADER struct, then the metadata as UTF-8 JSON, padded to a multiple of 8 bytes (header_size)
+#   records fixed-width frame records (see lib.FrameArray), RECORD_SIZE bytes each
+#   footer  FOOTER struct, written when the segment is closed. A segment without a footer
+#           (e.g. after a power cut) is still readable: its complete records are used.
+MAGIC           = b'PCANCAP1'
+FOOTER_MAGIC    = b'PCANEND1'
+VERSION         = 1
+EXTENSION       = '.cap'
+HEADER = struct.Struct('<8sHHHHd')  # magic, version, header size, record size, reserved, start time
+FOOTER = struct.Struct('<8sQddd')   # magic, record count, first timestamp, last timestamp, close time
+
+
+class SegmentInfo(NamedTuple):
+    """
+    Layout of a capture segment, as found by read_segment_info()
+
+    :param header_size offset of the first record
+    :param count number of complete records
+    :param start time the segment was opened
+    :param metadata the metadata dict written with the segment (serial number, bitrate, filters...)
+    :param closed True if the segment has a footer (it was closed cleanly)
+    """
+    header_size: int
+    count: int
+    start: float
+    metadata: dict
+    closed: bool
+
+
+def pack_header(start, metadata):
+    """
+    :return the header bytes of a segment opened at start with the given metadata dict
+    """
+    _meta = json.dumps(metadata, sort_keys=True).encode('utf-8')
+    _size = (HEADER.size + len(_meta) + 7) & ~7
+    return HEADER.pack(MAGIC, VERSION, _size, RECORD_SIZE, 0, start) + _meta.ljust(_size - HEADER.size, b' ')
+
+
+def pack_footer(count, first, last, closed):
+    return FOOTER.pack(FOOTER_MAGIC, count, first, last, closed)
+
+
+def read_segment_info(buffer):
+    """
+    Reads the header and footer of a segment
+
+    :param buffer the segment contents, e.g. bytes or an mmap
+
+    :return the SegmentInfo
+    :raise ValueError if the buffer is not a capture segment
+    """
+    if len(buffer) < HEADER.size:
+        raise ValueError("Not a capture segment (too short)")
+    _magic, _version, _header_size, _record_size, _, _start = HEADER.unpack_from(buffer, 0)
+    if _magic != MAGIC:
+        raise ValueError("Not a capture segment (bad magic)")
+    if _version != VERSION or _record_size != RECORD_SIZE:
+        raise ValueError("Unsupported capture segment version {}".format(_version))
+    if len(buffer) < _header_size:
+        raise ValueError("Truncated capture segment header")
+    _metadata = json.loads(bytes(buffer[HEADER.size:_header_size]).decode('utf-8'))
+
+    _body = len(buffer) - _header_size
+    if _body >= FOOTER.size and (_body - FOOTER.size) % RECORD_SIZE == 0:
+        _magic, _count, _first, _last, _closed = FOOTER.unpack_from(buffer, len(buffer) - FOOTER.size)
+        if _magic == FOOTER_MAGIC and _count == (_body - FOOTER.size) // RECORD_SIZE:
+            return SegmentInfo(_header_size, _count, _start, _metadata, True)
+    return SegmentInfo(_header_size, _body // RECORD_SIZE, _start, _metadata, False) # Partial last record ignored
+
+
+def list_segments(directory, prefix=''):
+    """
+    :return the paths of the capture segments in directory whose name starts with prefix, in name (= time) order
+    """
+    return [os.path.join(directory, _name) for _name in sorted(os.listdir(directory))
+            if _name.startswith(prefix) and _name.endswith(EXTENSION)]
@@ -0,0 +1,320 @@
+import json
+import os
+from typing import NamedTuple
+from lib.CaptureFile import list_segments
+from lib.CaptureReader import BLOCK_SIZE, BITMAP_BITS, CaptureSegment, id_bit
+from lib.FrameArray import FLAG_EXT, FRAME_DTYPE, array_to_frames, np, require_numpy
+from lib.FrameFilter import EXT_MASK, STD_MASK, FrameFilter
+
+# Catalog file kept in a capture directory: for every segment its size, modification time,
+# record count, first and last timestamp and an ID summary (the OR of its block ID bitmaps, see
+# lib.CaptureReader) as hex, so queries skip segments without opening them.
+CATALOG_NAME    = 'catalog.json'
+CATALOG_VERSION = 1
+CHUNK_RECORDS   = 1 << 18   # Records filtered at once when scanning without an ID list
+
+
+class SegmentEntry(NamedTuple):
+    """
+    Catalog entry of a capture segment
+
+    :param path the segment file
+    :param size file size when cataloged
+    :param mtime modification time (ns) when cataloged
+    :param count number of records
+    :param start timestamp of the first record
+    :param end timestamp of the last record
+    :param ids ID summary bitmap, BITMAP_BITS / 8 bytes
+    """
+    path: str
+    size: int
+    mtime: int
+    count: int
+    start: float
+    end: float
+    ids: bytes
+
+    def may_contain(self, id, ext=False):
+        """
+        :return False if the segment holds no frame of the ID (standard IDs are exact, extended IDs hashed)
+        """
+        _bit = id_bit(id, ext)
+        return bool(self.ids[_bit >> 3] & (0x80 >> (_bit & 7)))
+
+
+class QueryStats(NamedTuple):
+    """
+    Work done by a query
+
+    :param segments segments in the capture
+    :param segments_read segments opened, the others were skipped on their catalog entry
+    :param blocks index blocks in the time range of the segments read
+    :param blocks_read index blocks scanned, the others were skipped on their ID bitmap
+    :param records records returned
+    """
+    segments: int = 0
+    segments_read: int = 0
+    blocks: int = 0
+    blocks_read: int = 0
+    records: int = 0
+
+
+class CaptureQuery:
+    """
+    Answers queries over a directory of capture segments (see lib.CaptureFile), reading as little
+    of it as possible.
+
+    A catalog in the directory holds the time range and an ID summary of every segment, so
+    segments outside the time range or without the requested IDs are never opened. Within a
+    segment the block index (see lib.CaptureReader) bisects the time range and skips the blocks
+    whose ID bitmap does not contain the requested IDs. The remaining records are filtered with
+    NumPy: ID list, filter expression (see lib.FrameFilter) and, optionally, payload changes
+    compared with the previous frame of the same ID. The catalog is updated for new and grown
+    segments when the query is created.
+
+    Results are streamed as FRAME_DTYPE arrays, or collected into one array or CanFrame objects.
+
+    Example:
+        query = CaptureQuery('fleet/truck-17')
+        # Frames of 0x18FEF100 in the hour after t0 whose byte 2 changed
+        records = query.array(ids=[(0x18FEF100, True)], t0=t0, t1=t0 + 3600, changed=[2])
+        for records in query.select(where='std and id == 0x123 and data[0] > 0x10'):
+            ...
+        print(query.stats)
+    """
+
+    def __init__(self, path, prefix='', block_size=BLOCK_SIZE, persist_index=True):
+        """
+        :param path a capture segment, or a directory of segments
+        :param prefix only use the segments whose name starts with prefix (directories only)
+        :param block_size records per index block
+        :param persist_index True to save built segment indexes and the catalog
+        """
+        require_numpy()
+        self.path = path
+        self.block_size = block_size
+        self.persist_index = persist_index
+        self.stats = QueryStats()   # Of the last query
+        if os.path.isdir(path):
+            _paths = list_segments(path, prefix)
+            self.entries = self._update_catalog(os.path.join(path, CATALOG_NAME), _paths)
+        else:
+            self.entries = [self._catalog_segment(path)]
+        self.entries.sort(key=lambda e: e.start)
+
+    def __len__(self):
+        return sum(e.count for e in self.entries)
+
+    @property
+    def start(self):
+        return min((e.start for e in self.entries if e.count), default=None)
+
+    @property
+    def end(self):
+        return max((e.end for e in self.entries if e.count), default=None)
+
+    # =====QUERIES=====
+
+    def select(self, ids=None, t0=None, t1=None, where=None, changed=None, chunk_records=CHUNK_RECORDS):
+        """
+        Yields FRAME_DTYPE arrays of the matching records, in time order. Arrays are copies, or
+        zero-copy views of the mapped segments when no filter applies.
+
+        :param ids (id, ext) pairs, only frames of these IDs match (None for all IDs). Without ids,
+                   the exact IDs a filter expression is restricted to are used to skip segments and blocks.
+        :param t0 only records with t0 <= timestamp (None for no limit)
+        :param t1 only records with timestamp < t1 (None for no limit)
+        :param where a lib.FrameFilter or filter expression the records must match
+        :param changed byte indexes (0-7), a record matches if one of these bytes differs from the
+                       previous frame of its ID. The first frame of each ID in the time range matches,
+                       giving the starting value.
+        :param chunk_records records filtered at once when all blocks are read
+
+        :raise ValueError if the filter expression or a byte index is invalid
+        """
+        if isinstance(where, str):
+            where = FrameFilter(where)
+        if ids is None and where is not None:
+            _filters = where.id_filters()
+            if _filters and all(f.mask == (EXT_MASK if f.ext else STD_MASK) for f in _filters):
+                ids = [(f.id, f.ext) for f in _filters]
+        _keys = None if ids is None else np.array(sorted({i | (bool(e) << 32) for i, e in ids}), np.int64)
+        _byte_mask = None
+        if changed is not None:
+            if not all(0 <= b < 8 for b in changed):
+                raise ValueError("Byte indexes must be 0-7: {}".format(list(changed)))
+            _byte_mask = sum(0xFF << (8 * b) for b in set(changed))
+        return self._select(ids, _keys, t0, t1, where, _byte_mask, chunk_records)
+
+    def array(self, ids=None, t0=None, t1=None, where=None, changed=None):
+        """
+        :return a FRAME_DTYPE array of the matching records (see select())
+        """
+        _parts = list(self.select(ids, t0, t1, where, changed))
+        return np.concatenate(_parts) if _parts else np.zeros(0, FRAME_DTYPE)
+
+    def frames(self, ids=None, t0=None, t1=None, where=None, changed=None):
+        """
+        Yields the CanFrame objects of the matching records (see select())
+        """
+        for _records in self.select(ids, t0, t1, where, changed):
+            yield from array_to_frames(_records)
+
+    def _select(self, ids, keys, t0, t1, where, byte_mask, chunk_records):
+        _last = {}  # Key -> payload (uint64) of the previous frame, for the change filter
+        _segments_read = _blocks = _blocks_read = _count = 0
+        try:
+            for _entry in self.entries:
+                if not _entry.count or (t1 is not None and _entry.start >= t1) or (t0 is not None and _entry.end < t0):
+                    continue
+                if ids is not None and not any(_entry.may_contain(i, e) for i, e in ids):
+                    continue
+                _segment = CaptureSegment(_entry.path, self.block_size, self.persist_index)
+                _segments_read += 1
+                try:
+                    _begin = 0 if t0 is None else _segment.seek(t0)
+                    _end = len(_segment) if t1 is None else _segment.seek(t1)
+                    if _begin >= _end:
+                        continue
+                    _size = self.block_size
+                    _blocks += (_end - 1) // _size - _begin // _size + 1
+                    for _a, _b, _n in self._runs(_segment, ids, _begin, _end, chunk_records):
+                        _blocks_read += _n
+                        _records = _segment.records[_a:_b]
+                        _mask = None
+                        if keys is not None:
+                            _mask = np.isin(_record_keys(_records), keys)
+                            _records = _records[_mask]
+                            _mask = None
+                        if byte_mask is not None:
+                            _mask = _changed(_records, byte_mask, _last)
+                        if where is not None:
+                            _mask = where.mask(_records) if _mask is None else _mask & where.mask(_records)
+                        if _mask is not None:
+                            _records = _records[_mask]
+                        if len(_records):
+                            _count += len(_records)
+                            yield _records
+                finally:
+                    _segment.close()
+        finally:
+            self.stats = QueryStats(len(self.entries), _segments_read, _blocks, _blocks_read, _count)
+
+    def _runs(self, segment, ids, begin, end, chunk_records):
+        """
+        Yields (start, stop, blocks) record ranges of a segment to read: runs of consecutive blocks
+        that may contain the IDs, clipped to begin-end, or all of begin-end in chunks
+        """
+        _size = self.block_size
+        if ids is None:
+            for _a in range(begin, end, chunk_records):
+                _b = min(_a + chunk_records, end)
+                yield _a, _b, (_b - 1) // _size - _a // _size + 1
+            return
+        _wanted = np.unique(np.concatenate([segment.blocks_with(i, e) for i, e in ids]))
+        _wanted = _wanted[(_wanted >= begin // _size) & (_wanted <= (end - 1) // _size)]
+        if not len(_wanted):
+            return
+        _max_blocks = max(1, chunk_records // _size)
+        _breaks = np.nonzero(np.diff(_wanted) != 1)[0] + 1 # Starts of runs of consecutive blocks
+        for _run in np.split(_wanted, _breaks):
+            for i in range(0, len(_run), _max_blocks):
+                _part = _run[i:i + _max_blocks]
+                yield max(begin, int(_part[0]) * _size), min(end, (int(_part[-1]) + 1) * _size), len(_part)
+
+    # =====CATALOG=====
+
+    def _catalog_segment(self, path):
+        """
+        :return the SegmentEntry of a segment, building its block index if needed
+        """
+        _stat = os.stat(path)
+        _segment = CaptureSegment(path, self.block_size, self.persist_index)
+        try:
+            _ids = np.bitwise_or.reduce(_segment.bitmaps, axis=0) if len(_segment.bitmaps) \
+                else np.zeros(BITMAP_BITS // 8, np.uint8)
+            return SegmentEntry(path, _stat.st_size, _stat.st_mtime_ns, len(_segment), _segment.start, _segment.end,
+                                _ids.tobytes())
+        finally:
+            _segment.close()
+
+    def _update_catalog(self, catalog_path, paths):
+        """
+        :return the SegmentEntry of every segment, from the catalog file where it is up to date
+        """
+        _known = {}
+        try:
+            with open(catalog_path, 'r', encoding='utf-8') as f:
+                _catalog = json.load(f)
+            if _catalog.get('version') == CATALOG_VERSION and _catalog.get('bitmap_bits') == BITMAP_BITS:
+                _known = _catalog['segments']
+        except (OSError, ValueError, KeyError): # Missing or damaged, rebuild
+            _known = {}
+
+        _entries = []
+        _stale = False
+        for _path in paths:
+            _name = os.path.basename(_path)
+            _stat = os.stat(_path)
+            _e = _known.get(_name)
+            if _e is not None and _e['size'] == _stat.st_size and _e['mtime'] == _stat.st_mtime_ns:
+                _entries.append(SegmentEntry(_path, _e['size'], _e['mtime'], _e['count'], _e['start'], _e['end'],
+                                             bytes.fromhex(_e['ids'])))
+            else: # New or grown segment
+                _entries.append(self._catalog_segment(_path))
+                _stale = True
+        if self.persist_index and (_stale or len(_known) != len(_entries)):
+            self._save_catalog(catalog_path, _entries, _known)
+        return _entries
+
+    def _save_catalog(self, path, entries, known):
+        _segments = dict(known) # Keep the entries of segments outside the prefix
+        for _e in entries:
+            _segments[os.path.basename(_e.path)] = {'size': _e.size, 'mtime': _e.mtime, 'count': _e.count,
+                                                    'start': _e.start, 'end': _e.end, 'ids': _e.ids.hex()}
+        _directory = os.path.dirname(path)
+        _segments = {n: e for n, e in _segments.items() if os.path.exists(os.path.join(_directory, n))}
+        _tmp = path + '.tmp'
+        try:
+            with open(_tmp, 'w', encoding='utf-8') as f:
+                json.dump({'version': CATALOG_VERSION, 'bitmap_bits': BITMAP_BITS, 'segments': _segments}, f,
+                          sort_keys=True)
+            os.replace(_tmp, path) # Never leave a half written catalog behind
+        except OSError: # Read-only capture directory, keep the catalog in memory only
+            pass
+
+
+def _record_keys(records):
+    """
+    :return the (id, ext) key of each record as id | ext << 32 (int64)
+    """
+    return records['id'].astype(np.int64) | ((records['flags'] & FLAG_EXT).astype(np.int64) << 32)
+
+
+def _changed(records, byte_mask, last):
+    """
+    :param byte_mask the payload bytes compared, as a mask over the little-endian 64-bit payload
+    :param last key -> payload of the previous frame of each ID, updated with the last frames of records
+
+    :return a bool array, True for the records whose masked payload differs from the previous frame
+            of the same ID (or that are the first frame of their ID)
+    """
+    if not len(records):
+        return np.zeros(0, bool)
+    _keys = _record_keys(records)
+    _data = np.ascontiguousarray(records['data']).view('<u8').ravel()
+    _order = np.argsort(_keys, kind='stable') # Group by ID, keeping the time order within an ID
+    _keys = _keys[_order]
+    _data = _data[_order]
+    _previous = np.empty_like(_data)
+    _previous[1:] = _data[:-1]
+    _result = ((_previous ^ _data) & np.uint64(byte_mask)) != 0
+    _firsts = np.nonzero(np.concatenate(([True], _keys[1:] != _keys[:-1])))[0]
+    for i in _firsts: # First frame of an ID in this batch: compare with the previous batches
+        _p = last.get(int(_keys[i]))
+        _result[i] = _p is None or bool((_p ^ int(_data[i])) & byte_mask)
+    for i in np.append(_firsts[1:] - 1, len(_keys) - 1):
+        last[int(_keys[i])] = int(_data[i])
+    _changed = np.empty(len(records), bool)
+    _changed[_order] = _result
+    return _changed
@@ -0,0 +1,309 @@
+import mmap
+import os
+import struct
+from lib.CaptureFile import list_segments, read_segment_info
+from lib.FrameArray import FLAG_EXT, FRAME_DTYPE, array_to_frames, np, require_numpy
+
+# Index file written next to each segment (<segment>.idx):
+#   INDEX_HEADER, then the first timestamp of every block (float64), then one ID bitmap per block.
+# Bitmap bits 0-2047 are the standard IDs (exact), bits 2048-4095 a hash of the extended IDs.
+INDEX_MAGIC     = b'PCANIDX1'
+INDEX_EXTENSION = '.idx'
+INDEX_HEADER    = struct.Struct('<8sIIQ')  # magic, block size, bitmap bits, records indexed
+BITMAP_BITS     = 4096
+BLOCK_SIZE      = 4096                     # Records per index block
+
+
+def id_bits(ids, flags):
+    """
+    :return the bitmap bit of each ID (NumPy arrays of IDs and record flags)
+    """
+    _ids = ids.astype(np.uint32)
+    _hashed = 2048 + ((_ids ^ (_ids >> 11) ^ (_ids >> 22)) & 0x7FF)
+    return np.where(flags & FLAG_EXT, _hashed, _ids & 0x7FF)
+
+
+def id_bit(id, ext=False):
+    """
+    :return the bitmap bit of one ID (see id_bits())
+    """
+    return int(id_bits(np.array([id], np.uint32), np.array([FLAG_EXT if ext else 0], np.uint8))[0])
+
+
+class CaptureSegment:
+    """
+    One memory-mapped capture segment with its block index.
+
+    records is a zero-copy NumPy view (FRAME_DTYPE) of the mapped records. The index holds the
+    first timestamp of every block of block_size records and a bitmap of the IDs in each block;
+    it is mapped from <segment>.idx (nothing is read until a lookup touches it), built on first
+    use and extended when the segment has grown.
+    """
+
+    def __init__(self, path, block_size=BLOCK_SIZE, persist=True):
+        """
+        :param persist True to save a newly built index next to the segment
+        """
+        self.path = path
+        self.block_size = block_size
+        self._file = open(path, 'rb')
+        _size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if _size else b''
+        self.info = read_segment_info(self._map)
+        self.records = np.frombuffer(self._map, FRAME_DTYPE, self.info.count, self.info.header_size)
+        self.block_starts = None    # First timestamp of each block, float64
+        self.bitmaps = None         # (blocks, BITMAP_BITS / 8) uint8
+        self._index_file = None
+        self._index_map = None      # Map of the index file, when block_starts and bitmaps are views of it
+        self._load_index(persist)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def start(self):
+        return float(self.records['timestamp'][0]) if len(self.records) else self.info.start
+
+    @property
+    def end(self):
+        return float(self.records['timestamp'][-1]) if len(self.records) else self.info.start
+
+    def seek(self, t):
+        """
+        :return the index of the first record with a timestamp at or after t
+        """
+        _block = max(0, int(np.searchsorted(self.block_starts, t, 'right')) - 1) # Block that may contain t
+        _begin = _block * self.block_size
+        _end = min(_begin + self.block_size, len(self.records))
+        return _begin + int(np.searchsorted(self.records['timestamp'][_begin:_end], t, 'left'))
+
+    def blocks_with(self, id, ext):
+        """
+        :return the indexes of the blocks that may contain the ID
+        """
+        _bit = id_bit(id, ext)
+        return np.nonzero(self.bitmaps[:, _bit >> 3] & (0x80 >> (_bit & 7)))[0]
+
+    def close(self):
+        self.records = None
+        self.block_starts = None
+        self.bitmaps = None
+        self._close_index()
+        if isinstance(self._map, mmap.mmap):
+            try:
+                self._map.close()
+            except BufferError: # Views handed out are still in use, the map closes when they are released
+                pass
+        self._file.close()
+
+    # =====INDEX=====
+
+    def _load_index(self, persist):
+        _path = self.path + INDEX_EXTENSION
+        _starts, _bitmaps, _indexed = self._map_index(_path)
+        if _indexed < len(self.records): # New or grown segment, (re)index from the last partial block on
+            _first = _indexed // self.block_size
+            _new_starts, _new_bitmaps = self._build_index(_first)
+            _starts = np.concatenate((_starts[:_first], _new_starts))
+            _bitmaps = np.concatenate((_bitmaps[:_first], _new_bitmaps))
+            self._close_index()
+            if persist and self._save_index(_path, _starts, _bitmaps):
+                _starts, _bitmaps, _indexed = self._map_index(_path) # Saved copy, so the arrays are not kept in memory
+        self.block_starts = _starts
+        self.bitmaps = _bitmaps
+
+    def _map_index(self, path):
+        """
+        Maps an index file; the timestamps and bitmaps are views of the map, read on access
+
+        :return (block starts, bitmaps, records indexed), empty if the index is missing or does not fit
+        """
+        _empty = np.zeros(0, np.float64), np.zeros((0, BITMAP_BITS // 8), np.uint8), 0
+        try:
+            _file = open(path, 'rb')
+        except OSError: # Not indexed yet
+            return _empty
+        try:
+            _size = os.fstat(_file.fileno()).st_size
+            if _size < INDEX_HEADER.size:
+                raise ValueError("Index too short")
+            _map = mmap.mmap(_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError): # Damaged, rebuild
+            _file.close()
+            return _empty
+        _magic, _block_size, _bits, _indexed = INDEX_HEADER.unpack_from(_map, 0)
+        _n = -(-_indexed // self.block_size)
+        if _magic != INDEX_MAGIC or _block_size != self.block_size or _bits != BITMAP_BITS \
+                or _indexed > len(self.records) or _size < INDEX_HEADER.size + _n * (8 + BITMAP_BITS // 8):
+            _map.close()
+            _file.close()
+            return _empty
+        self._index_file = _file
+        self._index_map = _map
+        _starts = np.frombuffer(_map, np.float64, _n, INDEX_HEADER.size)
+        _bitmaps = np.frombuffer(_map, np.uint8, _n * BITMAP_BITS // 8, INDEX_HEADER.size + _n * 8)
+        return _starts, _bitmaps.reshape(_n, BITMAP_BITS // 8), _indexed
+
+    def _close_index(self):
+        if self._index_map is not None:
+            try:
+                self._index_map.close()
+            except BufferError: # Views still in use, the map closes when they are released
+                pass
+            self._index_file.close()
+            self._index_map = self._index_file = None
+
+    def _build_index(self, first_block, chunk_blocks=256):
+        _records = self.records
+        _starts = _records['timestamp'][first_block * self.block_size::self.block_size].copy()
+        _bitmaps = np.zeros((len(_starts), BITMAP_BITS // 8), np.uint8)
+        for i in range(0, len(_starts), chunk_blocks): # Chunked to bound the temporary memory
+            _begin = (first_block + i) * self.block_size
+            _chunk = _records[_begin:_begin + chunk_blocks * self.block_size]
+            _n = -(-len(_chunk) // self.block_size)
+            _keys = (np.arange(len(_chunk)) // self.block_size) * BITMAP_BITS + id_bits(_chunk['id'], _chunk['flags'])
+            _bits = np.zeros(_n * BITMAP_BITS, bool)
+            _bits[_keys] = True
+            _bitmaps[i:i + _n] = np.packbits(_bits.reshape(_n, BITMAP_BITS), axis=1)
+        return _starts, _bitmaps
+
+    def _save_index(self, path, starts, bitmaps):
+        _tmp = path + '.tmp'
+        try:
+            with open(_tmp, 'wb') as f:
+                f.write(INDEX_HEADER.pack(INDEX_MAGIC, self.block_size, BITMAP_BITS, len(self.records)))
+                f.write(starts.tobytes())
+                f.write(bitmaps.tobytes())
+            os.replace(_tmp, path) # Never leave a half written index behind
+            return True
+        except OSError: # Read-only capture directory, keep the index in memory only
+            return False
+
+
+class CaptureReader:
+    """
+    Reads capture segments (see lib.CaptureFile) through memory maps, without parsing them.
+
+    Opening only maps the files and loads their block indexes, so the cost does not depend on the
+    capture size once the indexes exist. Time lookups bisect the block index and then the
+    timestamps of one block; ID lookups only scan the blocks whose bitmap contains the ID.
+    Record arrays returned by slice() are zero-copy views of the mapped files. Timestamps are
+    assumed to be increasing (host reception time).
+
+    Example:
+        reader = CaptureReader('logs')
+        for records in reader.slice(t0, t0 + 10):       # FRAME_DTYPE views, one per segment
+            print(records['id'], records['timestamp'])
+        rpm = reader.frames_for(0x0CF00400, ext=True)   # FRAME_DTYPE array of that ID only
+    """
+
+    def __init__(self, path, prefix='', block_size=BLOCK_SIZE, persist_index=True):
+        """
+        :param path a capture segment, or a directory of segments
+        :param prefix only use the segments whose name starts with prefix (directories only)
+        :param block_size records per index block
+        :param persist_index True to save built indexes next to the segments
+        """
+        require_numpy()
+        _paths = list_segments(path, prefix) if os.path.isdir(path) else [path]
+        self.segments = [CaptureSegment(p, block_size, persist_index) for p in _paths]
+        self.segments.sort(key=lambda s: s.start)
+        self._offsets = [0]         # Global index of the first record of each segment
+        for _segment in self.segments:
+            self._offsets.append(self._offsets[-1] + len(_segment))
+        self._segment_starts = [s.start for s in self.segments]
+
+    def __len__(self):
+        return self._offsets[-1]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def metadata(self):
+        """
+        :return the metadata of the first segment (serial number, bitrate, filters...)
+        """
+        return self.segments[0].info.metadata if self.segments else {}
+
+    @property
+    def start(self):
+        return self.segments[0].start if self.segments else None
+
+    @property
+    def end(self):
+        return self.segments[-1].end if self.segments else None
+
+    def seek(self, t):
+        """
+        :return the global index of the first record with a timestamp at or after t
+        """
+        for i in range(max(0, bisect_right(self._segment_starts, t) - 1), len(self.segments)):
+            _index = self.segments[i].seek(t)
+            if _index < len(self.segments[i]):
+                return self._offsets[i] + _index
+        return len(self)
+
+    def slice(self, t0=None, t1=None):
+        """
+        :return a list of zero-copy FRAME_DTYPE views, one per segment, of the records with
+                t0 <= timestamp < t1 (None for an open end)
+        """
+        _views = []
+        for _segment in self.segments:
+            if not len(_segment) or (t1 is not None and _segment.start >= t1) or (t0 is not None and _segment.end < t0):
+                continue
+            _begin = 0 if t0 is None else _segment.seek(t0)
+            _end = len(_segment) if t1 is None else _segment.seek(t1)
+            if _begin < _end:
+                _views.append(_segment.records[_begin:_end])
+        return _views
+
+    def records(self, start, stop):
+        """
+        :return a list of zero-copy FRAME_DTYPE views of the records with global indexes start to stop
+        """
+        _views = []
+        for i, _segment in enumerate(self.segments):
+            _begin = max(start - self._offsets[i], 0)
+            _end = min(stop - self._offsets[i], len(_segment))
+            if _begin < _end:
+                _views.append(_segment.records[_begin:_end])
+        return _views
+
+    def frames_for(self, id, ext=False, t0=None, t1=None):
+        """
+        :return a FRAME_DTYPE array (a copy) of the records of one ID with t0 <= timestamp < t1,
+                only reading the index blocks that contain the ID
+        """
+        _flag = FLAG_EXT if ext else 0
+        _parts = []
+        for _segment in self.segments:
+            if not len(_segment) or (t1 is not None and _segment.start >= t1) or (t0 is not None and _segment.end < t0):
+                continue
+            _begin = 0 if t0 is None else _segment.seek(t0)
+            _end = len(_segment) if t1 is None else _segment.seek(t1)
+            _size = _segment.block_size
+            for _block in _segment.blocks_with(id, ext):
+                _a = max(_block * _size, _begin)
+                _b = min((_block + 1) * _size, _end)
+                if _a >= _b:
+                    continue
+                _records = _segment.records[_a:_b]
+                _parts.append(_records[(_records['id'] == id) & ((_records['flags'] & FLAG_EXT) == _flag)])
+        return np.concatenate(_parts) if _parts else np.zeros(0, FRAME_DTYPE)
+
+    def frames(self, t0=None, t1=None):
+        """
+        Yields the CanFrame objects of the records with t0 <= timestamp < t1
+        """
+        for _view in self.slice(t0, t1):
+            yield from array_to_frames(_view)
+
+    def close(self):
+        for _segment in self.segments:
+            _segment.close()
+        self.segments = []
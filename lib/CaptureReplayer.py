@@ -0,0 +1,174 @@
+import threading
+import time
+from array import array
+from typing import NamedTuple
+
+
+class ReplayReport(NamedTuple):
+    """
+    Timing achieved by a replay. Errors are the send time minus the scheduled time of each frame, in ms,
+    None when the frames were sent as fast as possible.
+
+    :param frames frames sent
+    :param rejected frames answered with BEL by the PCAN module
+    :param batches serial writes used
+    :param duration seconds the replay took
+    :param original_duration seconds between the first and the last frame of the capture (after filtering)
+    """
+    frames: int
+    rejected: int
+    batches: int
+    duration: float
+    original_duration: float
+    mean_error: float
+    p50_error: float
+    p99_error: float
+    max_error: float
+
+    def __str__(self):
+        _text = "Replayed {} frames in {} writes ({} rejected), {:.3f} s for {:.3f} s of capture".format(
+            self.frames, self.batches, self.rejected, self.duration, self.original_duration)
+        if self.mean_error is None:
+            return _text
+        return _text + "\nTiming error (ms): mean {:.3f}, median {:.3f}, p99 {:.3f}, max {:.3f}".format(
+            self.mean_error, self.p50_error, self.p99_error, self.max_error)
+
+
+class CaptureReplayer:
+    """
+    Re-transmits captured frames through a PCAN_RS_232 with their original timing.
+
+    Every frame gets an absolute deadline, start + (timestamp - first timestamp) / speed, so
+    scheduling errors do not accumulate. The replayer sleeps until shortly before a deadline and
+    spins for the rest, which is far more precise than sleep() alone. Frames whose deadlines fall
+    within batch_window of the first waiting frame are sent in the same serial write: the link
+    could not carry them any sooner one by one.
+
+    Example:
+        replayer = CaptureReplayer(pcan, speed=2, remap={0x100: 0x200})
+        report = replayer.replay(CaptureReader('logs').frames(t0, t0 + 60))
+        print(report)
+    """
+
+    def __init__(self, pcan, speed=1.0, filter=None, remap=None, batch_window=None, max_batch=16, spin=0.002):
+        """
+        :param pcan the PCAN_RS_232 to transmit with, its CAN channel must be open
+        :param speed replay speed factor (2 = twice as fast), 0 to send as fast as possible
+        :param filter a function taking a CanFrame and returning True to send it, None to send all
+        :param remap a dict of captured ID -> transmitted ID, or a function taking and returning a CanFrame
+        :param batch_window seconds of deadlines sent in one write, None for the serial time of one frame
+        :param max_batch largest number of frames in one write (keep within the PCAN transmit FIFO)
+        :param spin seconds before a deadline at which sleeping stops and spinning starts
+        """
+        self.pcan = pcan
+        self.speed = speed
+        self.filter = filter
+        self.remap = remap
+        self.batch_window = batch_window if batch_window is not None else 22 * 10 / pcan.baudrate # ~22 chars per frame
+        self.max_batch = max_batch
+        self.spin = spin
+        self._stop = threading.Event()
+
+    def stop(self):
+        """
+        Stops a running replay() after the current write
+        """
+        self._stop.set()
+
+    def replay(self, frames):
+        """
+        Transmits frames, blocking until done or stopped
+
+        :param frames an iterable of CanFrame objects in timestamp order, e.g. CaptureReader.frames()
+
+        :return the ReplayReport
+        """
+        self._stop.clear()
+        if not self.pcan.receiver_alive: # Keeps received frames from being mistaken for transmit replies
+            self.pcan.start_receiver()
+        _frames = self._prepare(frames)
+        _errors = array('d')
+        _sent = _rejected = _batches = 0
+        _first_ts = _last_ts = None
+        _clock = time.perf_counter
+        _start = None
+        _pending = None # Frame read ahead that did not fit in the previous batch
+
+        while not self._stop.is_set():
+            _frame = _pending if _pending is not None else next(_frames, None)
+            _pending = None
+            if _frame is None:
+                break
+            if _start is None:
+                _first_ts = _frame.timestamp
+                _start = _clock() + 0.01 # Small lead so the first deadline is not already late
+            _deadline = self._deadline(_start, _first_ts, _frame.timestamp)
+
+            # Collect the frames due within the batch window of the first one
+            _batch = [_frame]
+            _deadlines = [_deadline]
+            while len(_batch) < self.max_batch:
+                _next = next(_frames, None)
+                if _next is None:
+                    break
+                _next_deadline = self._deadline(_start, _first_ts, _next.timestamp)
+                if _next_deadline - _deadline > self.batch_window:
+                    _pending = _next
+                    break
+                _batch.append(_next)
+                _deadlines.append(_next_deadline)
+            _last_ts = _batch[-1].timestamp
+
+            self._wait_until(_deadline)
+            _now = _clock()
+            _replies = self.pcan.send_messages([f.to_message() for f in _batch])
+            if self.speed:
+                _errors.extend((_now - d) * 1000 for d in _deadlines)
+            _rejected += _replies.count(-1)
+            _sent += len(_batch) - _replies.count(-1)
+            _batches += 1
+
+        _duration = _clock() - _start if _start is not None else 0.0
+        return self._report(_sent, _rejected, _batches, _duration,
+                            (_last_ts - _first_ts) if _first_ts is not None else 0.0, _errors)
+
+    def _prepare(self, frames):
+        """
+        Applies the filter and the ID remapping
+        """
+        _filter = self.filter
+        _remap = self.remap
+        for _frame in frames:
+            if _filter is not None and not _filter(_frame):
+                continue
+            if isinstance(_remap, dict):
+                _id = _remap.get(_frame.id)
+                if _id is not None:
+                    _frame = _frame._replace(id=_id, ext=_frame.ext or _id > 0x7FF)
+            elif _remap is not None:
+                _frame = _remap(_frame)
+            yield _frame
+
+    def _deadline(self, start, first_ts, ts):
+        return start + (ts - first_ts) / self.speed if self.speed else start
+
+    def _wait_until(self, deadline):
+        """
+        Sleeps until spin seconds before the deadline, then spins until it
+        """
+        _clock = time.perf_counter
+        _remaining = deadline - _clock()
+        if _remaining > self.spin:
+            self._stop.wait(_remaining - self.spin)
+        while _clock() < deadline and not self._stop.is_set():
+            pass
+
+    @staticmethod
+    def _report(sent, rejected, batches, duration, original_duration, errors):
+        if not errors:
+            return ReplayReport(sent, rejected, batches, duration, original_duration, None, None, None, None)
+        _sorted = sorted(errors)
+        _n = len(_sorted)
+        return ReplayReport(sent, rejected, batches, duration, original_duration,
+                            sum(_sorted) / _n, _sorted[_n // 2], _sorted[min(_n - 1, int(_n * 0.99))],
+                            max(abs(_sorted[0]), abs(_sorted[-1])))
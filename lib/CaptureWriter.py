@@ -0,0 +1,210 @@
+import os
+import threading
+import time
+from lib.CaptureFile import EXTENSION, pack_footer, pack_header
+from lib.FrameArray import RECORD, RECORD_SIZE
+
+
+def device_metadata(pcan, **extra):
+    """
+    Collects the adapter information stored in capture headers
+
+    :param pcan the PCAN_RS_232 the frames are captured from
+    :param extra further settings to record, e.g. bitrate='500k', acceptance_code='00000000'
+
+    :return the metadata dict
+    """
+    _metadata = {'port': pcan.port, 'uart_baudrate': pcan.baudrate}
+    _sn = pcan.get_serial_number()
+    if _sn != -1:
+        _metadata['serial_number'] = _sn
+    _version = pcan.get_version_info()
+    if _version != -1:
+        _metadata['hardware_version'], _metadata['software_version'] = _version
+    _metadata.update(extra)
+    return _metadata
+
+
+class CaptureWriter:
+    """
+    Records frames into rotating binary capture segments (see lib.CaptureFile).
+
+    Frames are packed into a write buffer as fixed-width records and written when the buffer is
+    full; every fsync_interval seconds the buffer is written and fsync()ed, so at most that much
+    traffic is lost on a power cut. A segment is closed (footer written) and the next one started
+    when it reaches max_bytes or max_seconds. write() takes a list of frames, so the writer can be
+    registered directly as a PCAN_RS_232 listener.
+
+    Example:
+        writer = CaptureWriter('logs', metadata=device_metadata(pcan, bitrate='500k'))
+        pcan.add_listener(writer.write)
+        pcan.start_receiver()
+        ...
+        writer.close()
+    """
+
+    def __init__(self, directory, prefix='capture', max_bytes=256 << 20, max_seconds=3600, metadata=None,
+                 fsync_interval=1.0, buffer_size=1 << 20):
+        """
+        :param directory the directory the segments are written to, created if needed
+        :param prefix the start of the segment file names, followed by the open time and a sequence number
+        :param max_bytes segment size after which a new segment is started, 0 for no limit
+        :param max_seconds segment duration after which a new segment is started, 0 for no limit
+        :param metadata dict stored in every segment header (see device_metadata())
+        :param fsync_interval seconds between forced writes to disk, 0 to only fsync when a segment is closed
+        :param buffer_size bytes of records buffered between writes
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.metadata = dict(metadata or {})
+        self.fsync_interval = fsync_interval
+        self.segments = []          # Paths of the segments written so far
+        self.count = 0              # Frames written to all segments
+
+        self._buffer = bytearray(buffer_size - buffer_size % RECORD_SIZE or RECORD_SIZE)
+        self._length = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._sequence = 0
+        self._closed = False
+        os.makedirs(directory, exist_ok=True)
+
+        # Periodic flush, so frames reach the disk even when traffic stops
+        self._flush_event = threading.Event()
+        self._flush_thread = None
+        if fsync_interval:
+            self._flush_thread = threading.Thread(target=self._flusher, name='capture-fsync', daemon=True)
+            self._flush_thread.start()
+
+    def write(self, frames):
+        """
+        Appends frames to the current segment
+
+        :param frames a list of CanFrame objects
+        """
+        _pack_into = RECORD.pack_into
+        with self._lock:
+            if self._closed:
+                return
+            if self._file is None or self._segment_full():
+                self._rotate()
+            _buffer = self._buffer
+            _capacity = len(_buffer)
+            _length = self._length
+            for _f in frames:
+                if _length == _capacity:
+                    self._length = _length
+                    self._write_buffer()
+                    _length = 0
+                _pack_into(_buffer, _length, _f.timestamp, _f.id, _f.ext | _f.rtr << 1, _f.dlc, _f.data)
+                _length += RECORD_SIZE
+                if self._first is None:
+                    self._first = _f.timestamp
+                self._last = _f.timestamp
+            self._length = _length
+            self._segment_count += len(frames)
+            self.count += len(frames)
+
+    def write_records(self, records):
+        """
+        Appends packed frame records (e.g. from FrameRing.records()) to the current segment, without unpacking them
+
+        :param records a bytes-like object holding whole records
+        """
+        _count = len(records) // RECORD_SIZE
+        if not _count:
+            return
+        with self._lock:
+            if self._closed:
+                return
+            if self._file is None or self._segment_full():
+                self._rotate()
+            self._write_buffer()
+            self._file.write(records)
+            self._segment_bytes += _count * RECORD_SIZE
+            if self._first is None:
+                self._first = RECORD.unpack_from(records, 0)[0]
+            self._last = RECORD.unpack_from(records, (_count - 1) * RECORD_SIZE)[0]
+            self._segment_count += _count
+            self.count += _count
+
+    def flush(self, sync=True):
+        """
+        Writes the buffered records to the current segment and optionally fsyncs it
+        """
+        with self._lock:
+            if self._file is not None:
+                self._write_buffer()
+                self._file.flush()
+                if sync:
+                    os.fsync(self._file.fileno())
+
+    def rotate(self):
+        """
+        Closes the current segment and starts a new one
+        """
+        with self._lock:
+            self._rotate()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._close_segment()
+        self._flush_event.set()
+        if self._flush_thread is not None:
+            self._flush_thread.join()
+
+    # =====SEGMENTS=====
+
+    def _segment_full(self):
+        _bytes = self._segment_bytes + self._length
+        return (self.max_bytes and _bytes >= self.max_bytes) or \
+               (self.max_seconds and time.time() - self._segment_start >= self.max_seconds)
+
+    def _rotate(self):
+        self._close_segment()
+        self._segment_start = time.time()
+        _name = "{}-{}-{:04d}{}".format(self.prefix, time.strftime('%Y%m%d-%H%M%S', time.localtime(self._segment_start)),
+                                        self._sequence, EXTENSION)
+        self._sequence += 1
+        _path = os.path.join(self.directory, _name)
+        self._file = open(_path, 'wb')
+        _header = pack_header(self._segment_start, dict(self.metadata, segment=self._sequence - 1))
+        self._file.write(_header)
+        self._file.flush()
+        os.fsync(self._file.fileno()) # The header is durable before any record is
+        self._segment_bytes = len(_header)
+        self._segment_count = 0
+        self._first = None
+        self._last = None
+        self.segments.append(_path)
+
+    def _close_segment(self):
+        if self._file is None:
+            return
+        self._write_buffer()
+        self._file.write(pack_footer(self._segment_count, self._first or 0.0, self._last or 0.0, time.time()))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+
+    def _write_buffer(self):
+        if self._length:
+            self._file.write(memoryview(self._buffer)[:self._length])
+            self._segment_bytes += self._length
+            self._length = 0
+
+    def _flusher(self):
+        while not self._flush_event.wait(self.fsync_interval):
+            with self._lock:
+                if self._file is None:
+                    continue
+                if self._segment_full(): # Time based rotation also happens while the bus is quiet
+                    self._rotate()
+                    continue
+                self._write_buffer()
+                self._file.flush()
+                os.fsync(self._file.fileno())
@@ -0,0 +1,548 @@
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import NamedTuple
+from lib.FrameArray import FLAG_EXT, FLAG_RTR, FRAME_DTYPE, array_to_frames, frames_to_array, np, require_numpy
+
+try:
+    import zstandard
+except ImportError: # zstd is optional, zlib is always available
+    zstandard = None
+
+# Columnar capture layout:
+#   header  HEADER struct, then the metadata as UTF-8 JSON, padded to a multiple of 8 bytes (header_size)
+#   chunks  CHUNK struct, a COLUMN struct per column (COLUMNS order), then the column data
+#   footer  an INDEX_ENTRY per chunk, then the FOOTER struct, written when the file is closed. A file
+#           without a footer (e.g. after a power cut) is still readable: its complete chunks are found
+#           by walking the chunk headers.
+#
+# Columns of a chunk of n records:
+#   time    timestamp ticks (resolution seconds) since the chunk's first timestamp, as zigzag varint deltas
+#   ids     dictionary of the distinct IDs, uint32 with bit 31 set for extended IDs, ascending
+#   index   dictionary index of each record, uint8, uint16 or uint32 (the column width)
+#   dlc     DLCs, two per byte (first record in the low nibble)
+#   rtr     remote request flags, one bit per record (np.packbits order)
+#   data    the 8 payload bytes of every record (0 beyond the DLC) grouped by ID in time order, as differences
+#           to the previous record (mod 256) stored in byte planes: byte 0 of every record, then byte 1...
+MAGIC           = b'PCANCOL1'
+CHUNK_MAGIC     = b'CHNK'
+FOOTER_MAGIC    = b'PCOLEND1'
+VERSION         = 1
+EXTENSION       = '.ccap'
+HEADER      = struct.Struct('<8sHHdd')  # magic, version, header size, start time, timestamp resolution (s)
+CHUNK       = struct.Struct('<4sIIdd')  # magic, record count, size of the column table and data, first and last timestamp
+COLUMN      = struct.Struct('<BBII')    # codec, width, raw size, stored size
+INDEX_ENTRY = struct.Struct('<QIdd')    # chunk offset, record count, first and last timestamp
+FOOTER      = struct.Struct('<8sQQ')    # magic, offset of the index, chunk count
+
+COLUMNS         = ('time', 'ids', 'index', 'dlc', 'rtr', 'data')
+CODECS          = {'none': 0, 'zlib': 1, 'zstd': 2}
+CHUNK_RECORDS   = 1 << 16
+EXT_BIT         = 0x80000000
+
+# Columns needed to decode each FRAME_DTYPE field
+_FIELD_COLUMNS = {'timestamp': ('time',), 'id': ('ids', 'index'), 'flags': ('ids', 'index', 'rtr'),
+                  'dlc': ('dlc',), 'data': ('index', 'data')}
+
+
+class ChunkInfo(NamedTuple):
+    """
+    Position of a chunk in a columnar capture
+
+    :param offset file offset of the chunk header
+    :param count number of records
+    :param start timestamp of the first record
+    :param end timestamp of the last record
+    """
+    offset: int
+    count: int
+    start: float
+    end: float
+
+
+# =====VARINTS=====
+
+def encode_varints(values):
+    """
+    :param values a NumPy array of unsigned integers (below 2^63)
+
+    :return the LEB128 encoding of the values (7 bits per byte, high bit set on all but the last byte)
+    """
+    _v = values.astype(np.uint64)
+    _lengths = np.ones(len(_v), np.int64)
+    for i in range(1, 10):
+        _lengths += _v >= np.uint64(1 << (7 * i))
+    _shifts = np.arange(10, dtype=np.uint64) * np.uint64(7)
+    _bytes = ((_v[:, None] >> _shifts) & np.uint64(0x7F)).astype(np.uint8)
+    _positions = np.arange(10)
+    _bytes[_positions < (_lengths[:, None] - 1)] |= 0x80
+    return _bytes[_positions < _lengths[:, None]].tobytes()
+
+
+def decode_varints(data):
+    """
+    :return the values of a LEB128 encoded buffer as a uint64 array
+    """
+    _b = np.frombuffer(data, np.uint8)
+    if not len(_b):
+        return np.zeros(0, np.uint64)
+    _ends = np.nonzero(_b < 0x80)[0]
+    _starts = np.concatenate(([0], _ends[:-1] + 1))
+    _value_of = np.repeat(np.arange(len(_ends)), _ends - _starts + 1)
+    _shift = (np.arange(len(_b)) - _starts[_value_of]).astype(np.uint64) * np.uint64(7)
+    return np.add.reduceat((_b & 0x7F).astype(np.uint64) << _shift, _starts)
+
+
+def _zigzag(values):
+    _v = values.astype(np.int64)
+    return ((_v << 1) ^ (_v >> 63)).astype(np.uint64)
+
+
+def _unzigzag(values):
+    _v = values.astype(np.uint64)
+    return (_v >> np.uint64(1)).astype(np.int64) ^ -(_v & np.uint64(1)).astype(np.int64)
+
+
+# =====CODECS=====
+
+def _compress(data, codec, level):
+    if codec == 1:
+        return zlib.compress(data, level)
+    if codec == 2:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return data
+
+
+def _decompress(data, codec, size):
+    if codec == 0:
+        return data
+    if codec == 1:
+        return zlib.decompress(data, bufsize=max(size, 1))
+    if codec == 2:
+        if zstandard is None:
+            raise ValueError("Columnar capture compressed with zstd, install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=size)
+    raise ValueError("Unknown column codec {}".format(codec))
+
+
+# =====CHUNKS=====
+
+def encode_chunk(records, resolution=1e-6, codec=1, level=6):
+    """
+    Encodes FRAME_DTYPE records as a chunk
+
+    :param codec 0 for no compression, 1 for zlib, 2 for zstd (see CODECS); columns that do not
+                 shrink are stored uncompressed
+
+    :return the chunk bytes
+    """
+    _n = len(records)
+    _first = float(records['timestamp'][0])
+    _ticks = np.rint((records['timestamp'] - _first) / resolution).astype(np.int64)
+    _time = encode_varints(_zigzag(np.diff(_ticks, prepend=0)))
+
+    _keys = records['id'].astype(np.uint32) | np.where(records['flags'] & FLAG_EXT, EXT_BIT, 0).astype(np.uint32)
+    _ids, _index = np.unique(_keys, return_inverse=True)
+    _width = 1 if len(_ids) <= 0x100 else 2 if len(_ids) <= 0x10000 else 4
+    _index = _index.astype({1: np.uint8, 2: '<u2', 4: '<u4'}[_width])
+
+    _dlc = records['dlc'].astype(np.uint8)
+    _padded = np.zeros(_n + (_n & 1), np.uint8)
+    _padded[:_n] = _dlc
+    _nibbles = _padded[0::2] | (_padded[1::2] << 4)
+    _rtr = (records['flags'] & FLAG_RTR) != 0
+
+    # Same ID together, byte positions apart and differences only: counters and slowly changing
+    # signals turn into runs of equal bytes that compress to almost nothing
+    _order = np.argsort(_index, kind='stable')
+    _data = records['data'][_order]
+    _data[1:] -= records['data'][_order][:-1]
+    _data = np.ascontiguousarray(_data.T)
+
+    _columns = [(_time, 1), (_ids.astype('<u4').tobytes(), 4), (_index.tobytes(), _width), (_nibbles.tobytes(), 1),
+                (np.packbits(_rtr).tobytes(), 1), (_data.tobytes(), 1)]
+    _table = []
+    _body = []
+    for _raw, _w in _columns:
+        _stored = _compress(_raw, codec, level) if codec and _raw else _raw
+        _codec = codec if len(_stored) < len(_raw) else 0
+        if not _codec:
+            _stored = _raw
+        _table.append(COLUMN.pack(_codec, _w, len(_raw), len(_stored)))
+        _body.append(_stored)
+    _size = sum(map(len, _table)) + sum(map(len, _body))
+    return b''.join([CHUNK.pack(CHUNK_MAGIC, _n, _size, _first, float(records['timestamp'][-1]))] + _table + _body)
+
+
+def decode_chunk(count, first, body, resolution=1e-6, fields=None):
+    """
+    Decodes a chunk into FRAME_DTYPE records
+
+    :param count, first the record count and first timestamp from the CHUNK header
+    :param body the column table and data following the CHUNK header
+    :param fields the FRAME_DTYPE fields to decode, None for all; the others are left 0
+
+    :return the records
+    """
+    _names = set(COLUMNS) if fields is None else {c for f in fields for c in _FIELD_COLUMNS[f]}
+    _columns = _read_columns(body, _names)
+    _records = np.zeros(count, FRAME_DTYPE)
+    _wanted = FRAME_DTYPE.names if fields is None else fields
+
+    if 'timestamp' in _wanted:
+        _ticks = np.cumsum(_unzigzag(decode_varints(_columns['time'])))
+        _records['timestamp'] = first + _ticks * resolution
+    if 'id' in _wanted or 'flags' in _wanted:
+        _keys = np.frombuffer(_columns['ids'], '<u4')[_columns['index']]
+        _records['id'] = _keys & ~np.uint32(EXT_BIT)
+        _ext = (_keys & np.uint32(EXT_BIT)) != 0
+    if 'flags' in _wanted:
+        _rtr = np.unpackbits(np.frombuffer(_columns['rtr'], np.uint8), count=count).astype(bool)
+        _records['flags'] = np.where(_ext, FLAG_EXT, 0) | np.where(_rtr, FLAG_RTR, 0)
+    if 'dlc' in _wanted:
+        _nibbles = np.frombuffer(_columns['dlc'], np.uint8)
+        _dlc = np.empty(len(_nibbles) * 2, np.uint8)
+        _dlc[0::2] = _nibbles & 0x0F
+        _dlc[1::2] = _nibbles >> 4
+        _records['dlc'] = _dlc[:count]
+    if 'data' in _wanted:
+        _order = np.argsort(_columns['index'], kind='stable')
+        _planes = np.frombuffer(_columns['data'], np.uint8).reshape(8, count)
+        _records['data'][_order] = np.cumsum(_planes.T, axis=0, dtype=np.uint8) # Wraps mod 256
+    return _records
+
+
+def _read_columns(body, names):
+    """
+    :return a dict of column name -> decompressed bytes (the index as an integer array) of the named columns
+    """
+    _columns = {}
+    _offset = len(COLUMNS) * COLUMN.size
+    for i, _name in enumerate(COLUMNS):
+        _codec, _width, _raw, _stored = COLUMN.unpack_from(body, i * COLUMN.size)
+        if _name in names:
+            _data = _decompress(bytes(body[_offset:_offset + _stored]), _codec, _raw)
+            if _name == 'index':
+                _data = np.frombuffer(_data, {1: np.uint8, 2: '<u2', 4: '<u4'}[_width])
+            _columns[_name] = _data
+        _offset += _stored
+    return _columns
+
+
+# =====WRITER=====
+
+class ColumnarWriter:
+    """
+    Writes frames into a columnar capture for long-term archives.
+
+    Frames are buffered and encoded in chunks of chunk_records: per chunk the timestamps become
+    varint deltas, the IDs a dictionary plus a narrow index, the DLCs nibbles, the request flags
+    bits and the payloads per-ID byte planes of differences, and every column is compressed on its
+    own (zlib, or zstd if the zstandard package is installed). Cyclic traffic repeats itself, so
+    this is several times smaller than the fixed-width capture segments of lib.CaptureWriter, and
+    a scan only decompresses the columns it needs. Timestamps are stored with resolution seconds.
+    write() takes a list of frames, so the writer can be registered directly as a PCAN_RS_232
+    listener.
+
+    Example:
+        with ColumnarWriter('archive/2024-05.ccap', metadata={'vehicle': 'truck-17'}) as writer:
+            for records in CaptureReader('logs').slice():
+                writer.write_array(records)
+    """
+
+    def __init__(self, path, metadata=None, chunk_records=CHUNK_RECORDS, codec='zlib', level=None, resolution=1e-6):
+        """
+        :param path the file to write
+        :param metadata dict stored in the header
+        :param chunk_records records per chunk, the unit of random access
+        :param codec 'zlib', 'zstd' or 'none'
+        :param level compression level, None for the codec default (zlib 6, zstd 9)
+        :param resolution timestamp resolution in seconds
+
+        :raise ValueError if the codec is unknown or not installed
+        """
+        require_numpy()
+        if codec not in CODECS:
+            raise ValueError("Unknown codec '{}' (use {})".format(codec, ', '.join(CODECS)))
+        if codec == 'zstd' and zstandard is None:
+            raise ValueError("The zstd codec needs the zstandard package (pip install zstandard)")
+        self.path = path
+        self.chunk_records = chunk_records
+        self.codec = CODECS[codec]
+        self.level = level if level is not None else (9 if codec == 'zstd' else 6)
+        self.resolution = resolution
+        self.count = 0              # Records written
+        self.chunks = []            # ChunkInfo of the chunks written
+        self._pending = []          # Record arrays not yet encoded
+        self._pending_count = 0
+        self._lock = threading.Lock()
+        self._file = open(path, 'wb')
+        _meta = json.dumps(dict(metadata or {}, codec=codec), sort_keys=True).encode('utf-8')
+        _size = (HEADER.size + len(_meta) + 7) & ~7
+        self._file.write(HEADER.pack(MAGIC, VERSION, _size, time.time(), resolution) + _meta.ljust(_size - HEADER.size, b' '))
+        self._offset = _size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, frames):
+        """
+        Appends frames
+
+        :param frames a list of CanFrame objects
+        """
+        if frames:
+            self.write_array(frames_to_array(frames))
+
+    def write_array(self, records):
+        """
+        Appends FRAME_DTYPE records, e.g. from lib.CaptureReader
+        """
+        with self._lock:
+            if self._file is None or not len(records):
+                return
+            self._pending.append(records)
+            self._pending_count += len(records)
+            if self._pending_count >= self.chunk_records:
+                _records = np.concatenate(self._pending)
+                _full = len(_records) - len(_records) % self.chunk_records
+                for i in range(0, _full, self.chunk_records):
+                    self._write_chunk(_records[i:i + self.chunk_records])
+                self._pending = [_records[_full:]] if _full < len(_records) else []
+                self._pending_count = len(_records) - _full
+
+    def flush(self):
+        """
+        Writes the buffered records as a (short) chunk and fsyncs the file
+        """
+        with self._lock:
+            self._flush_pending()
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._flush_pending()
+            _index = b''.join(INDEX_ENTRY.pack(*c) for c in self.chunks)
+            self._file.write(_index + FOOTER.pack(FOOTER_MAGIC, self._offset, len(self.chunks)))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+    def _flush_pending(self):
+        if self._pending_count and self._file is not None:
+            self._write_chunk(np.concatenate(self._pending))
+        self._pending = []
+        self._pending_count = 0
+
+    def _write_chunk(self, records):
+        _chunk = encode_chunk(records, self.resolution, self.codec, self.level)
+        self._file.write(_chunk)
+        self.chunks.append(ChunkInfo(self._offset, len(records), float(records['timestamp'][0]),
+                                     float(records['timestamp'][-1])))
+        self._offset += len(_chunk)
+        self.count += len(records)
+
+
+# =====READER=====
+
+class ColumnarReader:
+    """
+    Reads a columnar capture written by ColumnarWriter, one chunk at a time.
+
+    The chunk index (from the footer, or from the chunk headers of a file that was not closed)
+    gives random access to any chunk and skips chunks outside a time range. frames_for() and
+    chunk_ids() read only the column table and the ID dictionary of a chunk first, so chunks
+    without a requested ID are skipped without reading their other columns. Only the columns
+    needed for the requested fields are decompressed.
+
+    Example:
+        with ColumnarReader('archive/2024-05.ccap') as reader:
+            for records in reader.select(t0, t1, fields=('timestamp', 'id')):  # FRAME_DTYPE arrays
+                ...
+            rpm = reader.frames_for(0x0CF00400, ext=True)
+    """
+
+    def __init__(self, path):
+        """
+        :raise ValueError if the file is not a columnar capture
+        """
+        require_numpy()
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            _head = self._file.read(HEADER.size)
+            if len(_head) < HEADER.size:
+                raise ValueError("Not a columnar capture (too short)")
+            _magic, _version, _header_size, self.created, self.resolution = HEADER.unpack(_head)
+            if _magic != MAGIC:
+                raise ValueError("Not a columnar capture (bad magic)")
+            if _version != VERSION:
+                raise ValueError("Unsupported columnar capture version {}".format(_version))
+            self.metadata = json.loads(self._file.read(_header_size - HEADER.size).decode('utf-8'))
+            self.chunks = self._load_index(_header_size)
+        except (ValueError, struct.error):
+            self._file.close()
+            raise
+        self.closed = self._footer is not None
+
+    def __len__(self):
+        return sum(c.count for c in self.chunks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def start(self):
+        return self.chunks[0].start if self.chunks else None
+
+    @property
+    def end(self):
+        return self.chunks[-1].end if self.chunks else None
+
+    def read_chunk(self, i, fields=None):
+        """
+        :param fields the FRAME_DTYPE fields to decode, None for all; the others are left 0
+
+        :return the FRAME_DTYPE records of chunk i
+        """
+        _count, _first, _body = self._read_body(self.chunks[i])
+        return decode_chunk(_count, _first, _body, self.resolution, fields)
+
+    def chunk_ids(self, i):
+        """
+        :return the set of (id, ext) pairs in chunk i, reading only its ID dictionary
+        """
+        return {(int(k) & ~EXT_BIT, bool(k & EXT_BIT)) for k in self._read_ids(self.chunks[i])}
+
+    def select(self, t0=None, t1=None, fields=None):
+        """
+        Yields FRAME_DTYPE arrays of the records with t0 <= timestamp < t1 (None for an open end),
+        one per chunk
+
+        :param fields the FRAME_DTYPE fields to decode, None for all (the timestamps are always decoded)
+        """
+        _fields = None if fields is None else tuple(set(fields) | {'timestamp'})
+        for i, _chunk in enumerate(self.chunks):
+            if (t1 is not None and _chunk.start >= t1) or (t0 is not None and _chunk.end < t0):
+                continue
+            _records = self.read_chunk(i, _fields)
+            if t0 is not None or t1 is not None:
+                _ts = _records['timestamp']
+                _records = _records[(_ts >= (-np.inf if t0 is None else t0)) & (_ts < (np.inf if t1 is None else t1))]
+            if len(_records):
+                yield _records
+
+    def records(self, t0=None, t1=None):
+        """
+        :return a FRAME_DTYPE array of the records with t0 <= timestamp < t1
+        """
+        _parts = list(self.select(t0, t1))
+        return np.concatenate(_parts) if _parts else np.zeros(0, FRAME_DTYPE)
+
+    def frames_for(self, id, ext=False, t0=None, t1=None):
+        """
+        :return a FRAME_DTYPE array of the records of one ID with t0 <= timestamp < t1, only
+                decoding the chunks whose ID dictionary contains it
+        """
+        _key = id | (EXT_BIT if ext else 0)
+        _parts = []
+        for _chunk in self.chunks:
+            if (t1 is not None and _chunk.start >= t1) or (t0 is not None and _chunk.end < t0):
+                continue
+            if _key not in self._read_ids(_chunk):
+                continue
+            _count, _first, _body = self._read_body(_chunk)
+            _records = decode_chunk(_count, _first, _body, self.resolution)
+            _ts = _records['timestamp']
+            _mask = (_records['id'] == id) & ((_records['flags'] & FLAG_EXT) == (FLAG_EXT if ext else 0))
+            if t0 is not None:
+                _mask &= _ts >= t0
+            if t1 is not None:
+                _mask &= _ts < t1
+            _parts.append(_records[_mask])
+        return np.concatenate(_parts) if _parts else np.zeros(0, FRAME_DTYPE)
+
+    def frames(self, t0=None, t1=None):
+        """
+        Yields the CanFrame objects of the records with t0 <= timestamp < t1
+        """
+        for _records in self.select(t0, t1):
+            yield from array_to_frames(_records)
+
+    def close(self):
+        self._file.close()
+
+    def _read_header(self, chunk):
+        """
+        Reads the CHUNK header of a chunk, leaving the file at its column table
+
+        :return (record count, size of the column table and data, first timestamp)
+        """
+        self._file.seek(chunk.offset)
+        _magic, _count, _size, _first, _last = CHUNK.unpack(self._file.read(CHUNK.size))
+        if _magic != CHUNK_MAGIC:
+            raise ValueError("Damaged columnar capture: no chunk at offset {}".format(chunk.offset))
+        return _count, _size, _first
+
+    def _read_body(self, chunk):
+        """
+        :return (record count, first timestamp, column table and data) of a chunk
+        """
+        _count, _size, _first = self._read_header(chunk)
+        return _count, _first, memoryview(self._file.read(_size))
+
+    def _read_ids(self, chunk):
+        """
+        :return the ID dictionary of a chunk as a uint32 array, reading only the column table and the ids column
+        """
+        self._read_header(chunk)
+        _table = self._file.read(len(COLUMNS) * COLUMN.size)
+        _skip = 0
+        for i, _name in enumerate(COLUMNS):
+            _codec, _width, _raw, _stored = COLUMN.unpack_from(_table, i * COLUMN.size)
+            if _name == 'ids':
+                break
+            _skip += _stored
+        self._file.seek(_skip, os.SEEK_CUR)
+        return np.frombuffer(_decompress(self._file.read(_stored), _codec, _raw), '<u4')
+
+    def _load_index(self, header_size):
+        """
+        :return the ChunkInfo of every chunk, from the footer or by walking the chunk headers
+        """
+        self._footer = None
+        _size = os.fstat(self._file.fileno()).st_size
+        if _size >= header_size + FOOTER.size:
+            self._file.seek(_size - FOOTER.size)
+            _magic, _index_offset, _n = FOOTER.unpack(self._file.read(FOOTER.size))
+            if _magic == FOOTER_MAGIC and _index_offset + _n * INDEX_ENTRY.size + FOOTER.size == _size:
+                self._file.seek(_index_offset)
+                _index = self._file.read(_n * INDEX_ENTRY.size)
+                self._footer = _index_offset
+                return [ChunkInfo(*INDEX_ENTRY.unpack_from(_index, i * INDEX_ENTRY.size)) for i in range(_n)]
+
+        _chunks = [] # Not closed: use the complete chunks
+        _offset = header_size
+        while _offset + CHUNK.size <= _size:
+            self._file.seek(_offset)
+            _magic, _count, _body, _first, _last = CHUNK.unpack(self._file.read(CHUNK.size))
+            if _magic != CHUNK_MAGIC or _offset + CHUNK.size + _body > _size:
+                break
+            _chunks.append(ChunkInfo(_offset, _count, _first, _last))
+            _offset += CHUNK.size + _body
+        return _chunks
+
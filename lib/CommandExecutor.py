@@ -0,0 +1,162 @@
+import threading
+from collections import deque
+from queue import Empty, Queue
+
+
+class Command:
+    """
+    A device command submitted to a CommandExecutor
+    """
+
+    def __init__(self, fn, args, done, key, description):
+        self.fn = fn
+        self.args = args
+        self.done = done
+        self.key = key
+        self.description = description
+        self.result = None
+        self.exception = None
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Cancels the command. A queued command is never run; the result of a command already being
+        run is discarded. Either way its done callback is not called.
+        """
+        self.cancelled = True
+
+
+class CommandExecutor:
+    """
+    Runs device commands on a worker thread so the Tk mainloop never waits on a serial round trip.
+
+    Commands run one at a time in submission order. Results are handed back to the Tk thread by
+    polling with master.after() (Tk must not be called from other threads) and passed to the
+    command's done callback there. A command that raises is reported with the result -1, the
+    exception is kept in Command.exception.
+
+    Commands submitted with a key replace a queued command with the same key, so clicking a button
+    repeatedly during heavy traffic runs the command once with the latest arguments.
+
+    Example:
+        executor = CommandExecutor(root)
+        executor.submit(pcan.get_status_flags, done=lambda res: print(res), key='status')
+    """
+    POLL_INTERVAL = 20 # ms between checks for finished commands
+
+    def __init__(self, master, poll_interval=POLL_INTERVAL):
+        """
+        :param master the Tk widget used to schedule the result callbacks
+        :param poll_interval ms between checks for finished commands while commands are pending
+        """
+        self.master = master
+        self.poll_interval = poll_interval
+        self.in_flight = None           # Command being run by the worker
+
+        self._queue = deque()           # Commands waiting for the worker
+        self._condition = threading.Condition()
+        self._finished = Queue()        # Commands run by the worker, waiting for their callbacks
+        self._pending = 0               # Submitted commands whose callbacks have not been handled yet
+        self._poll_job = None
+        self._alive = True
+        self._thread = threading.Thread(target=self._worker, name='pcan-commands', daemon=True)
+        self._thread.start()
+
+    @property
+    def queued(self):
+        """
+        :return the number of commands waiting to be run
+        """
+        return len(self._queue)
+
+    @property
+    def busy(self):
+        return self._pending > 0
+
+    def submit(self, fn, *args, done=None, key=None, description=None):
+        """
+        Queues fn(*args) to be run on the worker thread. Must be called from the Tk thread.
+
+        :param done called on the Tk thread with the result of fn, -1 if it raised
+        :param key commands with the same key replace each other while queued
+        :param description text describing the command, e.g. for a status line
+
+        :return the Command
+        """
+        _command = Command(fn, args, done, key, description)
+        with self._condition:
+            if key is not None:
+                for _queued in self._queue:
+                    if _queued.key == key:
+                        _queued.cancel()
+            self._queue.append(_command)
+            self._condition.notify()
+        self._pending += 1
+        if self._poll_job is None:
+            self._poll_job = self.master.after(self.poll_interval, self._poll)
+        return _command
+
+    def cancel(self, key=None):
+        """
+        Cancels the queued commands and the command in flight
+
+        :param key only cancel the commands with this key, None for all commands
+
+        :return the number of commands cancelled
+        """
+        _n = 0
+        with self._condition:
+            _commands = list(self._queue)
+            if self.in_flight is not None:
+                _commands.append(self.in_flight)
+            for _command in _commands:
+                if not _command.cancelled and (key is None or _command.key == key):
+                    _command.cancel()
+                    _n += 1
+        return _n
+
+    def close(self):
+        """
+        Cancels all commands and stops the worker thread once the command in flight returns
+        """
+        self.cancel()
+        with self._condition:
+            self._alive = False
+            self._condition.notify()
+        if self._poll_job is not None:
+            self.master.after_cancel(self._poll_job)
+            self._poll_job = None
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while self._alive and not self._queue:
+                    self._condition.wait()
+                if not self._alive:
+                    return
+                _command = self._queue.popleft()
+                if not _command.cancelled:
+                    self.in_flight = _command
+            if not _command.cancelled:
+                try:
+                    _command.result = _command.fn(*_command.args)
+                except Exception as e: # e.g. SerialException when the device was unplugged
+                    _command.exception = e
+                    _command.result = -1
+            with self._condition:
+                self.in_flight = None
+            self._finished.put(_command)
+
+    def _poll(self):
+        """
+        Tk timer callback: calls the done callbacks of finished commands
+        """
+        while True:
+            try:
+                _command = self._finished.get_nowait()
+            except Empty:
+                break
+            self._pending -= 1
+            if not _command.cancelled and _command.done is not None:
+                _command.done(_command.result)
+        self._poll_job = self.master.after(self.poll_interval, self._poll) if self._pending else None
@@ -0,0 +1,275 @@
+import re
+import struct
+from typing import NamedTuple, Optional
+from lib.FrameArray import FLAG_EXT, FLAG_RTR, np, require_numpy
+
+EXTENDED_ID_FLAG = 0x80000000 # DBC files mark extended identifiers with bit 31
+
+_BO_RE = re.compile(r'^BO_\s+(\d+)\s+(\w+)\s*:\s*(\d+)\s+(\w+)')
+_SG_RE = re.compile(r'^SG_\s+(\w+)\s*(M|m\d+M?)?\s*:\s*(\d+)\|(\d+)@([01])([+-])\s*'
+                    r'\(([^,]+),([^)]+)\)\s*\[([^|]*)\|([^\]]*)\]\s*"([^"]*)"')
+_VALTYPE_RE = re.compile(r'^SIG_VALTYPE_\s+(\d+)\s+(\w+)\s*:?\s*([12])\s*;')
+
+
+class Signal(NamedTuple):
+    """
+    A signal definition from a DBC file.
+    start is the DBC start bit (LSB for Intel, MSB for Motorola byte order).
+    multiplexer_value is None for plain signals, -1 for the multiplexer switch itself.
+    Extended multiplexing switches (m1M) are decoded as signals multiplexed by their value;
+    SG_MUL_VAL_ is not read, so every multiplexed signal is selected by the M switch.
+    value_type is 0 for integers, 1 for IEEE float and 2 for IEEE double.
+    """
+    name: str
+    start: int
+    length: int
+    little_endian: bool
+    signed: bool
+    factor: float
+    offset: float
+    minimum: float
+    maximum: float
+    unit: str
+    multiplexer_value: Optional[int] = None
+    value_type: int = 0
+
+
+class Message(NamedTuple):
+    """
+    A message definition from a DBC file, id includes EXTENDED_ID_FLAG for 29-bit identifiers
+    """
+    id: int
+    name: str
+    dlc: int
+    sender: str
+    signals: list
+
+
+def _shift(signal):
+    """
+    Bit position of the signal LSB in the 64-bit payload integer, read little endian for Intel
+    signals and big endian for Motorola signals
+    """
+    if signal.little_endian:
+        return signal.start
+    _msb = (signal.start // 8) * 8 + (7 - signal.start % 8) # Sequential bit index counted from the MSB of byte 0
+    return 63 - (_msb + signal.length - 1)
+
+
+def _compile_signal(signal):
+    """
+    Precompiles the extraction, sign handling and scaling of a signal
+
+    :return a closure taking the payload as (little endian int, big endian int) and returning the physical value
+    """
+    _shift_n = _shift(signal)
+    _mask = (1 << signal.length) - 1
+    _factor = signal.factor
+    _offset = signal.offset
+    _index = 0 if signal.little_endian else 1
+
+    if signal.value_type:
+        _fmt = struct.Struct('<f' if signal.value_type == 1 else '<d')
+        _n = 4 if signal.value_type == 1 else 8
+        def _decode(raw):
+            return _fmt.unpack(((raw[_index] >> _shift_n) & _mask).to_bytes(_n, 'little'))[0] * _factor + _offset
+    elif signal.signed:
+        _sign = 1 << (signal.length - 1)
+        _wrap = 1 << signal.length
+        def _decode(raw):
+            _v = (raw[_index] >> _shift_n) & _mask
+            return ((_v - _wrap) if _v & _sign else _v) * _factor + _offset
+    elif _factor == 1 and _offset == 0: # Keep raw integers as ints
+        def _decode(raw):
+            return (raw[_index] >> _shift_n) & _mask
+    else:
+        def _decode(raw):
+            return ((raw[_index] >> _shift_n) & _mask) * _factor + _offset
+    return _decode
+
+
+def _compile_message(message):
+    """
+    Precompiles a message decoder
+
+    :return a closure taking the payload bytes and returning a dict of signal name -> physical value
+    """
+    _plain = [(s.name, _compile_signal(s)) for s in message.signals if s.multiplexer_value is None]
+    _switch = next((s for s in message.signals if s.multiplexer_value == -1), None)
+    _muxed = {}
+    for s in message.signals:
+        if s.multiplexer_value is not None and s.multiplexer_value >= 0:
+            _muxed.setdefault(s.multiplexer_value, []).append((s.name, _compile_signal(s)))
+
+    if _switch is None:
+        def _decode(data):
+            _data = data.ljust(8, b'\0')
+            _raw = (int.from_bytes(_data, 'little'), int.from_bytes(_data, 'big'))
+            return {name: f(_raw) for name, f in _plain}
+    else:
+        _switch_name = _switch.name
+        _switch_f = _compile_signal(_switch)
+        def _decode(data):
+            _data = data.ljust(8, b'\0')
+            _raw = (int.from_bytes(_data, 'little'), int.from_bytes(_data, 'big'))
+            _mux = _switch_f(_raw)
+            _values = {name: f(_raw) for name, f in _plain}
+            _values[_switch_name] = _mux
+            for name, f in _muxed.get(_mux, ()):
+                _values[name] = f(_raw)
+            return _values
+    return _decode
+
+
+class DBCDecoder:
+    """
+    Signal decoding engine for a DBC file.
+
+    Every message is compiled once into a closure (see decoders, keyed by DBC message ID) that
+    extracts, sign extends, scales and demultiplexes its signals. decode() works on single frames
+    and returns the cached values when the payload of an ID has not changed; decode_batch()
+    decodes a NumPy FRAME_DTYPE array into per-signal columns.
+
+    Example:
+        dbc = DBCDecoder('powertrain.dbc')
+        pcan.add_listener(lambda frames: [print(dbc.decode(f)) for f in frames])
+    """
+
+    def __init__(self, path=None, text=None):
+        """
+        :param path the DBC file to load
+        :param text the DBC contents, as an alternative to path
+        """
+        self.messages = {}  # DBC message ID -> Message
+        self.decoders = {}  # DBC message ID -> compiled decoder closure
+        self._cache = {}    # DBC message ID -> (payload, decoded values)
+        if path is not None:
+            with open(path, 'r', encoding='latin-1') as f:
+                text = f.read()
+        if text is not None:
+            self.load(text)
+
+    def load(self, text):
+        """
+        Parses DBC contents and compiles the decoders of their messages
+        """
+        _message = None
+        _value_types = {}
+        for _line in text.splitlines():
+            _line = _line.strip()
+            if _line.startswith('BO_ '):
+                _m = _BO_RE.match(_line)
+                if _m:
+                    _message = Message(int(_m.group(1)), _m.group(2), int(_m.group(3)), _m.group(4), [])
+                    self.messages[_message.id] = _message
+                continue
+            if _line.startswith('SG_ ') and _message is not None:
+                _m = _SG_RE.match(_line)
+                if _m:
+                    _mux = _m.group(2)
+                    _mux = None if _mux is None else -1 if _mux == 'M' else int(_mux[1:].rstrip('M'))
+                    _message.signals.append(Signal(
+                        _m.group(1), int(_m.group(3)), int(_m.group(4)), _m.group(5) == '1', _m.group(6) == '-',
+                        float(_m.group(7)), float(_m.group(8)), float(_m.group(9) or 0), float(_m.group(10) or 0),
+                        _m.group(11), _mux))
+                continue
+            if _line.startswith('SIG_VALTYPE_ '):
+                _m = _VALTYPE_RE.match(_line)
+                if _m:
+                    _value_types[(int(_m.group(1)), _m.group(2))] = int(_m.group(3))
+                continue
+            if _line:
+                _message = None # Signals only follow their BO_ line
+
+        for (_id, _name), _type in _value_types.items():
+            _msg = self.messages.get(_id)
+            if _msg is not None:
+                _msg.signals[:] = [s._replace(value_type=_type) if s.name == _name else s for s in _msg.signals]
+
+        for _id, _msg in self.messages.items():
+            self.decoders[_id] = _compile_message(_msg)
+        self._cache.clear()
+
+    # =====DECODING=====
+
+    def decode(self, frame):
+        """
+        Decodes the signals of a received frame
+
+        :param frame the CanFrame to decode
+
+        :return None if the frame is not defined in the DBC (or is a request frame)
+        :return a dict of signal name -> physical value. The dict is shared with the cache, do not modify it.
+        """
+        if frame.rtr:
+            return None
+        return self.decode_message(frame.id | EXTENDED_ID_FLAG if frame.ext else frame.id, frame.data)
+
+    def decode_message(self, id, data):
+        """
+        Decodes a payload for a DBC message ID (including EXTENDED_ID_FLAG for 29-bit IDs)
+
+        :return None if the ID is not defined in the DBC
+        :return a dict of signal name -> physical value. The dict is shared with the cache, do not modify it.
+        """
+        _cached = self._cache.get(id)
+        if _cached is not None and _cached[0] == data: # Payload unchanged since the last frame
+            return _cached[1]
+        _decoder = self.decoders.get(id)
+        if _decoder is None:
+            return None
+        _values = _decoder(data)
+        self._cache[id] = (data, _values)
+        return _values
+
+    def decode_batch(self, frames):
+        """
+        Decodes a NumPy array of FRAME_DTYPE records into per-signal columns
+
+        :param frames the frame array (see lib.FrameArray)
+
+        :return a dict of message name -> dict of columns. Every message dict holds a 'timestamp'
+                column and one float64 column per signal; multiplexed signals are NaN in rows where
+                the multiplexer selects another value.
+        """
+        require_numpy()
+        _ids = frames['id'].astype(np.uint32)
+        _ids = np.where(frames['flags'] & FLAG_EXT, _ids | EXTENDED_ID_FLAG, _ids)
+        _data_rows = ~(frames['flags'] & FLAG_RTR).astype(bool)
+
+        _columns = {}
+        for _id in np.unique(_ids[_data_rows]):
+            _msg = self.messages.get(int(_id))
+            if _msg is None:
+                continue
+            _sel = (_ids == _id) & _data_rows
+            _payload = np.ascontiguousarray(frames['data'][_sel])
+            _raw = (_payload.view('<u8').ravel(), _payload.view('>u8').ravel().astype('<u8'))
+            _cols = {'timestamp': frames['timestamp'][_sel]}
+            _mux = None
+            for s in _msg.signals:
+                if s.multiplexer_value == -1:
+                    _mux = self._decode_column(s, _raw)
+            for s in _msg.signals:
+                _col = self._decode_column(s, _raw)
+                if s.multiplexer_value is not None and s.multiplexer_value >= 0 and _mux is not None:
+                    _col = np.where(_mux == s.multiplexer_value, _col, np.nan)
+                _cols[s.name] = _col
+            _columns[_msg.name] = _cols
+        return _columns
+
+    @staticmethod
+    def _decode_column(signal, raw):
+        """
+        Vectorized version of the closure built by _compile_signal()
+        """
+        _v = (raw[0 if signal.little_endian else 1] >> np.uint64(_shift(signal))) & np.uint64((1 << signal.length) - 1)
+        if signal.value_type == 1:
+            _v = _v.astype(np.uint32).view(np.float32).astype(np.float64)
+        elif signal.value_type == 2:
+            _v = _v.view(np.float64)
+        elif signal.signed:
+            _v = _v.astype(np.int64) # Wraps 64-bit signals already
+            if signal.length < 64:
+                _v = np.where(_v & (1 << (signal.length - 1)), _v - (1 << signal.length), _v)
+        return _v * signal.factor + signal.offset
@@ -0,0 +1,62 @@
+import struct
+from lib.CanFrame import CanFrame
+
+try:
+    import numpy as np
+except ImportError: # NumPy is optional, only the batch functions need it
+    np = None
+
+# Flag bits of a frame record
+FLAG_EXT = 0x01 # Extended (29-bit) identifier
+FLAG_RTR = 0x02 # Remote transmission request
+
+# Fixed-width frame record: timestamp (s), id, flags, dlc, 8 data bytes (little endian, unpadded)
+RECORD = struct.Struct('<dIBB8s')
+RECORD_SIZE = RECORD.size
+
+FRAME_DTYPE = np.dtype([('timestamp', '<f8'), ('id', '<u4'), ('flags', 'u1'), ('dlc', 'u1'), ('data', 'u1', (8,))]) if np else None
+
+
+def require_numpy():
+    """
+    :raise ImportError if NumPy is not installed
+    """
+    if np is None:
+        raise ImportError("NumPy is required for batch mode (pip install numpy)")
+
+
+def pack_frame(frame):
+    """
+    Packs a CanFrame into a fixed-width frame record
+
+    :return the record as bytes (RECORD_SIZE long)
+    """
+    return RECORD.pack(frame.timestamp, frame.id, frame.ext | frame.rtr << 1, frame.dlc, frame.data)
+
+
+def unpack_frame(record, offset=0):
+    """
+    Unpacks a fixed-width frame record into a CanFrame
+
+    :param record a buffer containing the record
+    :param offset the position of the record within the buffer
+    """
+    _ts, _id, _flags, _dlc, _data = RECORD.unpack_from(record, offset)
+    return CanFrame(_id, bool(_flags & FLAG_EXT), bool(_flags & FLAG_RTR), _dlc, _data[:_dlc], _ts)
+
+
+def frames_to_array(frames):
+    """
+    Converts CanFrame objects into a NumPy array of FRAME_DTYPE records
+    """
+    require_numpy()
+    return np.frombuffer(b''.join(pack_frame(f) for f in frames), dtype=FRAME_DTYPE)
+
+
+def array_to_frames(array):
+    """
+    Yields a CanFrame for every record of a FRAME_DTYPE array
+    """
+    _buf = array.tobytes()
+    for _offset in range(0, len(_buf), RECORD_SIZE):
+        yield unpack_frame(_buf, _offset)
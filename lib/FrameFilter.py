@@ -0,0 +1,509 @@
+import re
+from typing import NamedTuple
+from lib.FrameArray import FLAG_EXT, FLAG_RTR, np, require_numpy
+
+STD_MASK = 0x7FF
+EXT_MASK = 0x1FFFFFFF
+
+
+class IdFilter(NamedTuple):
+    """
+    A candump-style ID filter: a frame matches when (frame.id & mask) == (id & mask)
+
+    :param id the CAN ID to compare with
+    :param mask the ID bits that must match
+    :param ext True if the filter applies to extended (29-bit) frames, False for standard
+    :param invert True to match the frames the filter would reject
+    """
+    id: int
+    mask: int
+    ext: bool = False
+    invert: bool = False
+
+
+def acceptance_registers(filters):
+    """
+    Computes SJA1000 single filter mode acceptance code and mask registers passing at least the
+    frames matched by the filters, so the PCAN module drops the others before the serial link.
+    Several filters are merged into one code/mask pair; the software filter still applies exactly.
+
+    :return a tuple of the code and mask registers as 8 hex digit strings (AC0-AC3, AM0-AM3),
+            None if the filters can not be programmed (inverted, or standard and extended mixed)
+    """
+    if not filters or any(f.invert for f in filters) or len({f.ext for f in filters}) > 1:
+        return None
+    _ext = filters[0].ext
+    _code = filters[0].id
+    _mask = EXT_MASK if _ext else STD_MASK
+    for f in filters: # Bits that must match: masked by every filter and equal in every filter
+        _mask &= f.mask & ~(f.id ^ _code)
+    _code &= _mask
+
+    # Acceptance mask bits are set for "don't care"; the RTR bit and unused bits are always don't care
+    if _ext:
+        _ac = _code << 3
+        _am = (~_mask & EXT_MASK) << 3 | 0x07
+    else:
+        _ac = _code << 21
+        _am = (~_mask & STD_MASK) << 21 | 0x1FFFFF # Includes the first two data bytes
+    return "{:08X}".format(_ac), "{:08X}".format(_am)
+
+
+# =====PARSER=====
+
+# Grammar, loosest binding first (Python precedence):
+#   or  : and ('or' and)*
+#   and : not ('and' not)*
+#   not : 'not' not | cmp
+#   cmp : bits (('=='|'!='|'<'|'<='|'>'|'>=') bits | ['not'] 'in' (bits '..' bits | '{' bits (',' bits)* '}'))?
+#   bits: '|' over '^' over '&' over '<<' '>>' over '+' '-' over unary '~' '-'
+#   atom: number | id | ext | std | rtr | dlc | data '[' number ']' | '(' or ')'
+_TOKEN_RE = re.compile(r'\s*(?:(0[xX][0-9A-Fa-f]+|0[bB][01]+|\d+)|(\.\.|==|!=|<=|>=|<<|>>|[()\[\]{},<>&|^~+\-])|([A-Za-z_]\w*))')
+_FIELDS = ('id', 'ext', 'std', 'rtr', 'dlc')
+_KEYWORDS = ('and', 'or', 'not', 'in', 'data', 'true', 'false') + _FIELDS
+_BINARY_LEVELS = (('|',), ('^',), ('&',), ('<<', '>>'), ('+', '-'))
+_SHIFTS = ('<<', '>>')
+_MAX_SHIFT = 63 # Shift counts are limited to what the int64 NumPy back end can shift
+_COMPARISONS = ('==', '!=', '<', '<=', '>', '>=')
+
+
+def _tokenize(text):
+    _tokens = []
+    _pos = 0
+    _text = text.rstrip()
+    while _pos < len(_text):
+        _m = _TOKEN_RE.match(_text, _pos)
+        if _m is None or _m.end() == _pos:
+            raise ValueError("Invalid filter expression at '{}': {}".format(_text[_pos:].strip(), text))
+        _number, _symbol, _name = _m.groups()
+        if _number is not None:
+            _tokens.append(('num', int(_number, 0)))
+        elif _symbol is not None:
+            _tokens.append(('sym', _symbol))
+        else:
+            _name = _name.lower()
+            if _name not in _KEYWORDS:
+                raise ValueError("Unknown name '{}' in filter expression (use {}, data[i]): {}".format(
+                    _name, ', '.join(_FIELDS), text))
+            _tokens.append(('name', _name))
+        _pos = _m.end()
+    return _tokens
+
+
+class _Parser:
+    """
+    Recursive descent parser building a tree of tuples, e.g. ('and', ('field', 'rtr'), ('num', 1))
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("Empty filter expression")
+        _tree = self._or()
+        if self.pos != len(self.tokens):
+            self._error("unexpected '{}'".format(self.tokens[self.pos][1]))
+        return _tree
+
+    def _error(self, reason):
+        raise ValueError("Invalid filter expression ({}): {}".format(reason, self.text))
+
+    def _peek(self, *values):
+        if self.pos < len(self.tokens) and self.tokens[self.pos][1] in values and self.tokens[self.pos][0] != 'num':
+            return self.tokens[self.pos][1]
+        return None
+
+    def _take(self, *values):
+        _value = self._peek(*values)
+        if _value is not None:
+            self.pos += 1
+        return _value
+
+    def _expect(self, value):
+        if self._take(value) is None:
+            self._error("expected '{}'".format(value))
+
+    def _or(self):
+        _node = self._and()
+        while self._take('or'):
+            _node = ('or', _node, self._and())
+        return _node
+
+    def _and(self):
+        _node = self._not()
+        while self._take('and'):
+            _node = ('and', _node, self._not())
+        return _node
+
+    def _not(self):
+        if self._take('not'):
+            return ('not', self._not())
+        return self._comparison()
+
+    def _comparison(self):
+        _left = self._bits(0)
+        _op = self._take(*_COMPARISONS)
+        if _op is not None:
+            return ('cmp', _op, _left, self._bits(0))
+        _negate = False
+        if self._peek('not') and self.pos + 1 < len(self.tokens) and self.tokens[self.pos + 1] == ('name', 'in'):
+            self.pos += 1
+            _negate = True
+        if self._take('in'):
+            if self._take('{'):
+                _values = [self._constant()]
+                while self._take(','):
+                    _values.append(self._constant())
+                self._expect('}')
+                _node = ('set', _left, frozenset(_values))
+            else:
+                _low = self._constant()
+                self._expect('..')
+                _node = ('range', _left, _low, self._constant())
+            return ('not', _node) if _negate else _node
+        return _left
+
+    def _constant(self):
+        _node = self._bits(0)
+        _value = _evaluate_constant(_node)
+        if _value is None:
+            self._error("ranges and sets take constant values")
+        return _value
+
+    def _bits(self, level):
+        if level == len(_BINARY_LEVELS):
+            return self._unary()
+        _node = self._bits(level + 1)
+        while True:
+            _op = self._take(*_BINARY_LEVELS[level])
+            if _op is None:
+                return _node
+            _node = ('bin', _op, _node, self._bits(level + 1))
+            if _op in _SHIFTS:
+                _count = _evaluate_constant(_node[3])
+                if _count is not None and not 0 <= _count <= _MAX_SHIFT:
+                    self._error("shift count out of 0-{}".format(_MAX_SHIFT))
+
+    def _unary(self):
+        _op = self._take('~', '-')
+        if _op is not None:
+            return ('unary', _op, self._unary())
+        return self._atom()
+
+    def _atom(self):
+        if self.pos >= len(self.tokens):
+            self._error("unexpected end")
+        _kind, _value = self.tokens[self.pos]
+        self.pos += 1
+        if _kind == 'num':
+            return ('num', _value)
+        if _value in _FIELDS:
+            return ('field', _value)
+        if _value in ('true', 'false'):
+            return ('num', int(_value == 'true'))
+        if _value == 'data':
+            self._expect('[')
+            _index = self._constant()
+            self._expect(']')
+            if not 0 <= _index < 8:
+                self._error("data index out of 0-7")
+            return ('byte', _index)
+        if _value == '(':
+            _node = self._or()
+            self._expect(')')
+            return _node
+        self._error("unexpected '{}'".format(_value))
+
+
+def _evaluate_constant(node):
+    """
+    :return the value of an expression made of numbers only, None if it uses frame fields
+    """
+    if node[0] == 'num':
+        return node[1]
+    if node[0] == 'unary':
+        _v = _evaluate_constant(node[2])
+        return None if _v is None else (~_v if node[1] == '~' else -_v)
+    if node[0] == 'bin':
+        _a = _evaluate_constant(node[2])
+        _b = _evaluate_constant(node[3])
+        if _a is None or _b is None:
+            return None
+        return eval("{} {} {}".format(_a, node[1], _b), {'__builtins__': {}}) # Operands are ints, op from the grammar
+    return None
+
+
+# =====BACK ENDS=====
+# Reading a data byte the frame does not have, or shifting by a count computed from the frame that is out of
+# 0-_MAX_SHIFT, makes an expression false: FrameFilter.match catches the exception, mask() removes the records
+# found by _failing()
+
+_PY_FIELDS = {'id': 'f.id', 'ext': 'f.ext', 'std': '(not f.ext)', 'rtr': 'f.rtr', 'dlc': 'f.dlc'}
+
+
+def _python(node, constants):
+    """
+    :return Python source evaluating node for a CanFrame named f; sets are added to constants
+    """
+    _kind = node[0]
+    if _kind == 'num':
+        return repr(node[1])
+    if _kind == 'field':
+        return _PY_FIELDS[node[1]]
+    if _kind == 'byte': # IndexError beyond the data, caught by FrameFilter.match
+        return "f.data[{}]".format(node[1])
+    if _kind == 'unary':
+        return "({}{})".format(node[1], _python(node[2], constants))
+    if _kind == 'bin' and node[1] in _SHIFTS and _evaluate_constant(node[3]) is None:
+        return "({} {} _shift_count({}))".format(_python(node[2], constants), node[1], _python(node[3], constants))
+    if _kind in ('bin', 'cmp'):
+        return "({} {} {})".format(_python(node[2], constants), node[1], _python(node[3], constants))
+    if _kind == 'range':
+        return "({} <= {} <= {})".format(node[2], _python(node[1], constants), node[3])
+    if _kind == 'set':
+        _name = "_set{}".format(len(constants))
+        constants[_name] = node[2]
+        return "({} in {})".format(_python(node[1], constants), _name)
+    if _kind == 'not':
+        return "(not {})".format(_python(node[1], constants))
+    return "({} {} {})".format(_python(node[1], constants), _kind, _python(node[2], constants)) # and, or
+
+
+def _shift_count(count):
+    """
+    :raise ValueError if a shift count computed from the frame is out of 0-_MAX_SHIFT
+    """
+    if not 0 <= count <= _MAX_SHIFT:
+        raise ValueError("shift count out of 0-{}".format(_MAX_SHIFT))
+    return count
+
+
+def _numpy(node, records):
+    """
+    :return the value of node for every record of a FRAME_DTYPE array (int64 or bool array, or an int)
+    """
+    _kind = node[0]
+    if _kind == 'num':
+        return node[1]
+    if _kind == 'field':
+        _name = node[1]
+        if _name == 'id':
+            return records['id'].astype(np.int64)
+        if _name == 'dlc':
+            return records['dlc'].astype(np.int64)
+        if _name == 'rtr':
+            return (records['flags'] & FLAG_RTR) != 0
+        _ext = (records['flags'] & FLAG_EXT) != 0
+        return _ext if _name == 'ext' else ~_ext
+    if _kind == 'byte': # Zero padded, the records where the byte is missing are removed by _failing()
+        return records['data'][:, node[1]].astype(np.int64)
+    if _kind == 'unary':
+        _v = _integer(_numpy(node[2], records))
+        return ~_v if node[1] == '~' else -_v
+    if _kind == 'bin':
+        _a = _integer(_numpy(node[2], records))
+        _b = _integer(_numpy(node[3], records))
+        return {'|': np.bitwise_or, '^': np.bitwise_xor, '&': np.bitwise_and, '<<': np.left_shift,
+                '>>': np.right_shift, '+': np.add, '-': np.subtract}[node[1]](_a, _b)
+    if _kind == 'cmp':
+        _a = _integer(_numpy(node[2], records))
+        _b = _integer(_numpy(node[3], records))
+        return {'==': np.equal, '!=': np.not_equal, '<': np.less, '<=': np.less_equal, '>': np.greater,
+                '>=': np.greater_equal}[node[1]](_a, _b)
+    if _kind == 'range':
+        _v = _integer(_numpy(node[1], records))
+        return (_v >= node[2]) & (_v <= node[3])
+    if _kind == 'set':
+        return np.isin(_integer(_numpy(node[1], records)), list(node[2]))
+    if _kind == 'not':
+        return ~_truth(_numpy(node[1], records), len(records))
+    _a = _truth(_numpy(node[1], records), len(records))
+    _b = _truth(_numpy(node[2], records), len(records))
+    return _a & _b if _kind == 'and' else _a | _b
+
+
+def _failing(node, records):
+    """
+    Finds the records whose evaluation reads a data byte beyond the frame's data or shifts by a
+    count out of range, with the and/or short-circuits of the Python back end
+
+    :return a bool array, or False if no record fails
+    """
+    _kind = node[0]
+    if _kind == 'byte':
+        return (records['dlc'] <= node[1]) | ((records['flags'] & FLAG_RTR) != 0) # Request frames carry no data
+    if _kind in ('num', 'field'):
+        return False
+    if _kind == 'unary':
+        return _failing(node[2], records)
+    if _kind == 'bin' and node[1] in _SHIFTS and _evaluate_constant(node[3]) is None:
+        _count = _integer(_numpy(node[3], records))
+        return _failing(node[2], records) | _failing(node[3], records) | (_count < 0) | (_count > _MAX_SHIFT)
+    if _kind in ('bin', 'cmp'):
+        return _failing(node[2], records) | _failing(node[3], records)
+    if _kind in ('range', 'set', 'not'):
+        return _failing(node[1], records)
+    _a = _failing(node[1], records)
+    _b = _failing(node[2], records)
+    if _b is False:
+        return _a
+    _truth_a = _truth(_numpy(node[1], records), len(records))
+    return _a | ((_truth_a if _kind == 'and' else ~_truth_a) & _b) # b is only evaluated when a does not decide
+
+
+def _may_fail(node):
+    """
+    :return True if evaluating node can fail for some frames (see _failing())
+    """
+    if node[0] == 'byte' or node[0] == 'bin' and node[1] in _SHIFTS and _evaluate_constant(node[3]) is None:
+        return True
+    return any(isinstance(n, tuple) and _may_fail(n) for n in node[1:])
+
+
+def _integer(value):
+    return value.astype(np.int64) if isinstance(value, np.ndarray) and value.dtype == bool else value
+
+
+def _truth(value, n):
+    if not isinstance(value, np.ndarray):
+        return np.full(n, bool(value))
+    return value if value.dtype == bool else value != 0
+
+
+def _id_constraint(node):
+    """
+    Finds a condition on the ID that every matching frame meets, for the acceptance registers
+
+    :return a list of alternative (code, mask, ext) tuples, ext None when either frame type passes,
+            or None if the expression does not restrict the ID in a way the registers can express
+    """
+    _kind = node[0]
+    if _kind == 'field' and node[1] in ('ext', 'std'):
+        return [(0, 0, node[1] == 'ext')]
+    if _kind == 'not' and node[1][0] == 'field' and node[1][1] in ('ext', 'std'):
+        return [(0, 0, node[1][1] == 'std')]
+    if _kind == 'cmp' and node[1] == '==':
+        _left, _right = node[2], node[3]
+        if _right[0] == 'field': # 0x100 == id
+            _left, _right = _right, _left
+        _value = _evaluate_constant(_right)
+        if _value is None:
+            return None
+        if _left == ('field', 'id'):
+            return [(_value, EXT_MASK, True if _value > STD_MASK else None)]
+        if _left[0] == 'bin' and _left[1] == '&' and _left[2] == ('field', 'id'): # (id & mask) == value
+            _mask = _evaluate_constant(_left[3])
+            if _mask is not None:
+                return [(_value & _mask, _mask & EXT_MASK, True if _value > STD_MASK else None)]
+        if _left[0] in ('field',) and _left[1] in ('ext', 'std'): # ext == 1
+            return [(0, 0, bool(_value) == (_left[1] == 'ext'))]
+        return None
+    if _kind == 'range' and node[1] == ('field', 'id'):
+        _low, _high = node[2], node[3]
+        if _low > _high:
+            return None
+        _mask = ~((1 << (_low ^ _high).bit_length()) - 1) & EXT_MASK # Common high bits of the range
+        return [(_low & _mask, _mask, True if _low > STD_MASK else None)]
+    if _kind == 'set' and node[1] == ('field', 'id'):
+        return [(v, EXT_MASK, True if v > STD_MASK else None) for v in sorted(node[2])]
+    if _kind == 'or':
+        _a = _id_constraint(node[1])
+        _b = _id_constraint(node[2])
+        return None if _a is None or _b is None else _a + _b
+    if _kind == 'and':
+        _a = _id_constraint(node[1])
+        _b = _id_constraint(node[2])
+        if _a is None or _b is None:
+            return _a if _b is None else _b
+        if len(_a) * len(_b) > 256:
+            return None
+        _both = []
+        for _code_a, _mask_a, _ext_a in _a:
+            for _code_b, _mask_b, _ext_b in _b:
+                if _ext_a is not None and _ext_b is not None and _ext_a != _ext_b:
+                    continue # Contradiction, no frame passes both
+                if (_code_a ^ _code_b) & _mask_a & _mask_b:
+                    continue
+                _both.append((_code_a | _code_b, _mask_a | _mask_b, _ext_a if _ext_a is not None else _ext_b))
+        return _both or None
+    return None
+
+
+class FrameFilter:
+    """
+    A frame filter expression, compiled once into a Python closure, a NumPy mask and, where
+    possible, SJA1000 acceptance registers.
+
+    The syntax follows Python: fields id, ext, std, rtr, dlc and data[0]-data[7], integer literals (0x.., 0b..), | ^ & << >> + - ~, comparisons, and/or/not,
+    'in lo..hi' (inclusive) and 'in {a, b, c}'. Any non-zero value is true. Reading a data byte the frame does not have
+    makes the whole expression false (and/or short-circuit as in Python), so 'data[5] == 0'
+    does not match frames shorter than 6 bytes or request frames. So does a shift by a count
+    computed from the frame that is out of 0-63 (constant counts are checked when compiling).
+
+    Example:
+        where = FrameFilter('std and id in 0x300..0x3FF and data[0] & 0x80 and not rtr')
+        frames = [f for f in frames if where.match(f)]
+        records = records[where.mask(records)]          # FRAME_DTYPE array
+        registers = where.acceptance_registers()        # ('60000000', '1FFFFFFF') or None
+    """
+
+    def __init__(self, text):
+        """
+        :param text the filter expression
+        :raise ValueError if the expression is invalid
+        """
+        self.text = text
+        self.tree = _Parser(text).parse()
+        _constants = {}
+        _source = _python(self.tree, _constants)
+        _match = eval("lambda f: _bool({})".format(_source),
+                      dict(_constants, _bool=bool, _shift_count=_shift_count, __builtins__={}))
+        self._may_fail = _may_fail(self.tree)
+        if self._may_fail:
+            def _match_checked(frame, _match=_match):
+                try:
+                    return _match(frame)
+                except (IndexError, ValueError, OverflowError): # data[i] beyond the frame's data, bad shift count
+                    return False
+            self.match = _match_checked # Takes a CanFrame
+        else:
+            self.match = _match
+
+    def __repr__(self):
+        return "FrameFilter({!r})".format(self.text)
+
+    def mask(self, records):
+        """
+        :return a bool array selecting the records of a FRAME_DTYPE array that match
+        """
+        require_numpy()
+        _mask = _truth(_numpy(self.tree, records), len(records))
+        if self._may_fail:
+            _failed = _failing(self.tree, records)
+            if _failed is not False:
+                _mask &= ~_failed
+        return _mask
+
+    def id_filters(self):
+        """
+        :return IdFilters passing at least every matching frame, None if the expression does not
+                restrict the IDs or leaves the frame type open (write 'std and id == 0x100' for
+                standard IDs up to 0x7FF)
+        """
+        _constraint = _id_constraint(self.tree)
+        if not _constraint or any(_ext is None for _code, _mask, _ext in _constraint):
+            return None
+        if not any(_mask for _code, _mask, _ext in _constraint): # Frame type only, the registers pass both types
+            return None
+        return [IdFilter(_code, _mask & (EXT_MASK if _ext else STD_MASK), _ext) for _code, _mask, _ext in _constraint]
+
+    def acceptance_registers(self):
+        """
+        :return the acceptance code and mask registers passing at least every matching frame
+                (see acceptance_registers()), None if the expression can not be pushed down
+        """
+        _filters = self.id_filters()
+        return acceptance_registers(_filters) if _filters else None
@@ -0,0 +1,115 @@
+import threading
+from lib.FrameArray import RECORD, RECORD_SIZE, unpack_frame
+
+
+class FrameRing:
+    """
+    Fixed-capacity ring of frames stored as packed fixed-width records (see lib.FrameArray).
+
+    Memory is allocated once; when the ring is full the oldest frames are overwritten. Frames are
+    only turned back into CanFrame objects when they are read, so appending costs one struct pack.
+    Appends and reads may happen from different threads.
+    """
+
+    def __init__(self, capacity):
+        """
+        :param capacity the maximum number of frames kept
+        """
+        self.capacity = capacity
+        self.total = 0              # Frames appended since creation (or clear())
+        self._buffer = bytearray(capacity * RECORD_SIZE)
+        self._next = 0              # Slot the next frame is written to
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def extend(self, frames):
+        """
+        Appends frames, overwriting the oldest ones when full
+        """
+        _pack_into = RECORD.pack_into
+        _buffer = self._buffer
+        _capacity = self.capacity
+        with self._lock:
+            _next = self._next
+            _n = 0
+            for _f in frames:
+                _pack_into(_buffer, _next * RECORD_SIZE, _f.timestamp, _f.id, _f.ext | _f.rtr << 1, _f.dlc, _f.data)
+                _next += 1
+                if _next == _capacity:
+                    _next = 0
+                _n += 1
+            self._next = _next
+            self._count = min(_capacity, self._count + _n)
+            self.total += _n
+
+    def append(self, frame):
+        self.extend((frame,))
+
+    def get(self, index):
+        """
+        :param index the position of the frame, 0 being the oldest frame kept
+
+        :return the CanFrame at index
+        """
+        with self._lock:
+            if not 0 <= index < self._count:
+                raise IndexError("FrameRing index out of range")
+            return unpack_frame(self._buffer, self._slot(index) * RECORD_SIZE)
+
+    def slice(self, start, stop):
+        """
+        :return a list of the CanFrame objects from index start up to (not including) stop
+        """
+        with self._lock:
+            start = max(0, start)
+            stop = min(self._count, stop)
+            return [unpack_frame(self._buffer, self._slot(i) * RECORD_SIZE) for i in range(start, stop)]
+
+    def find(self, timestamp):
+        """
+        :return the index of the first frame with a timestamp at or after timestamp (binary search,
+                timestamps are host reception times and do not decrease)
+        """
+        _unpack = RECORD.unpack_from
+        with self._lock:
+            _low, _high = 0, self._count
+            while _low < _high:
+                _mid = (_low + _high) // 2
+                if _unpack(self._buffer, self._slot(_mid) * RECORD_SIZE)[0] < timestamp:
+                    _low = _mid + 1
+                else:
+                    _high = _mid
+            return _low
+
+    def records(self, start, stop):
+        """
+        :return the packed records of the frames from index start up to (not including) stop, as bytes
+        """
+        with self._lock:
+            start = max(0, start)
+            stop = min(self._count, stop)
+            if start >= stop:
+                return b''
+            _first = self._slot(start) * RECORD_SIZE
+            _end = _first + (stop - start) * RECORD_SIZE
+            if _end <= len(self._buffer):
+                return bytes(self._buffer[_first:_end])
+            return bytes(self._buffer[_first:]) + bytes(self._buffer[:_end - len(self._buffer)])
+
+    def snapshot(self):
+        """
+        :return the packed records of all frames kept, oldest first, as bytes
+        """
+        return self.records(0, self.capacity)
+
+    def clear(self):
+        with self._lock:
+            self._next = 0
+            self._count = 0
+            self.total = 0
+
+    def _slot(self, index):
+        return (self._next - self._count + index) % self.capacity
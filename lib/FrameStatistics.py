@@ -0,0 +1,137 @@
+import math
+import threading
+import time
+from lib.IdStats import IdStats, changed_bytes
+
+# Statistics fields of an ID, kept in a list so the receiver thread updates them in place.
+# Same order as the IdStats fields following id and ext.
+_COUNT          = 0
+_BYTES          = 1
+_FIRST          = 2
+_LAST           = 3
+_GAPS           = 4
+_MEAN           = 5
+_M2             = 6
+_MIN            = 7
+_MAX            = 8
+_FIRST_DLC      = 9
+_DLC            = 10
+_DLC_CHANGES    = 11
+_FIRST_DATA     = 12
+_DATA           = 13
+_CHANGED        = 14
+_RTR            = 15
+
+
+class FrameStatistics:
+    """
+    Live per-ID traffic statistics, updated in O(1) time and memory per ID for every frame.
+
+    update() takes a list of frames, so it can be registered directly as a PCAN_RS_232 listener.
+    Per ID it keeps the counts, bytes, the inter-arrival gap mean (the estimated period),
+    variance (jitter, with Welford's algorithm), minimum and maximum, DLC changes and a per-byte
+    change mask; no frames are stored. Queries return IdStats snapshots and can be made from any
+    thread.
+
+    Example:
+        stats = FrameStatistics()
+        pcan.add_listener(stats.update)
+        pcan.start_receiver()
+        ...
+        for s in stats.overdue():   # Cyclic IDs that stopped
+            print("{:X} silent for {:.0f} ms".format(s.id, (time.time() - s.last) * 1000))
+    """
+
+    def __init__(self):
+        self._stats = {}    # (id, ext) -> statistics list
+        self._dirty = set() # Keys updated since the last take_dirty()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._stats)
+
+    def update(self, frames):
+        """
+        Adds received frames to the statistics (listener, called from the receiver thread)
+        """
+        with self._lock:
+            _stats = self._stats
+            _dirty = self._dirty
+            for _f in frames:
+                _key = (_f.id, _f.ext)
+                _s = _stats.get(_key)
+                _ts = _f.timestamp
+                if _s is None:
+                    _stats[_key] = [1, 0 if _f.rtr else _f.dlc, _ts, _ts, 0, 0.0, 0.0, math.inf, 0.0,
+                                    _f.dlc, _f.dlc, 0, _f.data, _f.data, 0, _f.rtr]
+                else:
+                    _gap = _ts - _s[_LAST]
+                    _n = _s[_GAPS] + 1
+                    _delta = _gap - _s[_MEAN]
+                    _mean = _s[_MEAN] + _delta / _n
+                    _s[_M2] += _delta * (_gap - _mean)
+                    _s[_MEAN] = _mean
+                    _s[_GAPS] = _n
+                    if _gap < _s[_MIN]:
+                        _s[_MIN] = _gap
+                    if _gap > _s[_MAX]:
+                        _s[_MAX] = _gap
+                    _s[_COUNT] += 1
+                    _s[_LAST] = _ts
+                    if not _f.rtr:
+                        _s[_BYTES] += _f.dlc
+                    if _f.dlc != _s[_DLC]:
+                        _s[_DLC_CHANGES] += 1
+                        _s[_DLC] = _f.dlc
+                    if _f.data != _s[_DATA]:
+                        _s[_CHANGED] |= changed_bytes(_s[_DATA], _f.data)
+                        _s[_DATA] = _f.data
+                    _s[_RTR] = _f.rtr
+                _dirty.add(_key)
+
+    # =====QUERIES=====
+
+    def get(self, id, ext=False):
+        """
+        :return the IdStats of an ID, None if it has not been received
+        """
+        with self._lock:
+            _s = self._stats.get((id, ext))
+            return None if _s is None else IdStats(id, ext, *_s)
+
+    def snapshot(self):
+        """
+        :return the IdStats of every ID received, sorted by (ext, id)
+        """
+        with self._lock:
+            _items = [(k, tuple(s)) for k, s in self._stats.items()]
+        return [IdStats(k[0], k[1], *s) for k, s in sorted(_items, key=lambda i: (i[0][1], i[0][0]))]
+
+    def take_dirty(self):
+        """
+        :return the (id, ext) keys updated since the previous call
+        """
+        with self._lock:
+            _dirty = self._dirty
+            self._dirty = set()
+        return _dirty
+
+    def overdue(self, now=None, factor=3.0, min_gaps=5):
+        """
+        Finds the cyclic IDs that stopped or are late: silent for more than factor times their period
+
+        :param now the current time, None for time.time() (frame timestamps are host time)
+        :param min_gaps gaps an ID needs before its period is trusted
+
+        :return the IdStats of the overdue IDs, sorted by (ext, id)
+        """
+        _now = time.time() if now is None else now
+        with self._lock:
+            _late = [(k, tuple(s)) for k, s in self._stats.items()
+                     if s[_GAPS] >= min_gaps and _now - s[_LAST] > factor * s[_MEAN]]
+        return [IdStats(k[0], k[1], *s) for k, s in sorted(_late, key=lambda i: (i[0][1], i[0][0]))]
+
+    def clear(self):
+        with self._lock:
+            self._stats = {}
+            self._dirty = set()
@@ -0,0 +1,345 @@
+import threading
+import time
+from queue import Empty, Queue
+from lib.CanFrame import CanFrame
+
+# Protocol control information (upper nibble of the first byte)
+SINGLE_FRAME        = 0x0
+FIRST_FRAME         = 0x1
+CONSECUTIVE_FRAME   = 0x2
+FLOW_CONTROL        = 0x3
+
+# Flow status of a flow control frame
+FC_CONTINUE         = 0x0
+FC_WAIT             = 0x1
+FC_OVERFLOW         = 0x2
+
+
+def st_min_to_seconds(st_min):
+    """
+    Converts an ISO-TP STmin byte to seconds
+
+    :param st_min 0x00-0x7F: 0-127 ms, 0xF1-0xF9: 100-900 us, anything else is reserved (treated as 127 ms)
+    """
+    if st_min <= 0x7F:
+        return st_min / 1000
+    if 0xF1 <= st_min <= 0xF9:
+        return (st_min - 0xF0) / 10000
+    return 0.127
+
+
+class ISOTPSession:
+    """
+    One ISO-TP (ISO 15765-2) connection between a transmit and a receive CAN ID.
+
+    Sessions are created with ISOTP.open_session(). send() segments a payload into single,
+    first and consecutive frames and follows the flow control of the receiver; recv() returns
+    the next payload reassembled from frames on the receive ID.
+    """
+
+    def __init__(self, isotp, tx_id, rx_id, ext=False, block_size=0, st_min=0, padding=0xCC,
+                 batch=True, max_batch=16, timeout=1, max_wait_frames=10, max_length=0xFFFFFFFF):
+        """
+        :param isotp the ISOTP layer owning this session
+        :param tx_id the CAN ID used to send frames
+        :param rx_id the CAN ID frames are received on
+        :param ext True if the IDs are extended (29-bit) identifiers
+        :param block_size the block size advertised when receiving (0: no further flow control)
+        :param st_min the STmin byte advertised when receiving
+        :param padding byte value used to pad frames to 8 bytes, None to send frames unpadded
+        :param batch True to send the consecutive frames of a block in as few serial writes as the
+                     receiver's STmin allows, False to send one frame per write
+        :param max_batch largest number of consecutive frames in one write (keep within the PCAN transmit FIFO)
+        :param timeout seconds to wait for flow control or the next consecutive frame (N_Bs/N_Cr)
+        :param max_wait_frames number of FC.WAIT frames accepted in a row before giving up
+        :param max_length largest payload accepted when receiving; longer ones are refused with FC.OVFLW
+        """
+        self.isotp = isotp
+        self.tx_id = tx_id
+        self.rx_id = rx_id
+        self.ext = ext
+        self.block_size = block_size
+        self.st_min = st_min
+        self.padding = padding
+        self.batch = batch
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.max_wait_frames = max_wait_frames
+        self.max_length = max_length
+
+        self._rx_queue = Queue()    # Reassembled payloads
+        self._fc_queue = Queue()    # Flow control frames received while sending
+        self._send_lock = threading.Lock()
+
+        # Reassembly state, only touched by the receiver thread
+        self._rx_buffer = None
+        self._rx_length = 0
+        self._rx_sn = 0
+        self._rx_block = 0
+        self._rx_deadline = 0.0
+
+    # =====SEND=====
+
+    def send(self, payload):
+        """
+        Sends a payload, segmenting it if it does not fit in a single frame
+
+        :param payload the data to send as bytes, bytearray or a list of ints
+
+        :return -1 if an ERROR occurs (frame rejected, flow control timeout or overflow)
+        :return 1 if the payload was sent
+        """
+        payload = bytes(payload)
+        _len = len(payload)
+        with self._send_lock:
+            if _len <= 7: # Fits in a single frame
+                return self._transmit([self._frame(bytes((SINGLE_FRAME << 4 | _len,)) + payload)])
+
+            self._drain(self._fc_queue)
+            if _len <= 0xFFF:
+                _ff = bytes((FIRST_FRAME << 4 | _len >> 8, _len & 0xFF)) + payload[:6]
+                _pos = 6
+            else: # Escape sequence with a 32-bit length
+                _ff = bytes((FIRST_FRAME << 4, 0)) + _len.to_bytes(4, 'big') + payload[:2]
+                _pos = 2
+            if self._transmit([self._frame(_ff)]) == -1:
+                return -1
+
+            _sn = 1
+            while _pos < _len:
+                _fc = self._wait_flow_control()
+                if _fc is None:
+                    return -1
+                _bs, _st_min = _fc
+
+                # Build the consecutive frames of this block
+                _frames = []
+                while _pos < _len and (_bs == 0 or len(_frames) < _bs):
+                    _frames.append(self._frame(bytes((CONSECUTIVE_FRAME << 4 | _sn,)) + payload[_pos:_pos + 7]))
+                    _pos += 7
+                    _sn = (_sn + 1) & 0xF
+
+                if self._send_block(_frames, st_min_to_seconds(_st_min)) == -1:
+                    return -1
+            return 1
+
+    def _send_block(self, frames, st_min):
+        """
+        Sends the consecutive frames of one block while respecting the receiver's STmin.
+
+        The serial link already spaces frames by their transfer time, so when that time is at
+        least STmin the block can go out in writes of up to max_batch frames. Otherwise frames are
+        sent one per write with STmin between them.
+        """
+        if not self.batch:
+            _group = 1
+        elif st_min == 0:
+            _group = self.max_batch
+        else:
+            _frame_time = len(frames[0].to_message()) * 10 / self.isotp.pcan.baudrate
+            _group = self.max_batch if _frame_time >= st_min else 1
+
+        for i in range(0, len(frames), _group):
+            if i and st_min and _group == 1:
+                time.sleep(st_min)
+            if self._transmit(frames[i:i + _group]) == -1:
+                return -1
+        return 1
+
+    def _wait_flow_control(self):
+        """
+        Waits for a flow control frame that allows sending to continue
+
+        :return None if an ERROR occurs (timeout, overflow or too many waits)
+        :return a tuple with the block size and STmin of the receiver
+        """
+        _waits = 0
+        while True:
+            try:
+                _data = self._fc_queue.get(timeout=self.timeout)
+            except Empty:
+                return None
+            _status = _data[0] & 0x0F
+            if _status == FC_CONTINUE:
+                return (_data[1], _data[2]) if len(_data) >= 3 else (0, 0)
+            if _status == FC_WAIT and _waits < self.max_wait_frames:
+                _waits += 1
+                continue
+            return None # Overflow, reserved status or too many waits
+
+    # =====RECEIVE=====
+
+    def recv(self, timeout=None):
+        """
+        Returns the next payload received on this session
+
+        :param timeout seconds to wait for a payload, None to use the session timeout
+
+        :return -1 if no payload was received in time
+        :return the payload as bytes
+        """
+        try:
+            return self._rx_queue.get(timeout=self.timeout if timeout is None else timeout)
+        except Empty:
+            return -1
+
+    def _on_frame(self, frame):
+        """
+        Handles a frame received on rx_id (called from the receiver thread)
+        """
+        _data = frame.data
+        if not _data:
+            return
+        _pci = _data[0] >> 4
+        if _pci == CONSECUTIVE_FRAME:
+            if self._rx_buffer is None:
+                return # Not expecting one
+            if time.monotonic() > self._rx_deadline or _data[0] & 0x0F != self._rx_sn:
+                self._rx_buffer = None # Timed out or lost a frame, abort the reception
+                return
+            self._rx_buffer += _data[1:1 + self._rx_length - len(self._rx_buffer)]
+            self._rx_sn = (self._rx_sn + 1) & 0xF
+            if len(self._rx_buffer) >= self._rx_length:
+                self._rx_queue.put(bytes(self._rx_buffer))
+                self._rx_buffer = None
+                return
+            self._rx_deadline = time.monotonic() + self.timeout
+            self._rx_block += 1
+            if self.block_size and self._rx_block >= self.block_size: # Block done, allow the next one
+                self._rx_block = 0
+                self.isotp._queue_transmit(self, [self._flow_control(FC_CONTINUE)])
+        elif _pci == SINGLE_FRAME:
+            _len = _data[0] & 0x0F
+            if 0 < _len <= len(_data) - 1:
+                self._rx_queue.put(bytes(_data[1:1 + _len]))
+        elif _pci == FIRST_FRAME:
+            _len = (_data[0] & 0x0F) << 8 | _data[1]
+            _start = 2
+            if _len == 0: # Escape sequence with a 32-bit length
+                _len = int.from_bytes(_data[2:6], 'big')
+                _start = 6
+            if _len > self.max_length:
+                self.isotp._queue_transmit(self, [self._flow_control(FC_OVERFLOW)])
+                return
+            self._rx_buffer = bytearray(_data[_start:])
+            self._rx_length = _len
+            self._rx_sn = 1
+            self._rx_block = 0
+            self._rx_deadline = time.monotonic() + self.timeout
+            self.isotp._queue_transmit(self, [self._flow_control(FC_CONTINUE)])
+        elif _pci == FLOW_CONTROL:
+            self._fc_queue.put(_data)
+
+    # =====UTILITY=====
+
+    def _frame(self, data):
+        if self.padding is not None and len(data) < 8:
+            data += bytes((self.padding,)) * (8 - len(data))
+        return CanFrame(self.tx_id, self.ext, False, len(data), data)
+
+    def _flow_control(self, status):
+        return self._frame(bytes((FLOW_CONTROL << 4 | status, self.block_size, self.st_min)))
+
+    def _transmit(self, frames):
+        return self.isotp.pcan.transmit_frames(frames)
+
+    @staticmethod
+    def _drain(queue):
+        while not queue.empty():
+            try: queue.get_nowait()
+            except Empty: break
+
+
+class ISOTP:
+    """
+    ISO-TP (ISO 15765-2) transport layer on top of a PCAN_RS_232.
+
+    Frames are taken from the PCAN receiver thread and routed to the session listening on
+    their ID, so any number of sessions (keyed by tx_id and rx_id) can transfer concurrently.
+    Flow control frames are transmitted from a worker thread, never from the receiver thread,
+    since a transmit has to wait for an acknowledgement that the receiver thread delivers.
+
+    Example:
+        isotp = ISOTP(pcan)
+        ecu = isotp.open_session(0x7E0, 0x7E8)
+        ecu.send(b'\\x22\\xF1\\x90')
+        vin = ecu.recv()
+    """
+
+    def __init__(self, pcan):
+        """
+        :param pcan the PCAN_RS_232 to transfer over. Its receiver thread is started if needed.
+        """
+        self.pcan = pcan
+        self._sessions = {}         # (tx_id, rx_id) -> ISOTPSession
+        self._by_rx = {}            # (rx_id, ext) -> ISOTPSession, for routing received frames
+        self._tx_queue = Queue()    # (session, frames) flow control to transmit
+        self._alive = True
+        self._tx_thread = threading.Thread(target=self._transmitter, name='isotp-tx')
+        self._tx_thread.daemon = True
+        self._tx_thread.start()
+        self.pcan.add_listener(self._on_frames)
+        self.pcan.start_receiver()
+
+    def open_session(self, tx_id, rx_id, **kwargs):
+        """
+        Opens a session between two CAN IDs. See ISOTPSession for the keyword arguments.
+
+        :raise ValueError if another session already receives on rx_id
+
+        :return the new ISOTPSession
+        """
+        _ext = kwargs.get('ext', tx_id > 0x7FF or rx_id > 0x7FF)
+        kwargs['ext'] = _ext
+        if (rx_id, _ext) in self._by_rx:
+            raise ValueError("A session already receives on ID {:X}".format(rx_id))
+        _session = ISOTPSession(self, tx_id, rx_id, **kwargs)
+        self._sessions[(tx_id, rx_id)] = _session
+        _by_rx = dict(self._by_rx) # Copy on write so the receiver thread can route without locking
+        _by_rx[(rx_id, _ext)] = _session
+        self._by_rx = _by_rx
+        return _session
+
+    def get_session(self, tx_id, rx_id):
+        """
+        :return the open session for the ID pair, or None
+        """
+        return self._sessions.get((tx_id, rx_id))
+
+    def close_session(self, session):
+        """
+        Closes a session, frames on its receive ID are ignored afterwards
+        """
+        self._sessions.pop((session.tx_id, session.rx_id), None)
+        _by_rx = dict(self._by_rx)
+        _by_rx.pop((session.rx_id, session.ext), None)
+        self._by_rx = _by_rx
+
+    def close(self):
+        """
+        Closes all sessions and stops the flow control worker
+        """
+        self.pcan.remove_listener(self._on_frames)
+        self._sessions.clear()
+        self._by_rx = {}
+        self._alive = False
+        self._tx_queue.put(None)
+        self._tx_thread.join()
+
+    def _on_frames(self, frames):
+        _by_rx = self._by_rx
+        for _frame in frames:
+            _session = _by_rx.get((_frame.id, _frame.ext))
+            if _session is not None and not _frame.rtr:
+                _session._on_frame(_frame)
+
+    def _queue_transmit(self, session, frames):
+        self._tx_queue.put((session, frames))
+
+    def _transmitter(self):
+        while self._alive:
+            _item = self._tx_queue.get()
+            if _item is None:
+                break
+            _session, _frames = _item
+            _session._transmit(_frames)
@@ -0,0 +1,128 @@
+import math
+from typing import NamedTuple
+
+
+class IdStats(NamedTuple):
+    """
+    Traffic statistics of one CAN ID. Gap statistics use Welford's mean and sum of squared
+    deviations (m2), so statistics of consecutive stretches of traffic merge exactly (see merge()).
+
+    :param id the CAN identifier
+    :param ext True for an extended (29-bit) identifier
+    :param count frames received
+    :param bytes payload bytes received (request frames carry none)
+    :param first timestamp of the first frame
+    :param last timestamp of the last frame
+    :param gaps number of inter-arrival gaps measured (count - 1)
+    :param mean_gap mean inter-arrival gap in seconds (the estimated period)
+    :param m2 sum of squared deviations of the gaps from mean_gap
+    :param min_gap smallest gap in seconds, inf before the second frame
+    :param max_gap largest gap in seconds
+    :param first_dlc DLC of the first frame
+    :param dlc DLC of the last frame
+    :param dlc_changes number of times the DLC differed from the previous frame
+    :param first_data payload of the first frame
+    :param data payload of the last frame
+    :param changed per-byte change mask, bit i set once byte i differed from the previous frame (see changed_bytes())
+    :param rtr True if the last frame was a remote request
+    """
+    id: int
+    ext: bool
+    count: int = 0
+    bytes: int = 0
+    first: float = 0.0
+    last: float = 0.0
+    gaps: int = 0
+    mean_gap: float = 0.0
+    m2: float = 0.0
+    min_gap: float = math.inf
+    max_gap: float = 0.0
+    first_dlc: int = 0
+    dlc: int = 0
+    dlc_changes: int = 0
+    first_data: bytes = b''
+    data: bytes = b''
+    changed: int = 0
+    rtr: bool = False
+
+    @property
+    def period(self):
+        """
+        :return the estimated period in seconds, None before the second frame
+        """
+        return self.mean_gap if self.gaps else None
+
+    @property
+    def jitter(self):
+        """
+        :return the standard deviation of the gaps in seconds, None before the second frame
+        """
+        return math.sqrt(self.m2 / self.gaps) if self.gaps else None
+
+    @property
+    def rate(self):
+        """
+        :return the mean frame rate in frames/s, None before the second frame
+        """
+        return self.gaps / (self.last - self.first) if self.gaps and self.last > self.first else None
+
+    @property
+    def changed_text(self):
+        """
+        :return the change mask with one character per byte, e.g. 'xx.....x' (bytes 0, 1 and 7 changed)
+        """
+        return ''.join('x' if self.changed >> i & 1 else '.' for i in range(8))
+
+    def __str__(self):
+        _id = "{:08X}".format(self.id) if self.ext else "{:03X}".format(self.id)
+        if not self.gaps:
+            return "{:>8}  {:>9}".format(_id, self.count)
+        return "{:>8}  {:>9}  {:9.3f} ms  jitter {:8.3f} ms  gap {:8.3f}-{:<9.3f} ms  DLC changes {:<6}  bytes {}".format(
+            _id, self.count, self.mean_gap * 1000, self.jitter * 1000, self.min_gap * 1000, self.max_gap * 1000,
+            self.dlc_changes, self.changed_text)
+
+
+def changed_bytes(previous, data):
+    """
+    :return a mask with bit i set if byte i of the payloads differs (missing bytes count as 0)
+    """
+    _x = int.from_bytes(previous, 'little') ^ int.from_bytes(data, 'little')
+    if not _x:
+        return 0
+    _x |= _x >> 4 # Fold every byte into its lowest bit...
+    _x |= _x >> 2
+    _x |= _x >> 1
+    _x &= 0x0101010101010101
+    return ((_x * 0x0102040810204080) >> 56) & 0xFF # ...and gather those bits into one byte
+
+
+def _combine(n1, mean1, m2_1, n2, mean2, m2_2):
+    """
+    Chan's parallel combination of two (count, mean, m2) triples
+    """
+    _n = n1 + n2
+    if not _n:
+        return 0, 0.0, 0.0
+    _delta = mean2 - mean1
+    return _n, mean1 + _delta * n2 / _n, m2_1 + m2_2 + _delta * _delta * n1 * n2 / _n
+
+
+def merge(a, b):
+    """
+    Merges the statistics of one ID over two consecutive stretches of traffic, a before b.
+    The gap between the last frame of a and the first frame of b is counted too. The merge is
+    associative, so per-chunk statistics can be reduced in any grouping as long as the order is kept.
+
+    :return the IdStats of the combined traffic
+    """
+    if not a.count:
+        return b
+    if not b.count:
+        return a
+    _gap = b.first - a.last
+    _n, _mean, _m2 = _combine(a.gaps, a.mean_gap, a.m2, 1, _gap, 0.0)
+    _n, _mean, _m2 = _combine(_n, _mean, _m2, b.gaps, b.mean_gap, b.m2)
+    return IdStats(a.id, a.ext, a.count + b.count, a.bytes + b.bytes, a.first, b.last, _n, _mean, _m2,
+                   min(a.min_gap, b.min_gap, _gap), max(a.max_gap, b.max_gap, _gap), a.first_dlc, b.dlc,
+                   a.dlc_changes + b.dlc_changes + (a.dlc != b.first_dlc), a.first_data, b.data,
+                   a.changed | b.changed | changed_bytes(a.data, b.first_data), b.rtr)
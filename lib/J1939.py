@@ -0,0 +1,333 @@
+import threading
+import time
+from collections import OrderedDict
+from queue import Queue
+from typing import NamedTuple
+from lib.CanFrame import CanFrame
+
+# Parameter group numbers used by the network layer
+PGN_REQUEST         = 0xEA00
+PGN_ADDRESS_CLAIMED = 0xEE00
+PGN_TP_CM           = 0xEC00
+PGN_TP_DT           = 0xEB00
+
+# TP.CM control bytes
+TP_CM_RTS           = 16
+TP_CM_CTS           = 17
+TP_CM_EOM_ACK       = 19
+TP_CM_BAM           = 32
+TP_CM_ABORT         = 255
+
+# TP.CM abort reasons
+ABORT_BUSY          = 1
+ABORT_RESOURCES     = 2
+ABORT_TIMEOUT       = 3
+
+GLOBAL_ADDRESS      = 0xFF
+NULL_ADDRESS        = 0xFE
+MAX_TP_SIZE         = 1785  # 255 packets of 7 bytes
+
+
+class J1939Message(NamedTuple):
+    """
+    A J1939 parameter group, either from a single frame or reassembled by the transport protocol
+    """
+    priority: int
+    pgn: int
+    sa: int
+    da: int
+    data: bytes
+    timestamp: float = 0.0
+
+
+def _build_id_table():
+    """
+    Precomputes (priority, PGN without PS, PDU1 format) for the upper 13 bits of a 29-bit ID
+    """
+    _table = []
+    for _hi in range(1 << 13):
+        _pf = _hi & 0xFF
+        _pgn = (_hi & 0x300) << 8 | _pf << 8 # Extended data page, data page and PDU format
+        _table.append((_hi >> 10, _pgn, _pf < 240))
+    return _table
+
+_ID_TABLE = _build_id_table()
+
+
+def parse_id(id):
+    """
+    Splits a 29-bit identifier into its J1939 fields
+
+    :return a tuple with priority, PGN, source address and destination address
+            (GLOBAL_ADDRESS for PDU2 parameter groups)
+    """
+    _priority, _pgn, _pdu1 = _ID_TABLE[id >> 16]
+    _ps = (id >> 8) & 0xFF
+    if _pdu1:
+        return (_priority, _pgn, id & 0xFF, _ps)
+    return (_priority, _pgn | _ps, id & 0xFF, GLOBAL_ADDRESS)
+
+
+def build_id(priority, pgn, sa, da=GLOBAL_ADDRESS):
+    """
+    Builds a 29-bit identifier from its J1939 fields
+    """
+    if (pgn >> 8) & 0xFF < 240: # PDU1, the destination address goes into PS
+        pgn = (pgn & 0x3FF00) | da
+    return (priority & 7) << 26 | pgn << 8 | sa
+
+
+class _TPSession:
+    """
+    Reassembly state of one BAM or CMDT transfer
+    """
+    __slots__ = ('pgn', 'size', 'packets', 'buffer', 'next_seq', 'window_end', 'max_per_cts', 'deadline', 'priority', 'bam')
+
+    def __init__(self, pgn, size, packets, priority, bam, max_per_cts):
+        self.pgn = pgn
+        self.size = size
+        self.packets = packets
+        self.buffer = bytearray()
+        self.next_seq = 1
+        self.window_end = 0
+        self.max_per_cts = max_per_cts
+        self.deadline = 0.0
+        self.priority = priority
+        self.bam = bam
+
+
+class J1939:
+    """
+    J1939 network layer on top of a PCAN_RS_232.
+
+    Extended frames from the receiver thread are split into priority/PGN/SA/DA (cached per ID on
+    top of a precomputed table) and TP.BAM/TP.CMDT transfers are reassembled, with one session per
+    (source, destination) pair. Memory is bounded: at most max_sessions transfers are tracked
+    (the oldest is dropped first), transfers are limited to MAX_TP_SIZE bytes and stalled ones
+    expire after the J1939-21 timeouts. CTS, end of message acknowledgements and address claims
+    are transmitted from a worker thread, never from the receiver thread.
+
+    Example:
+        j1939 = J1939(pcan, address=0xF9, name=0x0123456789ABCDEF)
+        j1939.add_listener(lambda msgs: [print(m) for m in msgs if m.pgn == 0xFECA]) # DM1
+        j1939.claim_address()
+    """
+    T1 = 0.75   # Max gap between BAM data packets (s)
+    T2 = 1.25   # Max wait for data after a CTS (s)
+
+    def __init__(self, pcan, address=NULL_ADDRESS, name=0, max_sessions=64, packets_per_cts=16):
+        """
+        :param pcan the PCAN_RS_232 to use. Its receiver thread is started if needed.
+        :param address our source address, CMDT transfers to it are answered with CTS
+        :param name our 64-bit NAME, used for address claiming
+        :param max_sessions the maximum number of concurrent transport protocol transfers
+        :param packets_per_cts the number of packets requested with each CTS
+        """
+        self.pcan = pcan
+        self.address = address
+        self.name = name
+        self.max_sessions = max_sessions
+        self.packets_per_cts = packets_per_cts
+
+        self._listeners = []
+        self._id_cache = {}             # 29-bit ID -> parse_id() result
+        self._sessions = OrderedDict()  # (sa, da) -> _TPSession, oldest first
+        self._tx_queue = Queue()
+        self._alive = True
+        self._tx_thread = threading.Thread(target=self._transmitter, name='j1939-tx')
+        self._tx_thread.daemon = True
+        self._tx_thread.start()
+        self.pcan.add_listener(self._on_frames)
+        self.pcan.start_receiver()
+
+    def add_listener(self, callback):
+        """
+        Registers a callback for received parameter groups
+
+        :param callback called from the receiver thread with a list of J1939Message objects
+        """
+        self._listeners = self._listeners + [callback]
+
+    def remove_listener(self, callback):
+        self._listeners = [l for l in self._listeners if l != callback]
+
+    def close(self):
+        """
+        Stops listening and stops the transmit worker
+        """
+        self.pcan.remove_listener(self._on_frames)
+        self._alive = False
+        self._tx_queue.put(None)
+        self._tx_thread.join()
+
+    # =====TRANSMIT=====
+
+    def send(self, pgn, data, da=GLOBAL_ADDRESS, priority=6):
+        """
+        Sends a parameter group from our address. Up to 8 bytes go in a single frame,
+        larger ones are broadcast with TP.BAM (blocking, 50 ms between data packets).
+
+        :return -1 if an ERROR occurs
+        :return 1 if the parameter group was sent
+        """
+        data = bytes(data)
+        if len(data) <= 8:
+            return self.pcan.transmit_frames([self._frame(priority, pgn, GLOBAL_ADDRESS if da is None else da, data)])
+        if len(data) > MAX_TP_SIZE:
+            return -1
+        _packets = -(-len(data) // 7)
+        _cm = bytes((TP_CM_BAM, len(data) & 0xFF, len(data) >> 8, _packets, 0xFF)) + pgn.to_bytes(3, 'little')
+        if self.pcan.transmit_frames([self._frame(7, PGN_TP_CM, GLOBAL_ADDRESS, _cm)]) == -1:
+            return -1
+        for _seq in range(1, _packets + 1):
+            time.sleep(0.05)
+            _chunk = data[(_seq - 1) * 7:_seq * 7].ljust(7, b'\xFF')
+            if self.pcan.transmit_frames([self._frame(7, PGN_TP_DT, GLOBAL_ADDRESS, bytes((_seq,)) + _chunk)]) == -1:
+                return -1
+        return 1
+
+    def claim_address(self, address=None):
+        """
+        Sends an address claim for our NAME
+
+        :param address the address to claim, None to claim the current one
+
+        :return -1 if an ERROR occurs
+        :return 1 if the claim was sent
+        """
+        if address is not None:
+            self.address = address
+        return self.pcan.transmit_frames([self._address_claim()])
+
+    def _frame(self, priority, pgn, da, data):
+        return CanFrame(build_id(priority, pgn, self.address, da), True, False, len(data), data)
+
+    def _address_claim(self):
+        return self._frame(6, PGN_ADDRESS_CLAIMED, GLOBAL_ADDRESS, self.name.to_bytes(8, 'little'))
+
+    def _transmitter(self):
+        while self._alive:
+            _frame = self._tx_queue.get()
+            if _frame is None:
+                break
+            self.pcan.transmit_frames([_frame])
+
+    # =====RECEIVE=====
+
+    def _on_frames(self, frames):
+        _messages = []
+        _cache = self._id_cache
+        for _frame in frames:
+            if not _frame.ext or _frame.rtr:
+                continue
+            _fields = _cache.get(_frame.id)
+            if _fields is None:
+                if len(_cache) > 4096: # Bound the cache on buses with many IDs
+                    _cache.clear()
+                _fields = _cache[_frame.id] = parse_id(_frame.id)
+            _priority, _pgn, _sa, _da = _fields
+
+            if _pgn == PGN_TP_DT:
+                _msg = self._on_tp_dt(_sa, _da, _frame)
+            elif _pgn == PGN_TP_CM:
+                _msg = self._on_tp_cm(_priority, _sa, _da, _frame)
+            else:
+                if _pgn == PGN_ADDRESS_CLAIMED:
+                    self._on_address_claim(_sa, _frame.data)
+                elif _pgn == PGN_REQUEST and _frame.data[:3] == PGN_ADDRESS_CLAIMED.to_bytes(3, 'little') \
+                        and _da in (self.address, GLOBAL_ADDRESS) and self.address != NULL_ADDRESS:
+                    self._tx_queue.put(self._address_claim())
+                _msg = J1939Message(_priority, _pgn, _sa, _da, _frame.data, _frame.timestamp)
+            if _msg is not None:
+                _messages.append(_msg)
+
+        if _messages:
+            for _listener in self._listeners:
+                _listener(_messages)
+
+    def _on_address_claim(self, sa, data):
+        """
+        Gives up our address if another node with a higher priority (lower) NAME claims it
+        """
+        if sa == self.address and sa != NULL_ADDRESS and int.from_bytes(data[:8], 'little') < self.name:
+            self.address = NULL_ADDRESS
+            self._tx_queue.put(self._address_claim()) # Cannot claim address
+
+    def _on_tp_cm(self, priority, sa, da, frame):
+        _data = frame.data
+        if len(_data) < 8:
+            return None
+        _control = _data[0]
+        _pgn = int.from_bytes(_data[5:8], 'little')
+        _key = (sa, da)
+
+        if _control == TP_CM_BAM or (_control == TP_CM_RTS and da == self.address):
+            _size = _data[1] | _data[2] << 8
+            _packets = _data[3]
+            if _size > MAX_TP_SIZE or _packets * 7 < _size:
+                if _control == TP_CM_RTS:
+                    self._abort(sa, _pgn, ABORT_RESOURCES)
+                return None
+            self._expire_sessions()
+            if _key in self._sessions:
+                del self._sessions[_key] # A new announcement replaces an unfinished transfer
+            while len(self._sessions) >= self.max_sessions: # Bounded memory, drop the oldest transfer
+                self._sessions.popitem(last=False)
+            _bam = _control == TP_CM_BAM
+            _max = _data[4] if not _bam and _data[4] != 0xFF else _packets
+            _session = _TPSession(_pgn, _size, _packets, priority, _bam, min(_max, self.packets_per_cts))
+            _session.deadline = time.monotonic() + (self.T1 if _bam else self.T2)
+            self._sessions[_key] = _session
+            if not _bam:
+                self._send_cts(sa, _session)
+        elif _control == TP_CM_ABORT:
+            self._sessions.pop((da, sa), None) # Sender aborted its transfer to us
+            self._sessions.pop(_key, None)
+        return None
+
+    def _on_tp_dt(self, sa, da, frame):
+        _key = (sa, da)
+        _session = self._sessions.get(_key)
+        _data = frame.data
+        if _session is None or not _data:
+            return None
+        _now = time.monotonic()
+        if _now > _session.deadline or _data[0] != _session.next_seq: # Stalled or lost a packet
+            del self._sessions[_key]
+            if not _session.bam:
+                self._abort(sa, _session.pgn, ABORT_TIMEOUT)
+            return None
+
+        _session.buffer += _data[1:8]
+        _session.next_seq += 1
+        _session.deadline = _now + (self.T1 if _session.bam else self.T2)
+
+        if _session.next_seq > _session.packets: # Complete
+            del self._sessions[_key]
+            if not _session.bam:
+                _ack = bytes((TP_CM_EOM_ACK, _session.size & 0xFF, _session.size >> 8, _session.packets, 0xFF)) \
+                    + _session.pgn.to_bytes(3, 'little')
+                self._tx_queue.put(self._frame(7, PGN_TP_CM, sa, _ack))
+            return J1939Message(_session.priority, _session.pgn, sa, da, bytes(_session.buffer[:_session.size]), frame.timestamp)
+
+        if not _session.bam and _session.next_seq > _session.window_end: # Window done, ask for the next one
+            self._send_cts(sa, _session)
+        return None
+
+    def _send_cts(self, sa, session):
+        _count = min(session.max_per_cts, session.packets - session.next_seq + 1)
+        session.window_end = session.next_seq + _count - 1
+        _cts = bytes((TP_CM_CTS, _count, session.next_seq, 0xFF, 0xFF)) + session.pgn.to_bytes(3, 'little')
+        self._tx_queue.put(self._frame(7, PGN_TP_CM, sa, _cts))
+
+    def _abort(self, sa, pgn, reason):
+        _abort = bytes((TP_CM_ABORT, reason, 0xFF, 0xFF, 0xFF)) + pgn.to_bytes(3, 'little')
+        self._tx_queue.put(self._frame(7, PGN_TP_CM, sa, _abort))
+
+    def _expire_sessions(self):
+        """
+        Drops transfers that have stalled past their timeout
+        """
+        _now = time.monotonic()
+        for _key in [k for k, s in self._sessions.items() if s.deadline < _now]:
+            del self._sessions[_key]
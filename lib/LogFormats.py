@@ -0,0 +1,475 @@
+import itertools
+import math
+import os
+import re
+import time
+from datetime import datetime
+from lib.CanFrame import CanFrame
+
+# Streaming readers and writers for text log formats: candump log (.log), Vector ASC (.asc),
+# PCAN-View TRC (.trc) and CSV (.csv). Readers parse large chunks of text with one precompiled
+# regex (or split() where the layout allows) instead of handling one line at a time, and writers
+# render and write frames in chunks, so files of any size are converted in constant memory.
+
+INTERFACE   = 'pcan0'   # Interface name written to candump logs
+CHUNK_SIZE  = 1 << 20   # Characters parsed per chunk
+WRITE_BATCH = 4096      # Frames rendered per write
+OLE_EPOCH   = 25569     # Days between 1899-12-30 (TRC start time epoch) and 1970-01-01
+
+
+def _chunks(stream, size=CHUNK_SIZE):
+    """
+    Yields the text of stream in chunks of about size characters, each ending at a line end
+    """
+    _rest = ''
+    while True:
+        _data = stream.read(size)
+        if not _data:
+            if _rest:
+                yield _rest + '\n'
+            return
+        _data = _rest + _data
+        _end = _data.rfind('\n') + 1
+        if _end == 0: # Line longer than a chunk, keep reading
+            _rest = _data
+            continue
+        _rest = _data[_end:]
+        yield _data[:_end]
+
+
+class ReadErrors:
+    """
+    Counts the malformed frame lines a reader skipped, keeping the first few for error messages.
+    Lines that are not frame records (comments, headers, events, error and CAN FD frames) are
+    ignored without being counted.
+    """
+
+    def __init__(self, keep=3):
+        self.count = 0
+        self.lines = []     # The first keep malformed lines
+        self.keep = keep
+
+    def add(self, line):
+        self.count += 1
+        if len(self.lines) < self.keep:
+            self.lines.append(line.strip())
+
+
+def _batches(frames, size=WRITE_BATCH):
+    _frames = iter(frames)
+    while True:
+        _batch = list(itertools.islice(_frames, size))
+        if not _batch:
+            return
+        yield _batch
+
+
+# =====CANDUMP=====
+
+_CANDUMP_RE = re.compile(r'\((\d+\.\d+)\)[ \t]+\S+[ \t]+([0-9A-Fa-f]{1,8})#(?:(R)(\d?)|([0-9A-Fa-f.]*))(?=[ \t]|$)')
+
+
+def candump_data(frame):
+    """
+    :return the frame in candump notation, e.g. '123#DEADBEEF', '12345678#R' or '123#R4'
+    """
+    _id = "{:08X}".format(frame.id) if frame.ext else "{:03X}".format(frame.id)
+    if frame.rtr:
+        return _id + ('#R' if frame.dlc == 0 else '#R{}'.format(frame.dlc))
+    return _id + '#' + frame.data.hex().upper()
+
+
+def candump_log(frame, timestamp=None):
+    """
+    :return the candump log line (candump -L) of a frame, stamped with the host time unless given
+    """
+    return "({:.6f}) {} {}\n".format(frame.timestamp if timestamp is None else timestamp, INTERFACE, candump_data(frame))
+
+
+def read_candump(stream, errors=None):
+    """
+    Yields the frames of a candump log (candump -L / log2asc input). CAN FD frames are skipped.
+
+    :param errors an optional ReadErrors counting the malformed lines, which are skipped
+    """
+    for _chunk in _chunks(stream):
+        _tokens = _chunk.split()
+        if len(_tokens) == 3 * _chunk.count('\n'):
+            try:
+                _frames = _candump_triplets(_tokens)
+            except ValueError: # Not one well-formed frame per line after all, e.g. a three word comment
+                _frames = None
+            if _frames is not None:
+                yield from _frames
+                continue
+        yield from _candump_lines(_chunk, errors)
+
+
+def _candump_triplets(tokens):
+    """
+    :return the frames of a chunk with one (timestamp) interface id#data triplet per line,
+            walking the tokens without splitting lines
+    :raise ValueError if a triplet is not a frame
+    """
+    _make = CanFrame._make
+    _fromhex = bytes.fromhex
+    _frames = []
+    for _ts, _frame in zip(tokens[0::3], tokens[2::3]):
+        if _ts[:1] != '(':
+            raise ValueError("Not a candump timestamp: {}".format(_ts))
+        _id, _sep, _data = _frame.partition('#')
+        if _data[:1] == 'R':
+            _frames.append(_make((int(_id, 16), len(_id) > 3, True, int(_data[1:] or 0), b'', float(_ts[1:-1]), None)))
+        elif _data[:1] != '#': # CAN FD
+            _bytes = _fromhex(_data) if '.' not in _data else _fromhex(_data.replace('.', ''))
+            _frames.append(_make((int(_id, 16), len(_id) > 3, False, len(_bytes), _bytes, float(_ts[1:-1]), None)))
+    return _frames
+
+
+def _candump_lines(chunk, errors):
+    """
+    Yields the frames of a chunk line by line, skipping blank lines and comments and counting malformed lines
+    """
+    _make = CanFrame._make
+    _fromhex = bytes.fromhex
+    _match = _CANDUMP_RE.match
+    for _line in chunk.splitlines():
+        _line = _line.strip()
+        if _line[:1] != '(': # Blank line or comment
+            continue
+        _m = _match(_line)
+        try:
+            if _m is None:
+                if '##' in _line: # CAN FD
+                    continue
+                raise ValueError(_line)
+            _ts, _id, _rtr, _rtr_dlc, _data = _m.groups()
+            if _rtr:
+                yield _make((int(_id, 16), len(_id) > 3, True, int(_rtr_dlc or 0), b'', float(_ts), None))
+            else:
+                _bytes = _fromhex(_data.replace('.', ''))
+                yield _make((int(_id, 16), len(_id) > 3, False, len(_bytes), _bytes, float(_ts), None))
+        except ValueError:
+            if errors is not None:
+                errors.add(_line)
+
+
+def write_candump(frames, stream):
+    """
+    :return the number of frames written
+    """
+    _n = 0
+    for _batch in _batches(frames):
+        stream.write(''.join(map(candump_log, _batch)))
+        _n += len(_batch)
+    return _n
+
+
+# =====VECTOR ASC=====
+
+_ASC_RE = re.compile(r'^[ \t]*(\d+\.\d+)[ \t]+\d+[ \t]+([0-9A-Fa-f]+)(x?)[ \t]+(?:Rx|Tx)[ \t]+'
+                     r'(?:(r)(?:[ \t]+([0-9A-Fa-f]))?|d[ \t]+([0-9A-Fa-f])((?:[ \t]+[0-9A-Fa-f]{2})*))', re.M)
+_ASC_DATE_RE = re.compile(r'^date\s+(.+?)\s*$', re.M)
+_ASC_RELATIVE_RE = re.compile(r'^base\s+\w+\s+timestamps\s+relative', re.M)
+
+
+def asc_header(start, delta=False):
+    _ms = int(round(start * 1000, 1)) # The date line has millisecond resolution
+    _time = time.localtime(_ms // 1000)
+    _date = time.strftime('%a %b %d %I:%M:%S', _time) + ".{:03d} ".format(_ms % 1000) + time.strftime('%p %Y', _time).lower()
+    return ("date {0}\nbase hex  timestamps {1}\nno internal events logged\n"
+            "Begin Triggerblock {0}\n   0.000000 Start of measurement\n").format(_date, 'relative' if delta else 'absolute')
+
+
+def asc_line(frame, timestamp):
+    """
+    :return the Vector ASC line of a frame; ASC timestamps are seconds since the start of the log
+    """
+    _id = "{:X}x".format(frame.id) if frame.ext else "{:X}".format(frame.id)
+    if frame.rtr:
+        _event = "r {:X}".format(frame.dlc)
+    else:
+        _event = "d {:X} {}".format(frame.dlc, frame.data.hex(' ').upper())
+    return "{:>11.6f} 1  {:<15} Rx   {}\n".format(timestamp or 0.0, _id, _event)
+
+
+def asc_footer():
+    return "End TriggerBlock\n"
+
+
+def read_asc(stream, errors=None):
+    """
+    Yields the CAN frames of a Vector ASC log with hexadecimal IDs. Timestamps are made absolute
+    with the date line of the header when it can be parsed; relative (delta) timestamps are summed.
+
+    :param errors an optional ReadErrors counting the malformed frame lines (fewer data bytes than
+                  the DLC), which are skipped
+    """
+    _start = None
+    _relative = False
+    _make = CanFrame._make
+    _fromhex = bytes.fromhex
+    for _chunk in _chunks(stream):
+        if _start is None:
+            _start = 0.0
+            _relative = _ASC_RELATIVE_RE.search(_chunk) is not None
+            _date = _ASC_DATE_RE.search(_chunk)
+            if _date is not None:
+                for _format in ('%a %b %d %I:%M:%S.%f %p %Y', '%a %b %d %H:%M:%S.%f %Y', '%a %b %d %I:%M:%S %p %Y'):
+                    try:
+                        _start = datetime.strptime(_date.group(1), _format).timestamp()
+                        break
+                    except ValueError:
+                        pass
+        for _ts, _id, _ext, _rtr, _rtr_dlc, _dlc, _data in _ASC_RE.findall(_chunk):
+            _timestamp = _start + float(_ts)
+            if _relative:
+                _start = _timestamp
+            if _rtr:
+                yield _make((int(_id, 16), _ext == 'x', True, int(_rtr_dlc or '0', 16), b'', _timestamp, None))
+            else:
+                _dlc = int(_dlc, 16)
+                _bytes = _fromhex(_data)
+                if len(_bytes) < _dlc:
+                    if errors is not None:
+                        errors.add("{} {}{} d {:X}{}".format(_ts, _id, _ext, _dlc, _data))
+                    continue
+                yield _make((int(_id, 16), _ext == 'x', False, _dlc, _bytes[:_dlc], _timestamp, None))
+
+
+def write_asc(frames, stream):
+    """
+    :return the number of frames written
+    """
+    _n = 0
+    _start = None
+    for _batch in _batches(frames):
+        if _start is None:
+            _start = math.floor(_batch[0].timestamp * 1000) / 1000 # Exactly representable by the date line
+            stream.write(asc_header(_start))
+        stream.write(''.join([asc_line(f, f.timestamp - _start) for f in _batch]))
+        _n += len(_batch)
+    if _start is None:
+        stream.write(asc_header(time.time()))
+    stream.write(asc_footer())
+    return _n
+
+
+# =====PCAN-VIEW TRC=====
+
+# Column layouts by file version: N number, O offset (ms), B bus, T type, I ID, R reserved, d direction,
+# l/L length, D data. Files without a $FILEVERSION line are version 1.0; 2.1 lists its columns in $COLUMNS.
+_TRC_COLUMNS = {'1.0': 'NOIlD', '1.1': 'NOTIlD', '1.2': 'NOBTIRlD', '1.3': 'NOBTIRlD', '2.0': 'NOTIdlD', '2.1': 'NOTIdlD'}
+
+
+def trc_header(start):
+    _ole = start / 86400 + OLE_EPOCH
+    return (";$FILEVERSION=1.1\n;$STARTTIME={:.10f}\n;\n"
+            ";   Start time: {}\n;\n"
+            ";   Message Number\n;   |         Time Offset (ms)\n;   |         |        Type\n"
+            ";   |         |        |        ID (hex)\n;   |         |        |        |     Data Length Code\n"
+            ";   |         |        |        |     |   Data Bytes (hex) ...\n;   |         |        |        |     |   |\n"
+            ";---+--   ----+----  --+--  ----+---  +  -+ -- -- -- -- -- -- --\n").format(
+        _ole, time.strftime('%d.%m.%Y %H:%M:%S', time.localtime(start)))
+
+
+def trc_line(number, frame, offset_ms):
+    """
+    :return the TRC version 1.1 line of a frame, with microsecond offsets
+    """
+    _id = "{:08X}".format(frame.id) if frame.ext else "{:04X}".format(frame.id)
+    _data = 'RTR' if frame.rtr else frame.data.hex(' ').upper()
+    return "{:>6}) {:>13.3f}  Rx     {:>8}  {}  {}\n".format(number, offset_ms, _id, frame.dlc, _data)
+
+
+def _trc_layout(columns):
+    """
+    :return the field indexes of the offset, type, ID, length and first data byte for a column layout
+    """
+    return (columns.index('O'), columns.find('T'), columns.index('I'),
+            columns.find('l') if 'l' in columns else columns.find('L'), columns.index('D'))
+
+
+def _trc_columns(version):
+    """
+    :return the default column layout of a TRC file version
+    :raise ValueError if the version is not supported
+    """
+    _columns = _TRC_COLUMNS.get(version.strip())
+    if _columns is None:
+        raise ValueError("Unsupported TRC file version {} (supported: {})".format(version.strip(), ', '.join(_TRC_COLUMNS)))
+    return _columns
+
+
+def read_trc(stream, errors=None):
+    """
+    Yields the frames of a PCAN-View TRC log (file versions 1.0-1.3, 2.0 and 2.1)
+
+    :param errors an optional ReadErrors counting the malformed lines, which are skipped
+
+    :raise ValueError if the file version is not supported
+    """
+    _start = 0.0
+    _offset, _type, _id, _length, _data = _trc_layout(_TRC_COLUMNS['1.0'])
+    _make = CanFrame._make
+    _fromhex = bytes.fromhex
+    for _chunk in _chunks(stream):
+        for _line in _chunk.splitlines():
+            if _line[:1] == ';':
+                if _line.startswith(';$STARTTIME='):
+                    _start = (float(_line[12:]) - OLE_EPOCH) * 86400
+                elif _line.startswith(';$FILEVERSION='):
+                    _offset, _type, _id, _length, _data = _trc_layout(_trc_columns(_line[14:]))
+                elif _line.startswith(';$COLUMNS='):
+                    _offset, _type, _id, _length, _data = _trc_layout(''.join(_line[10:].split(',')))
+                continue
+            _fields = _line.split()
+            if len(_fields) < _data: # The data column may be empty
+                if _fields and errors is not None:
+                    errors.add(_line)
+                continue
+            _kind = _fields[_type] if _type >= 0 else 'DT'
+            if _kind not in ('DT', 'RR', 'Rx', 'Tx'): # Error, status and CAN FD records
+                continue
+            try:
+                _dlc = int(_fields[_length])
+                _can_id = int(_fields[_id], 16)
+                if _can_id > 0x1FFFFFFF: # Version 1.0 and 1.1 error frames use ID FFFFFFFF
+                    continue
+                _rtr = _kind == 'RR' or _fields[_data:_data + 1] == ['RTR']
+                _bytes = b'' if _rtr else _fromhex(''.join(_fields[_data:_data + _dlc]))
+                if len(_bytes) != (0 if _rtr else _dlc):
+                    raise ValueError(_line)
+                _frame = _make((_can_id, len(_fields[_id]) > 4, _rtr, _dlc, _bytes,
+                                _start + float(_fields[_offset]) / 1000, None))
+            except ValueError:
+                if errors is not None:
+                    errors.add(_line)
+                continue
+            yield _frame
+
+
+def write_trc(frames, stream):
+    """
+    :return the number of frames written
+    """
+    _n = 0
+    _start = None
+    for _batch in _batches(frames):
+        if _start is None:
+            _start = _batch[0].timestamp
+            stream.write(trc_header(_start))
+        stream.write(''.join([trc_line(_n + i + 1, f, (f.timestamp - _start) * 1000) for i, f in enumerate(_batch)]))
+        _n += len(_batch)
+    if _start is None:
+        stream.write(trc_header(time.time()))
+    return _n
+
+
+# =====CSV=====
+
+CSV_HEADER = "timestamp,id,ext,rtr,dlc,data\n"
+
+
+def csv_line(frame, timestamp):
+    return "{},{:X},{:d},{:d},{},{}\n".format('' if timestamp is None else "{:.6f}".format(timestamp),
+                                              frame.id, frame.ext, frame.rtr, frame.dlc, frame.data.hex().upper())
+
+
+def read_csv(stream, errors=None):
+    """
+    Yields the frames of a CSV log written by write_csv() (timestamp,id,ext,rtr,dlc,data with hex id and data)
+
+    :param errors an optional ReadErrors counting the malformed lines, which are skipped
+    """
+    _make = CanFrame._make
+    _fromhex = bytes.fromhex
+    for _chunk in _chunks(stream):
+        _fields = _chunk.replace('\n', ',').split(',')
+        if len(_fields) != 6 * _chunk.count('\n') + 1 or '\r' in _chunk: # Irregular lines, go line by line
+            _rows = [_line.split(',') for _line in _chunk.splitlines()]
+        else: # Six fields per line: walk the fields of the whole chunk without splitting lines
+            _rows = zip(*[iter(_fields)] * 6)
+        for _row in _rows:
+            if len(_row) != 6 or _row[0] == 'timestamp':
+                if _row != [''] and _row[0] != 'timestamp' and errors is not None: # Not a blank line or the header
+                    errors.add(','.join(_row))
+                continue
+            _ts, _id, _ext, _rtr, _dlc, _data = _row
+            try:
+                _bytes = _fromhex(_data)
+                _frame = _make((int(_id, 16), _ext == '1', _rtr == '1', int(_dlc), _bytes, float(_ts or 0), None))
+                if _rtr != '1' and len(_bytes) != _frame.dlc:
+                    raise ValueError(_data)
+            except ValueError:
+                if errors is not None:
+                    errors.add(','.join(_row))
+                continue
+            yield _frame
+
+
+def write_csv(frames, stream):
+    """
+    :return the number of frames written
+    """
+    stream.write(CSV_HEADER)
+    _n = 0
+    for _batch in _batches(frames):
+        stream.write(''.join([csv_line(f, f.timestamp) for f in _batch]))
+        _n += len(_batch)
+    return _n
+
+
+# =====CONVERSION=====
+
+READERS = {'candump': read_candump, 'asc': read_asc, 'trc': read_trc, 'csv': read_csv}
+WRITERS = {'candump': write_candump, 'asc': write_asc, 'trc': write_trc, 'csv': write_csv}
+EXTENSIONS = {'.log': 'candump', '.asc': 'asc', '.trc': 'trc', '.csv': 'csv'}
+
+
+def format_of(path, format=None):
+    """
+    :return format if given, otherwise the format matching the file extension
+    :raise ValueError if the format is unknown
+    """
+    _format = format or EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if _format not in READERS:
+        raise ValueError("Unknown log format for {} (use one of {})".format(path, ', '.join(sorted(READERS))))
+    return _format
+
+
+def read_log(path, format=None, errors=None):
+    """
+    Yields the frames of a log file, in the format given or guessed from the extension
+
+    :param errors an optional ReadErrors counting the malformed lines, which are skipped
+    """
+    _reader = READERS[format_of(path, format)]
+    with open(path, 'r', newline='', errors='replace') as f:
+        yield from _reader(f, errors)
+
+
+def write_log(frames, path, format=None):
+    """
+    Writes frames to a log file, in the format given or guessed from the extension
+
+    :return the number of frames written
+    """
+    _writer = WRITERS[format_of(path, format)]
+    with open(path, 'w', newline='\n', buffering=1 << 20) as f:
+        return _writer(frames, f)
+
+
+def convert(source, destination, source_format=None, destination_format=None, filter=None, errors=None):
+    """
+    Converts a log file to another format, streaming
+
+    :param filter a function taking a CanFrame and returning True to keep it, None to keep all
+    :param errors an optional ReadErrors counting the malformed source lines, which are skipped
+
+    :return the number of frames written
+    """
+    _frames = read_log(source, source_format, errors)
+    if filter is not None:
+        _frames = (f for f in _frames if filter(f))
+    return write_log(_frames, destination, destination_format)
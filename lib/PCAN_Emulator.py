@@ -0,0 +1,185 @@
+import threading
+import time
+from collections import deque
+from serial.serialutil import CR
+from lib.CanFrame import CanFrame
+from lib.PCAN_RS_232 import PCAN_RS_232
+
+BEL = b'\x07'
+
+
+class PCAN_Emulator(PCAN_RS_232):
+    """
+    A PCAN_RS_232 that talks to an emulated PCAN-RS-232 device instead of a serial port.
+
+    The emulator implements the ASCII command set (open/close, configuration, status, transmit)
+    and models the serial link: writes take the time the bytes need on the wire at the configured
+    baudrate, and replies become readable after the device latency plus their own wire time.
+    This makes it useful for benchmarking the library without hardware.
+
+    Other bus participants are emulated with nodes: callables that receive every transmitted
+    CanFrame and return an iterable of CanFrame objects to put on the bus in response (or None).
+    Frames can also be put on the bus directly with inject().
+    """
+    SERIAL_NUMBER   = b'0001'
+    VERSION         = b'1011'
+
+    # Commands only accepted while the CAN channel is closed
+    _CLOSED_ONLY = b'ZXWSsUeMm'
+
+    def __init__(self, baudrate=57600, timeout=1, latency=0.001, nodes=None, *args, **kwargs):
+        """
+        :param baudrate the emulated serial link speed
+        :param timeout the read timeout in seconds
+        :param latency seconds between the device receiving a command and starting its reply
+        :param nodes callables emulating the other CAN nodes on the bus
+        """
+        self.latency = latency
+        self.nodes = list(nodes or [])
+        self.status_flags = 0   # Emulated status flags byte, see get_status_flags()
+
+        # Emulated device state
+        self._dev_open = False
+        self._dev_listen = False
+        self._dev_auto_poll = True
+        self._dev_timestamps = False
+        self._dev_start = time.monotonic()
+
+        # Emulated serial link
+        self._cmd_buffer = b''
+        self._rx_chunks = deque()   # (time the bytes are readable, bytes)
+        self._rx_free_at = 0.0      # Time the device->host line is free again
+        self._rx_cond = threading.Condition()
+        self._tx_lock = threading.Lock()
+
+        super().__init__(None, baudrate, timeout, *args, **kwargs) # port=None: nothing is opened
+
+    # =====EMULATED SERIAL PORT=====
+
+    @property
+    def in_waiting(self):
+        _now = time.monotonic()
+        with self._rx_cond:
+            return sum(len(c) for t, c in self._rx_chunks if t <= _now)
+
+    def read(self, size=1):
+        _deadline = time.monotonic() + (self.timeout if self.timeout is not None else 1e9)
+        _out = bytearray()
+        with self._rx_cond:
+            while True:
+                _now = time.monotonic()
+                while self._rx_chunks and self._rx_chunks[0][0] <= _now and len(_out) < size:
+                    _t, _chunk = self._rx_chunks.popleft()
+                    _take = size - len(_out)
+                    _out += _chunk[:_take]
+                    if len(_chunk) > _take: # Put back what did not fit
+                        self._rx_chunks.appendleft((_t, _chunk[_take:]))
+                if _out or _now >= _deadline:
+                    return bytes(_out)
+                _wait = _deadline - _now
+                if self._rx_chunks:
+                    _wait = min(_wait, self._rx_chunks[0][0] - _now)
+                self._rx_cond.wait(_wait)
+
+    def write(self, data):
+        with self._tx_lock:
+            time.sleep(len(data) * self._char_time()) # Time on the host->device line
+            _records = (self._cmd_buffer + bytes(data)).split(CR)
+            self._cmd_buffer = _records.pop()
+            for _rec in _records:
+                self._execute(_rec)
+        return len(data)
+
+    def reset_input_buffer(self):
+        with self._rx_cond:
+            self._rx_chunks.clear()
+
+    def reset_output_buffer(self):
+        self._cmd_buffer = b''
+
+    def close(self):
+        self.stop_receiver()
+
+    # =====EMULATED BUS=====
+
+    def inject(self, frame):
+        """
+        Puts a frame on the emulated bus, as if sent by another node
+
+        :param frame the CanFrame to receive
+
+        :return -1 if the frame is not received (CAN channel closed or auto poll disabled)
+        :return 1 if the frame is sent to the host
+        """
+        if not self._dev_open or not self._dev_auto_poll:
+            return -1
+        _msg = frame.to_message()
+        if self._dev_timestamps: # Append the millisecond timestamp, rolling over every minute
+            _ms = int((time.monotonic() - self._dev_start) * 1000) % 60000
+            _msg = _msg[:-1] + b'%04X\r' % _ms
+        self._deliver(_msg)
+        return 1
+
+    # =====DEVICE MODEL=====
+
+    def _char_time(self):
+        return 10 / self.baudrate # 8N1: 10 bits per character
+
+    def _deliver(self, data):
+        """
+        Queues device->host bytes, readable once the latency and their wire time have passed
+        """
+        with self._rx_cond:
+            _start = max(time.monotonic() + self.latency, self._rx_free_at)
+            self._rx_free_at = _start + len(data) * self._char_time()
+            self._rx_chunks.append((self._rx_free_at, data))
+            self._rx_cond.notify_all()
+
+    def _execute(self, rec):
+        """
+        Executes a single command record (without CR) and delivers the reply
+        """
+        _cmd = rec[:1]
+        if _cmd in (b't', b'T', b'r', b'R'):
+            if not self._dev_open or self._dev_listen:
+                self._deliver(BEL)
+                return
+            try:
+                _frame = CanFrame.from_message(rec, time.time())
+            except (ValueError, IndexError):
+                self._deliver(BEL)
+                return
+            self._deliver(b'Z\r' if _frame.ext else b'z\r')
+            for _node in self.nodes:
+                for _reply in _node(_frame) or ():
+                    self.inject(_reply)
+        elif _cmd == b'O' or _cmd == b'L':
+            if self._dev_open:
+                self._deliver(BEL)
+            else:
+                self._dev_open = True
+                self._dev_listen = _cmd == b'L'
+                self._deliver(CR)
+        elif _cmd == b'C':
+            if not self._dev_open:
+                self._deliver(BEL)
+            else:
+                self._dev_open = False
+                self._deliver(CR)
+        elif _cmd == b'N':
+            self._deliver(b'N' + self.SERIAL_NUMBER + CR)
+        elif _cmd == b'V':
+            self._deliver(b'V' + self.VERSION + CR)
+        elif _cmd == b'F':
+            self._deliver(b'F%02X\r' % self.status_flags if self._dev_open else BEL)
+        elif _cmd == b'Q':
+            self._deliver(CR if self._dev_open else BEL)
+        elif _cmd and _cmd in self._CLOSED_ONLY:
+            if self._dev_open:
+                self._deliver(BEL)
+                return
+            if _cmd == b'X': self._dev_auto_poll = rec[1:2] == b'1'
+            elif _cmd == b'Z': self._dev_timestamps = rec[1:2] == b'1'
+            self._deliver(CR)
+        else:
+            self._deliver(BEL)
@@ -1,5 +1,11 @@
 import serial
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from queue import Empty, Queue
 from serial.serialutil import CR
+from lib.CanFrame import CanFrame
 
 class PCAN_RS_232(serial.Serial):
     # Constants for PCAN interface
@@ -28,6 +34,17 @@ class PCAN_RS_232(serial.Serial):
     _can_open = False
 
     def __init__(self, port, baudrate, timeout=1, *args, **kwargs):
+        # Receive path state (see start_receiver())
+        self._command_lock = threading.RLock()  # Serializes command/reply round trips
+        self._replies = Queue()                 # Command replies separated from the frame stream by the receiver
+        self._rx_buffer = b''                   # Incomplete record left over from the last read
+        self._receiver_alive = False
+        self._receiver_thread = None
+        self._listeners = []                    # Callbacks receiving each batch of received frames
+        self._waiters = {}                      # (id, ext) -> deque of (deadline, Future) for request()
+        self._waiters_lock = threading.Lock()
+        self._next_deadline = float('inf')
+
         super().__init__(port=port, baudrate=baudrate, timeout=timeout, *args, **kwargs)
         self.reset_output_buffer() # Clear input/output buffers on initialization
 
@@ -89,9 +106,9 @@ class PCAN_RS_232(serial.Serial):
         
         :pre This command is accepted only if the CAN channel is closed. 
         
-        The timestamp feature is OFF by default. When enabled, four additional bytes will be added to the beginning
+        The timestamp feature is OFF by default. When enabled, four additional bytes will be added to the end
         of a CAN data frame like so:
-        b'tXXXXiiildd...' where the four X's are the timestamp's hex value in milliseconds.
+        b'tiiildd...XXXX' where the four X's are the timestamp's hex value in milliseconds.
         
         :param n=False Turn OFF the timestamp feature 
         :param n=True Turn ON the timestamp feature
@@ -402,22 +419,24 @@ class PCAN_RS_232(serial.Serial):
         if n in range(0,7): n = format(n, '01n').encode('utf-8')    # Check if n is in correct range (0-6) then encode (b'X')
         else: return -1                                             # Return an error otherwise
 
-        # Change serial baudrate of PCAN module
-        if self._can_open: 
-            self.close_channel()
-        self.write(self.SET_UART_BAUDRATE + n + b'\r')
-
-        # Adjust serial port baudrate to maintain 
-        _n = int(n.decode())
-        if   _n == 0: self.baudrate = 230400
-        elif _n == 1: self.baudrate = 115200
-        elif _n == 2: self.baudrate = 57600 # Default
-        elif _n == 3: self.baudrate = 38400
-        elif _n == 4: self.baudrate = 19200
-        elif _n == 5: self.baudrate = 9600
-        elif _n == 6: self.baudrate = 2400
-
-        return self._receive_reply()
+        with self._command_lock:
+            # Change serial baudrate of PCAN module
+            if self._can_open: 
+                self.close_channel()
+            self._discard_replies()
+            self.write(self.SET_UART_BAUDRATE + n + b'\r')
+
+            # Adjust serial port baudrate to maintain 
+            _n = int(n.decode())
+            if   _n == 0: self.baudrate = 230400
+            elif _n == 1: self.baudrate = 115200
+            elif _n == 2: self.baudrate = 57600 # Default
+            elif _n == 3: self.baudrate = 38400
+            elif _n == 4: self.baudrate = 19200
+            elif _n == 5: self.baudrate = 9600
+            elif _n == 6: self.baudrate = 2400
+
+            return self._receive_reply()
 
     # =====TRANSMIT FUNCTIONS=====
 
@@ -531,6 +550,245 @@ class PCAN_RS_232(serial.Serial):
         # Note: Transmitting can only be performed when the CAN channel is OPEN and AUTOSTART is OFF
         return self.send_message(b'r' + id + dlc + b'\r')
 
+    def transmit_frames(self, frames):
+        """
+        Transmits several CAN frames with a single serial write
+
+        :pre This command is only accepted when the CAN channel is open
+
+        Joining the frames into one write avoids waiting for the acknowledgement of each frame
+        before sending the next, which is what limits the throughput of transmit_*_message().
+        Keep the batch within the PCAN transmit FIFO, or the excess frames will be rejected.
+
+        :param frames an iterable of CanFrame objects to transmit, in order
+
+        :return -1 if an ERROR occurs (any frame was rejected or not acknowledged)
+        :return 1 if every frame was successfully transmitted
+        """
+        _res = self.send_messages([f.to_message() for f in frames])
+        return 1 if all(r == 1 for r in _res) else -1
+
+    def request(self, id, dlc, timeout=1, ext=None):
+        """
+        Transmits a CAN request frame and returns a Future that completes with the matching data frame
+
+        :pre This command is only accepted when the CAN channel is open
+
+        The waiter is registered (keyed by ID and frame type) before the RTR frame is sent, so the
+        reply cannot be missed. Only the PCAN acknowledgement of the RTR frame is waited on here;
+        the data reply is delivered by the receiver thread, which is started if it is not running.
+        Any number of requests can be outstanding at once, e.g. to poll many nodes in one sweep:
+            futures = [pcan.request(id, 8) for id in node_ids]
+            replies = [f.result() for f in futures]
+        Requests for the same ID are completed in the order they were made.
+
+        :param id the CAN request ID as a hex string or int
+        :param dlc the expected length of the incoming CAN data as an int value
+        :param timeout seconds to wait for the data frame before the Future fails with TimeoutError
+        :param ext True for an extended (29-bit) request, False for standard (11-bit),
+                   None to pick based on the size of the ID
+
+        :return a concurrent.futures.Future resolving to the CanFrame of the reply.
+                The Future fails with SerialException if the PCAN module rejects the request frame
+        """
+        if isinstance(id, str): id = int(id, 16)    # Check if ID is a hex string and convert to int
+        if ext is None: ext = id > 0x7FF            # Pick the identifier type from the ID range
+
+        _key = (id, ext)
+        _deadline = time.monotonic() + timeout
+        _future = Future()
+        with self._waiters_lock: # Register before sending so a fast reply can not be missed
+            self._waiters.setdefault(_key, deque()).append((_deadline, _future))
+            self._next_deadline = min(self._next_deadline, _deadline)
+
+        if not self._receiver_alive:
+            self.start_receiver()
+
+        _res = self.transmit_extended_request(id, dlc) if ext else self.transmit_standard_request(id, dlc)
+        if _res == -1: # Request frame was not accepted, fail the waiter immediately
+            with self._waiters_lock:
+                _queue = self._waiters.get(_key)
+                if _queue is not None:
+                    try: _queue.remove((_deadline, _future))
+                    except ValueError: pass
+                    if not _queue: del self._waiters[_key]
+            if _future.set_running_or_notify_cancel():
+                _future.set_exception(serial.SerialException("PCAN module rejected request for ID {:X}".format(id)))
+        return _future
+
+    # =====RECEIVE FUNCTIONS=====
+
+    def start_receiver(self):
+        """
+        Starts the background receiver thread.
+
+        While the receiver is running it owns the serial input: received frames are parsed into
+        CanFrame objects, used to complete pending request() Futures and handed to the registered
+        listeners, while command replies are queued for send_message().
+        """
+        if self._receiver_alive:
+            return
+        self._receiver_alive = True
+        self._receiver_thread = threading.Thread(target=self._receiver, name='pcan-rx')
+        self._receiver_thread.daemon = True
+        self._receiver_thread.start()
+
+    def stop_receiver(self):
+        """
+        Stops the background receiver thread and fails any outstanding requests
+        """
+        self._receiver_alive = False
+        if self._receiver_thread is not None and self._receiver_thread is not threading.current_thread():
+            self._receiver_thread.join()
+        self._receiver_thread = None
+        self._fail_requests(serial.SerialException("PCAN receiver stopped"))
+
+    @property
+    def receiver_alive(self):
+        """
+        :return True while the receiver thread is running (it stops if the serial port fails)
+        """
+        return self._receiver_alive
+
+    def add_listener(self, callback):
+        """
+        Registers a callback for received frames
+
+        :param callback called from the receiver thread with a list of CanFrame objects,
+                        one call per chunk read from the serial port
+        """
+        self._listeners = self._listeners + [callback] # Copy on write so the receiver can iterate without locking
+
+    def remove_listener(self, callback):
+        """
+        Unregisters a callback previously registered with add_listener()
+        """
+        self._listeners = [l for l in self._listeners if l != callback]
+
+    def read_frames(self):
+        """
+        Reads whatever is waiting on the serial port (or waits up to timeout for one byte),
+        and processes it with process_received()
+
+        :return a list of the CanFrame objects received
+        """
+        _data = self.read(self.in_waiting or 1) # Read all that is there or wait for one byte
+        if self._waiters and time.monotonic() >= self._next_deadline:
+            self._expire_requests()
+        if not _data:
+            return []
+        return self.process_received(_data)
+
+    def process_received(self, data):
+        """
+        Splits raw serial data into records, queues command replies and dispatches frames
+        to pending requests and listeners
+
+        :param data the raw bytes read from the serial port
+
+        :return a list of the CanFrame objects received
+        """
+        _records = (self._rx_buffer + data).split(b'\r')
+        _tail = _records.pop() # Incomplete record, kept until the rest of it arrives
+        while _tail[:1] == b'\x07': # BEL is not terminated by CR
+            self._replies.put(-1)
+            _tail = _tail[1:]
+        self._rx_buffer = _tail
+
+        _now = time.time()
+        _frames = []
+        for _rec in _records:
+            while _rec[:1] == b'\x07': # Error replies preceding this record
+                self._replies.put(-1)
+                _rec = _rec[1:]
+            if _rec[:1] in b'tTrR' and len(_rec) >= 5: # Received CAN frame (b'' is also "in" any bytes)
+                try:
+                    _frames.append(CanFrame.from_message(_rec, _now))
+                    continue
+                except ValueError:
+                    pass
+            if _rec == b'' or _rec == b'z' or _rec == b'Z': # General acknowledgement
+                self._replies.put(1)
+            else:
+                self._replies.put(_rec + b'\r')
+
+        if _frames:
+            if self._waiters:
+                self._complete_requests(_frames)
+            for _listener in self._listeners:
+                _listener(_frames)
+        return _frames
+
+    def _receiver(self):
+        """
+        Receiver thread loop
+        """
+        try:
+            while self._receiver_alive:
+                self.read_frames()
+        except serial.SerialException as e: # If borked, fail outstanding requests and kill thread
+            self._receiver_alive = False
+            self._fail_requests(e)
+
+    def _complete_requests(self, frames):
+        """
+        Completes the oldest pending request for the ID of each received data frame
+        """
+        _done = []
+        with self._waiters_lock:
+            for _frame in frames:
+                if _frame.rtr:
+                    continue
+                _key = (_frame.id, _frame.ext)
+                _queue = self._waiters.get(_key)
+                if _queue is None:
+                    continue
+                while _queue:
+                    _future = _queue.popleft()[1]
+                    if _future.set_running_or_notify_cancel(): # Skip requests cancelled by the caller
+                        _done.append((_future, _frame))
+                        break
+                if not _queue:
+                    del self._waiters[_key]
+        for _future, _frame in _done: # Resolve outside the lock so callbacks may issue new requests
+            _future.set_result(_frame)
+
+    def _expire_requests(self):
+        """
+        Fails pending requests whose deadline has passed with TimeoutError
+        """
+        _now = time.monotonic()
+        _expired = []
+        _next = float('inf')
+        with self._waiters_lock:
+            for _key in list(self._waiters):
+                _queue = self._waiters[_key]
+                _keep = deque()
+                for _deadline, _future in _queue:
+                    if _deadline <= _now:
+                        _expired.append((_key, _future))
+                    else:
+                        _keep.append((_deadline, _future))
+                        _next = min(_next, _deadline)
+                if _keep: self._waiters[_key] = _keep
+                else: del self._waiters[_key]
+            self._next_deadline = _next
+        for _key, _future in _expired:
+            if _future.set_running_or_notify_cancel():
+                _future.set_exception(TimeoutError("No reply from CAN ID {:X}".format(_key[0])))
+
+    def _fail_requests(self, exc):
+        """
+        Fails every pending request with the given exception
+        """
+        with self._waiters_lock:
+            _pending = [_future for _queue in self._waiters.values() for _deadline, _future in _queue]
+            self._waiters.clear()
+            self._next_deadline = float('inf')
+        for _future in _pending:
+            if _future.set_running_or_notify_cancel():
+                _future.set_exception(exc)
+
     # =====UTILITY=====
 
     def send_message(self, msg):
@@ -543,8 +801,23 @@ class PCAN_RS_232(serial.Serial):
         :return 1 if the PCAN module aknowledges the command
         :return the contents of the reception bus if the PCAN module sent data over
         """
-        self.write(msg)
-        return self._receive_reply()
+        with self._command_lock:
+            self._discard_replies()
+            self.write(msg)
+            return self._receive_reply()
+
+    def send_messages(self, msgs):
+        """
+        Sends several messages across the serial bus in a single write and collects one reply per message
+
+        :param msgs a list of UTF-8 encoded messages, each terminated with CR
+
+        :return a list with the reply to each message, as returned by send_message()
+        """
+        with self._command_lock:
+            self._discard_replies()
+            self.write(b''.join(msgs))
+            return [self._receive_reply() for _ in msgs]
 
     def _send_message_close_only(self, msg):
         """
@@ -557,13 +830,14 @@ class PCAN_RS_232(serial.Serial):
         :return 1 if the PCAN module aknowledges the command
         :return the contents of the reception bus if the PCAN module sent data over
         """
-        if self._can_open:
-            self.close_channel()
-            _res = self.send_message(msg)
-            self.open_channel()
-            return _res
-        else:
-            return self.send_message(msg)
+        with self._command_lock:
+            if self._can_open:
+                self.close_channel()
+                _res = self.send_message(msg)
+                self.open_channel()
+                return _res
+            else:
+                return self.send_message(msg)
 
     def _send_message_open_only(self, msg):
         """
@@ -576,13 +850,14 @@ class PCAN_RS_232(serial.Serial):
         :return 1 if the PCAN module aknowledges the command
         :return the contents of the reception bus if the PCAN module sent data over
         """
-        if not self._can_open:
-            self.open_channel()
-            _res = self.send_message(msg)
-            self.close_channel()
-            return _res
-        else:
-            return self.send_message(msg)
+        with self._command_lock:
+            if not self._can_open:
+                self.open_channel()
+                _res = self.send_message(msg)
+                self.close_channel()
+                return _res
+            else:
+                return self.send_message(msg)
 
     def _receive_reply(self):
         """
@@ -592,8 +867,14 @@ class PCAN_RS_232(serial.Serial):
         :return 1 if the PCAN module aknowledges the command
         :return the contents of the reception bus if the PCAN module sent data over
         """
+        if self._receiver_alive: # The receiver thread owns the serial input and queues the replies
+            try:
+                return self._replies.get(timeout=self.timeout)
+            except Empty:
+                return -1
+
         _gen_ack = [b'\r', b'\r\r', b'Z\r', b'z\r']
-        _rec_buf = self.read_until('\r')
+        _rec_buf = self.read_until(CR)
         # print(_rec_buf) # Debug
 
         if _rec_buf == b'\x07' or _rec_buf == b'': # Message failed to be interpreted or send
@@ -603,6 +884,15 @@ class PCAN_RS_232(serial.Serial):
         else:                   # Return full message
             return _rec_buf
 
+    def _discard_replies(self):
+        """
+        Drops stale replies (e.g. the second CR of a double acknowledgement) so they are not
+        mistaken for the reply to the next command
+        """
+        while not self._replies.empty():
+            try: self._replies.get_nowait()
+            except Empty: break
+
     def empty_buffers(self):
         """
         Empties the input/output serial buffers
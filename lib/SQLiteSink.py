@@ -0,0 +1,227 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import deque
+from lib.DBCDecoder import EXTENDED_ID_FLAG, DBCDecoder
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS runs (run INTEGER PRIMARY KEY, start REAL, stop REAL, frames INTEGER, metadata TEXT)",
+    "CREATE TABLE IF NOT EXISTS frames (run INTEGER, timestamp REAL, id INTEGER, ext INTEGER, rtr INTEGER, dlc INTEGER, data BLOB)",
+    "CREATE TABLE IF NOT EXISTS signals (run INTEGER, timestamp REAL, message TEXT, signal TEXT, value REAL)",
+)
+# Created when a sink closes, after the bulk load: building an index once is much cheaper than
+# updating it for every inserted row
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS frames_by_id ON frames (run, id, ext, timestamp)",
+    "CREATE INDEX IF NOT EXISTS signals_by_name ON signals (run, message, signal, timestamp)",
+)
+INSERT_FRAME = "INSERT INTO frames VALUES (?, ?, ?, ?, ?, ?, ?)"
+INSERT_SIGNAL = "INSERT INTO signals VALUES (?, ?, ?, ?, ?)"
+
+
+class SQLiteSink:
+    """
+    Stores received frames, and optionally their decoded DBC signals, in an SQLite database for
+    querying with SQL.
+
+    write() only queues the frames; a writer thread inserts everything queued in one transaction
+    per batch_interval (or sooner once batch_size frames are waiting) with executemany() on
+    prepared statements, so the cost per frame stays far below a transaction per row. The
+    database uses WAL mode, so it can be queried while the sink writes. Each sink adds a row to
+    the runs table and tags its frames and signals with that run number. Indexes are created when
+    the sink closes.
+
+    When the disk falls behind and max_pending frames are queued, write() blocks the caller (the
+    receiver thread, so frames wait in the serial buffers instead of memory) or, with
+    block=False, drops the frames and counts them in dropped. write() takes a list of frames, so
+    the sink can be registered directly as a PCAN_RS_232 listener.
+
+    Example:
+        sink = SQLiteSink('bench.db', dbc='powertrain.dbc', metadata={'test': 'cold start'})
+        pcan.add_listener(sink.write)
+        pcan.start_receiver()
+        ...
+        sink.close()
+        # SELECT timestamp, value FROM signals WHERE run = 1 AND signal = 'EngineSpeed'
+    """
+
+    def __init__(self, path, dbc=None, metadata=None, batch_interval=0.5, batch_size=50000, max_pending=500000,
+                 block=True, create_indexes=True):
+        """
+        :param path the database file, created if needed
+        :param dbc a DBCDecoder or DBC file path to also store the decoded signals, None for frames only
+        :param metadata dict stored with the run (e.g. lib.CaptureWriter.device_metadata())
+        :param batch_interval seconds between transactions
+        :param batch_size queued frames that start a transaction before batch_interval is over
+        :param max_pending queued frames at which write() blocks or drops
+        :param block True to block write() while the queue is full, False to drop the frames
+        :param create_indexes True to create the indexes when the sink is closed
+
+        :raise sqlite3.Error if the database can not be opened
+        """
+        self.path = path
+        self.dbc = DBCDecoder(dbc) if isinstance(dbc, str) else dbc
+        self.batch_interval = batch_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.block = block
+        self.create_indexes = create_indexes
+        self.count = 0              # Frames committed
+        self.signal_count = 0       # Signal values committed
+        self.dropped = 0            # Frames dropped because the queue was full (block=False) or after an error
+        self.transactions = 0
+        self.error = None           # Exception that stopped the writer thread, if any
+
+        self._queue = deque()       # Frame lists waiting for the writer thread
+        self._pending = 0           # Frames in the queue
+        self._cond = threading.Condition()
+        self._closing = False
+        self._flush_requested = False # flush() is waiting, commit without waiting for batch_interval
+
+        # The connection is made here so errors surface in the caller, then only used by the writer thread
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        try:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL") # WAL stays consistent on a power cut, commits need no fsync
+            for _statement in SCHEMA:
+                self._db.execute(_statement)
+            self.run = self._db.execute("INSERT INTO runs (start, frames, metadata) VALUES (?, 0, ?)", (
+                time.time(), json.dumps(dict(metadata or {}), sort_keys=True))).lastrowid
+        except sqlite3.Error:
+            self._db.close()
+            raise
+        self._thread = threading.Thread(target=self._writer, name='sqlite-sink', daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self):
+        """
+        :return the number of frames queued and not yet committed
+        """
+        return self._pending
+
+    def write(self, frames):
+        """
+        Queues frames for the database (listener, called from the receiver thread)
+
+        :param frames a list of CanFrame objects
+        """
+        _n = len(frames)
+        if not _n:
+            return
+        with self._cond:
+            if self.block:
+                self._cond.wait_for(lambda: self._pending + _n <= self.max_pending or not self._pending
+                                    or self._closing or self.error is not None)
+            if self._closing or self.error is not None or self._pending + _n > self.max_pending and self._pending:
+                self.dropped += _n
+                return
+            self._queue.append(frames)
+            self._pending += _n
+            if self._pending >= self.batch_size:
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Waits until the queued frames are committed
+
+        :return True if the queue was emptied, False on timeout or writer error
+        """
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: not self._pending or self.error is not None, timeout) \
+                and self.error is None
+
+    def close(self):
+        """
+        Commits the queued frames, records the end of the run and creates the indexes
+        """
+        with self._cond:
+            if self._closing:
+                return
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join()
+        try:
+            if self.error is None:
+                self._db.execute("UPDATE runs SET stop = ?, frames = ? WHERE run = ?", (time.time(), self.count, self.run))
+                if self.create_indexes:
+                    for _statement in INDEXES:
+                        self._db.execute(_statement)
+        except sqlite3.Error as e:
+            self.error = e
+        finally:
+            self._db.close()
+
+    # =====WRITER=====
+
+    def _writer(self):
+        """
+        Writer thread loop: one transaction per batch
+        """
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending >= self.batch_size or self._closing or self._flush_requested,
+                                    self.batch_interval)
+                _batches = list(self._queue)
+                self._queue.clear()
+                if not _batches:
+                    self._flush_requested = False
+                _closing = self._closing
+            if _batches:
+                _n = sum(map(len, _batches))
+                try:
+                    self._insert(_batches)
+                except sqlite3.Error as e:
+                    with self._cond:
+                        self.error = e
+                        self.dropped += self._pending # Includes the failed batch
+                        self._queue.clear()
+                        self._pending = 0
+                        self._cond.notify_all()
+                    return
+                with self._cond:
+                    self._pending -= _n
+                    if not self._pending: # Frames queued meanwhile are committed right away for flush()
+                        self._flush_requested = False
+                    self._cond.notify_all() # Room for blocked writers, and flush()
+            elif _closing:
+                return
+
+    def _insert(self, batches):
+        _run = self.run
+        _rows = [(_run, f.timestamp, f.id, f.ext, f.rtr, f.dlc, f.data) for _frames in batches for f in _frames]
+        _signals = self._signal_rows(batches) if self.dbc is not None else []
+        _db = self._db
+        _db.execute("BEGIN")
+        try:
+            _db.executemany(INSERT_FRAME, _rows)
+            if _signals:
+                _db.executemany(INSERT_SIGNAL, _signals)
+            _db.execute("COMMIT")
+        except sqlite3.Error:
+            _db.execute("ROLLBACK")
+            raise
+        self.count += len(_rows)
+        self.signal_count += len(_signals)
+        self.transactions += 1
+
+    def _signal_rows(self, batches):
+        """
+        :return (run, timestamp, message, signal, value) rows of the signals of the frames defined in the DBC
+        """
+        _run = self.run
+        _messages = self.dbc.messages
+        _decode = self.dbc.decode
+        _rows = []
+        for _frames in batches:
+            for f in _frames:
+                _values = _decode(f)
+                if _values is None:
+                    continue
+                _name = _messages[f.id | EXTENDED_ID_FLAG if f.ext else f.id].name
+                _ts = f.timestamp
+                _rows.extend([(_run, _ts, _name, s, v) for s, v in _values.items()])
+        return _rows
@@ -0,0 +1,177 @@
+import threading
+import time
+from typing import NamedTuple
+from lib.CaptureWriter import CaptureWriter
+from lib.FrameRing import FrameRing
+
+
+class TriggerEvent(NamedTuple):
+    """
+    A persisted trigger capture
+
+    :param name the trigger that fired
+    :param time timestamp of the frame (or status poll) that fired it
+    :param path the capture segment holding the pre- and post-trigger frames
+    :param count frames in the segment
+    """
+    name: str
+    time: float
+    path: str
+    count: int
+
+
+class TriggerCapture:
+    """
+    Keeps the most recent frames in a preallocated FrameRing and, when a trigger fires, persists
+    the pre-trigger window plus the post-trigger window to a capture segment, then re-arms.
+
+    Triggers are functions taking a CanFrame and returning True to fire; fire() triggers by hand,
+    e.g. on status flags polled from the device. The pre-trigger window is copied out of the ring
+    as packed records without unpacking them; post-trigger frames are written as they arrive.
+    Triggers firing while a post-trigger window is being recorded are ignored. update() takes a
+    list of frames, so it can be registered directly as a PCAN_RS_232 listener; call tick()
+    periodically so a capture also finishes when the bus goes quiet.
+
+    Example:
+        capture = TriggerCapture('faults', {'DTC': lambda f: f.id == 0x7E8 and f.data[:2] == b'\x03\x59'},
+                                 pre_seconds=10, post_seconds=2, capacity=50000)
+        pcan.add_listener(capture.update)
+        pcan.start_receiver()
+    """
+
+    def __init__(self, directory, triggers, pre_seconds=5.0, post_seconds=5.0, capacity=100000, prefix='trigger',
+                 metadata=None, max_events=0, fsync_interval=1.0, on_event=None):
+        """
+        :param directory the directory the capture segments are written to
+        :param triggers a dict of trigger name -> function taking a CanFrame and returning True to fire
+        :param pre_seconds seconds of traffic kept from before the trigger (as far as the ring holds)
+        :param post_seconds seconds of traffic recorded after the trigger
+        :param capacity frames held by the ring, enough for pre_seconds at the highest expected frame rate
+        :param prefix the start of the segment file names, followed by the event number
+        :param metadata dict stored in every segment header (see lib.CaptureWriter.device_metadata())
+        :param max_events number of captures after which the triggers stay disarmed, 0 for no limit
+        :param on_event called with the TriggerEvent of every finished capture (from the receiver thread)
+        """
+        self.directory = directory
+        self.triggers = list(triggers.items())
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.prefix = prefix
+        self.metadata = dict(metadata or {})
+        self.max_events = max_events
+        self.fsync_interval = fsync_interval
+        self.on_event = on_event
+        self.ring = FrameRing(capacity)
+        self.events = []            # TriggerEvent of every finished capture
+        self._writer = None         # CaptureWriter of the capture in progress
+        self._fired = None          # (name, time) of the capture in progress
+        self._deadline = None       # End of the post-trigger window
+        self._lock = threading.Lock()
+
+    @property
+    def armed(self):
+        return self._writer is None and (not self.max_events or len(self.events) < self.max_events)
+
+    @property
+    def recording(self):
+        return self._writer is not None
+
+    def update(self, frames):
+        """
+        Adds received frames to the ring, checks the triggers and records post-trigger frames
+        (listener, called from the receiver thread)
+        """
+        with self._lock:
+            self.ring.extend(frames)
+            _n = len(frames)
+            _start = 0
+            while _start < _n:
+                if self._writer is not None:
+                    _deadline = self._deadline
+                    _stop = _start
+                    while _stop < _n and frames[_stop].timestamp <= _deadline:
+                        _stop += 1
+                    self._writer.write(frames[_start:_stop])
+                    if _stop == _n:
+                        return
+                    self._finish()
+                    _start = _stop
+                elif self.armed:
+                    _hit = self._scan(frames, _start)
+                    if _hit is None:
+                        return
+                    _index, _name = _hit
+                    # The whole batch is in the ring already: the pre-trigger window ends before the trigger frame
+                    self._fire(_name, frames[_index].timestamp, len(self.ring) - (_n - _index))
+                    _start = _index
+                else:
+                    return
+
+    def fire(self, name, timestamp=None):
+        """
+        Triggers a capture by hand, e.g. on status flags
+
+        :param timestamp the trigger time, None for now (frame timestamps are host time)
+
+        :return True if a capture was started, False if one is in progress or the triggers are disarmed
+        """
+        with self._lock:
+            if not self.armed:
+                return False
+            self._fire(name, time.time() if timestamp is None else timestamp, len(self.ring))
+            return True
+
+    def tick(self, now=None):
+        """
+        Finishes the capture in progress once its post-trigger window is over, also when no frames
+        arrive to close it (call periodically)
+
+        :param now the current time, None for time.time()
+        """
+        with self._lock:
+            if self._writer is not None and (time.time() if now is None else now) > self._deadline:
+                self._finish()
+
+    def close(self):
+        """
+        Finishes the capture in progress, if any, with the post-trigger frames received so far
+        """
+        with self._lock:
+            if self._writer is not None:
+                self._finish()
+
+    def _scan(self, frames, start):
+        """
+        :return (index, trigger name) of the first frame from start on that fires a trigger, None if none does
+        """
+        _triggers = self.triggers
+        for i in range(start, len(frames)):
+            _f = frames[i]
+            for _name, _match in _triggers:
+                if _match(_f):
+                    return i, _name
+        return None
+
+    def _fire(self, name, timestamp, pre_stop):
+        """
+        Starts a capture: writes the ring frames from pre_seconds before the trigger up to ring index pre_stop
+        """
+        self._fired = (name, timestamp)
+        self._deadline = timestamp + self.post_seconds
+        _prefix = "{}-{:04d}".format(self.prefix, len(self.events)) # Unique even for several events per second
+        self._writer = CaptureWriter(self.directory, _prefix, 0, 0, dict(
+            self.metadata, trigger=name, trigger_time=timestamp, pre_seconds=self.pre_seconds,
+            post_seconds=self.post_seconds), self.fsync_interval)
+        _pre_start = self.ring.find(timestamp - self.pre_seconds)
+        self._writer.write_records(self.ring.records(_pre_start, max(_pre_start, pre_stop)))
+
+    def _finish(self):
+        self._writer.close()
+        _name, _time = self._fired
+        _event = TriggerEvent(_name, _time, self._writer.segments[0] if self._writer.segments else None, self._writer.count)
+        self._writer = None
+        self._fired = None
+        self._deadline = None
+        self.events.append(_event)
+        if self.on_event is not None:
+            self.on_event(_event)
@@ -0,0 +1,302 @@
+import threading
+import time
+
+# Service identifiers
+DIAGNOSTIC_SESSION_CONTROL  = 0x10
+SECURITY_ACCESS             = 0x27
+READ_DATA_BY_IDENTIFIER     = 0x22
+WRITE_DATA_BY_IDENTIFIER    = 0x2E
+ROUTINE_CONTROL             = 0x31
+REQUEST_DOWNLOAD            = 0x34
+TRANSFER_DATA               = 0x36
+REQUEST_TRANSFER_EXIT       = 0x37
+TESTER_PRESENT              = 0x3E
+NEGATIVE_RESPONSE           = 0x7F
+
+# Negative response codes handled by the client
+RESPONSE_PENDING            = 0x78
+
+# Diagnostic sessions
+DEFAULT_SESSION             = 0x01
+PROGRAMMING_SESSION         = 0x02
+EXTENDED_SESSION            = 0x03
+
+# Routine control types
+START_ROUTINE               = 0x01
+STOP_ROUTINE                = 0x02
+REQUEST_ROUTINE_RESULTS     = 0x03
+
+SUPPRESS_POSITIVE_RESPONSE  = 0x80
+
+
+class UDSClient:
+    """
+    UDS (ISO 14229) diagnostic client over an ISO-TP session.
+
+    Every service returns -1 when an ERROR occurs (timeout or negative response, in which case
+    the code is kept in last_nrc) and the positive response payload or a service specific value
+    otherwise. Response pending (NRC 0x78) is handled by waiting up to p2_star for the final reply.
+
+    Example:
+        uds = UDSClient(isotp.open_session(0x7E0, 0x7E8))
+        uds.diagnostic_session_control(PROGRAMMING_SESSION)
+        uds.security_access(0x01, my_key_function)
+        rate = uds.download(0x08000000, image)
+    """
+
+    def __init__(self, session, p2=1, p2_star=5):
+        """
+        :param session the ISOTPSession connected to the ECU
+        :param p2 seconds to wait for the first response to a request
+        :param p2_star seconds to wait for the final response after each response pending
+        """
+        self.session = session
+        self.p2 = p2
+        self.p2_star = p2_star
+        self.last_nrc = None
+
+        self._request_lock = threading.Lock()
+        self._tester_present_alive = False
+        self._tester_present_thread = None
+
+    # =====SERVICES=====
+
+    def diagnostic_session_control(self, session_type):
+        """
+        Changes the diagnostic session (0x10)
+
+        :param session_type e.g. DEFAULT_SESSION, PROGRAMMING_SESSION or EXTENDED_SESSION
+
+        :return -1 if an ERROR occurs
+        :return the session parameter record (P2/P2* timings) as bytes
+        """
+        _res = self.request(bytes((DIAGNOSTIC_SESSION_CONTROL, session_type)))
+        return _res if _res == -1 else _res[2:]
+
+    def security_access(self, level, key_function):
+        """
+        Unlocks a security level (0x27) with the seed/key exchange
+
+        :param level the odd request seed sub-function, the key is sent with level + 1
+        :param key_function called with (seed, level), returns the key as bytes
+
+        :return -1 if an ERROR occurs (e.g. invalid key)
+        :return 1 if the level is unlocked
+        """
+        _res = self.request(bytes((SECURITY_ACCESS, level)))
+        if _res == -1:
+            return -1
+        _seed = _res[2:]
+        if not any(_seed): # A zero seed means the level is already unlocked
+            return 1
+        _key = bytes(key_function(_seed, level))
+        _res = self.request(bytes((SECURITY_ACCESS, level + 1)) + _key)
+        return _res if _res == -1 else 1
+
+    def read_data_by_identifier(self, did):
+        """
+        Reads a data identifier (0x22)
+
+        :param did the 16-bit data identifier
+
+        :return -1 if an ERROR occurs
+        :return the data record as bytes
+        """
+        _res = self.request(bytes((READ_DATA_BY_IDENTIFIER, did >> 8, did & 0xFF)))
+        return _res if _res == -1 else _res[3:]
+
+    def write_data_by_identifier(self, did, data):
+        """
+        Writes a data identifier (0x2E)
+
+        :param did the 16-bit data identifier
+        :param data the data record as bytes
+
+        :return -1 if an ERROR occurs
+        :return 1 if the data was written
+        """
+        _res = self.request(bytes((WRITE_DATA_BY_IDENTIFIER, did >> 8, did & 0xFF)) + bytes(data))
+        return _res if _res == -1 else 1
+
+    def routine_control(self, control_type, routine_id, data=b''):
+        """
+        Starts, stops or requests the results of a routine (0x31)
+
+        :param control_type START_ROUTINE, STOP_ROUTINE or REQUEST_ROUTINE_RESULTS
+        :param routine_id the 16-bit routine identifier
+        :param data the routine option record as bytes
+
+        :return -1 if an ERROR occurs
+        :return the routine status record as bytes
+        """
+        _res = self.request(bytes((ROUTINE_CONTROL, control_type, routine_id >> 8, routine_id & 0xFF)) + bytes(data))
+        return _res if _res == -1 else _res[4:]
+
+    def request_download(self, address, size, address_length=4, size_length=4, data_format=0x00):
+        """
+        Requests a download to the ECU memory (0x34)
+
+        :param address the start address in ECU memory
+        :param size the number of bytes to download
+        :param address_length bytes used to encode the address
+        :param size_length bytes used to encode the size
+        :param data_format the data format identifier (compression/encryption method, 0 for none)
+
+        :return -1 if an ERROR occurs
+        :return the maximum block length (including SID and sequence counter) accepted by TransferData
+        """
+        _alfid = size_length << 4 | address_length
+        _res = self.request(bytes((REQUEST_DOWNLOAD, data_format, _alfid))
+                            + address.to_bytes(address_length, 'big') + size.to_bytes(size_length, 'big'))
+        if _res == -1:
+            return -1
+        _n = _res[1] >> 4 # Length of the maxNumberOfBlockLength field
+        return int.from_bytes(_res[2:2 + _n], 'big')
+
+    def transfer_data(self, sequence, data):
+        """
+        Transfers one block of data (0x36)
+
+        :param sequence the block sequence counter (1-255, wrapping to 0)
+        :param data the block data as bytes
+
+        :return -1 if an ERROR occurs
+        :return 1 if the block was accepted
+        """
+        _res = self.request(bytes((TRANSFER_DATA, sequence)) + data)
+        return _res if _res == -1 else 1
+
+    def request_transfer_exit(self, data=b''):
+        """
+        Ends a data transfer (0x37)
+
+        :return -1 if an ERROR occurs
+        :return the transfer response parameter record as bytes
+        """
+        _res = self.request(bytes((REQUEST_TRANSFER_EXIT,)) + bytes(data))
+        return _res if _res == -1 else _res[1:]
+
+    def tester_present(self):
+        """
+        Sends a tester present (0x3E) with the positive response suppressed
+
+        :return -1 if an ERROR occurs
+        :return 1 if the request was sent
+        """
+        return self.session.send(bytes((TESTER_PRESENT, SUPPRESS_POSITIVE_RESPONSE)))
+
+    # =====BLOCK TRANSFER=====
+
+    def download(self, address, image, block_length=None, data_format=0x00, progress=None):
+        """
+        Streams an image into ECU memory with RequestDownload, TransferData and RequestTransferExit
+
+        UDS allows only one TransferData request in flight, so throughput comes from the block size:
+        the largest block the ECU accepts is used (fewer round trips), and each block goes out as
+        batched ISO-TP consecutive frames.
+
+        :param address the start address in ECU memory
+        :param image the data to download as bytes
+        :param block_length the TransferData length (including SID and sequence counter) to use,
+                            None to use the maximum reported by the ECU
+        :param data_format the data format identifier passed to RequestDownload
+        :param progress optional callback called with (bytes sent, total bytes) after every block
+
+        :return -1 if an ERROR occurs
+        :return the achieved transfer rate in bytes/s
+        """
+        image = memoryview(bytes(image))
+        _start = time.perf_counter()
+        _max = self.request_download(address, len(image), data_format=data_format)
+        if _max == -1:
+            return -1
+        if block_length is not None:
+            _max = min(_max, block_length)
+        _chunk = _max - 2 # SID and sequence counter
+        if _chunk <= 0:
+            return -1
+
+        _seq = 1
+        for _pos in range(0, len(image), _chunk):
+            _block = bytes(image[_pos:_pos + _chunk])
+            if self.transfer_data(_seq, _block) == -1:
+                return -1
+            _seq = (_seq + 1) & 0xFF
+            if progress is not None:
+                progress(_pos + len(_block), len(image))
+
+        if self.request_transfer_exit() == -1:
+            return -1
+        return len(image) / (time.perf_counter() - _start)
+
+    # =====TESTER PRESENT=====
+
+    def start_tester_present(self, interval=2):
+        """
+        Starts sending tester present in the background to keep a non-default session alive.
+        A cycle is skipped when another request is in progress, since that keeps the session alive.
+
+        :param interval seconds between tester present requests
+        """
+        if self._tester_present_alive:
+            return
+        self._tester_present_alive = True
+        self._tester_present_thread = threading.Thread(target=self._tester_present_loop, args=(interval,), name='uds-tp')
+        self._tester_present_thread.daemon = True
+        self._tester_present_thread.start()
+
+    def stop_tester_present(self):
+        """
+        Stops the background tester present
+        """
+        self._tester_present_alive = False
+        if self._tester_present_thread is not None:
+            self._tester_present_thread.join()
+            self._tester_present_thread = None
+
+    def _tester_present_loop(self, interval):
+        _next = time.monotonic() + interval
+        while self._tester_present_alive:
+            time.sleep(min(0.1, max(0, _next - time.monotonic())))
+            if time.monotonic() < _next:
+                continue
+            _next += interval
+            if self._request_lock.acquire(blocking=False):
+                try:
+                    self.tester_present()
+                finally:
+                    self._request_lock.release()
+
+    # =====UTILITY=====
+
+    def request(self, payload):
+        """
+        Sends a request and waits for its positive response
+
+        :param payload the full request, starting with the service identifier
+
+        :return -1 if an ERROR occurs (timeout or negative response, see last_nrc)
+        :return the positive response payload as bytes
+        """
+        _sid = payload[0]
+        with self._request_lock:
+            self.last_nrc = None
+            while self.session.recv(timeout=0) != -1: # Drop stale responses
+                pass
+            if self.session.send(payload) == -1:
+                return -1
+
+            _deadline = time.monotonic() + self.p2
+            while True:
+                _res = self.session.recv(timeout=max(0, _deadline - time.monotonic()))
+                if _res == -1:
+                    return -1
+                if _res[0] == _sid + 0x40:
+                    return _res
+                if _res[0] == NEGATIVE_RESPONSE and len(_res) >= 3 and _res[1] == _sid:
+                    if _res[2] == RESPONSE_PENDING: # ECU is busy, wait for the final response
+                        _deadline = time.monotonic() + self.p2_star
+                        continue
+                    self.last_nrc = _res[2]
+                    return -1
+                # Anything else is not a response to this request, keep waiting
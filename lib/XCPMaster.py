@@ -0,0 +1,339 @@
+import struct
+import threading
+from array import array
+from queue import Empty, Queue
+from lib.CanFrame import CanFrame
+
+# Command codes
+CONNECT                 = 0xFF
+DISCONNECT              = 0xFE
+GET_STATUS              = 0xFD
+SET_MTA                 = 0xF6
+UPLOAD                  = 0xF5
+SHORT_UPLOAD            = 0xF4
+DOWNLOAD                = 0xF0
+SET_DAQ_PTR             = 0xE2
+WRITE_DAQ               = 0xE1
+SET_DAQ_LIST_MODE       = 0xE0
+START_STOP_DAQ_LIST     = 0xDE
+START_STOP_SYNCH        = 0xDD
+FREE_DAQ                = 0xD6
+ALLOC_DAQ               = 0xD5
+ALLOC_ODT               = 0xD4
+ALLOC_ODT_ENTRY         = 0xD3
+
+# Packet identifiers sent by the slave
+PID_RES                 = 0xFF
+PID_ERR                 = 0xFE
+PID_EV                  = 0xFD
+PID_SERV                = 0xFC
+
+
+class DAQSignal:
+    """
+    A measurement variable sampled by a DAQ list
+
+    :param name the column name of the measurement
+    :param address the ECU address of the variable
+    :param fmt the struct format character of the variable, e.g. 'B', 'h', 'I' or 'f' (standard sizes, 'l' is 4 bytes)
+    :param ext the address extension
+
+    :raise ValueError if fmt is not a struct format with a standard size
+    """
+
+    def __init__(self, name, address, fmt, ext=0):
+        if any(c in fmt for c in 'nNP@=<>!'):
+            raise ValueError("Invalid DAQ signal format (native or byte order codes not allowed): {}".format(fmt))
+        self.name = name
+        self.address = address
+        self.fmt = fmt
+        self.ext = ext
+        try:
+            self.size = struct.calcsize('<' + fmt) # The unpacker uses the slave's byte order, so standard sizes
+        except struct.error:
+            raise ValueError("Invalid DAQ signal format: {}".format(fmt))
+
+
+class _ODT:
+    """
+    Decode information for one object descriptor table, set up when the DAQ lists are started
+    """
+    __slots__ = ('signals', 'unpack_from', 'timestamps', 'columns', 'appenders')
+
+    def __init__(self, signals, unpacker):
+        self.signals = signals
+        self.unpack_from = unpacker.unpack_from
+        self.timestamps = array('d')
+        self.columns = [array('d') for _ in signals]
+        self.appenders = tuple(c.append for c in self.columns)
+
+
+class XCPMaster:
+    """
+    XCP-on-CAN master on top of a PCAN_RS_232.
+
+    Commands are sent on cmd_id and answered on res_id. DAQ lists are configured from DAQSignal
+    lists, packed into ODTs that fit the slave's MAX_DTO. Received DAQ frames are decoded in the
+    PCAN receiver thread with a struct.Struct per ODT layout (cached, so identical layouts share
+    one) and appended to timestamped measurement columns, collected with take_measurements().
+
+    Commands return -1 when an ERROR occurs (timeout or error packet, the code is kept in
+    last_error) and the response payload or a command specific value otherwise.
+
+    Example:
+        xcp = XCPMaster(pcan, 0x7F0, 0x7F1)
+        xcp.connect()
+        xcp.add_daq_list(event=0, signals=[DAQSignal('rpm', 0x20001000, 'H'), DAQSignal('map', 0x20001004, 'f')])
+        xcp.start_daq()
+        ...
+        columns = xcp.take_measurements() # {'rpm': (timestamps, values), ...}
+    """
+    _struct_cache = {} # ODT layout -> struct.Struct, shared by all masters
+
+    def __init__(self, pcan, cmd_id, res_id, daq_id=None, ext=False, timeout=1):
+        """
+        :param pcan the PCAN_RS_232 to use. Its receiver thread is started if needed.
+        :param cmd_id the CAN ID the master sends commands on
+        :param res_id the CAN ID the slave sends responses on
+        :param daq_id the CAN ID the slave sends DAQ packets on, None if the same as res_id
+        :param ext True if the IDs are extended (29-bit) identifiers
+        :param timeout seconds to wait for a response
+        """
+        self.pcan = pcan
+        self.cmd_id = cmd_id
+        self.res_id = res_id
+        self.daq_id = res_id if daq_id is None else daq_id
+        self.ext = ext
+        self.timeout = timeout
+        self.last_error = None
+
+        # Slave properties from CONNECT
+        self.max_cto = 8
+        self.max_dto = 8
+        self.byte_order = '<'
+
+        self._daq_lists = []        # (event, prescaler, list of ODT signal lists)
+        self._odts = {}             # Absolute ODT number (PID) -> _ODT, while DAQ is running
+        self._daq_lock = threading.Lock() # Keeps the timestamp and value columns of an ODT the same length
+        self._responses = Queue()
+        self._command_lock = threading.Lock()
+        self.pcan.add_listener(self._on_frames)
+        self.pcan.start_receiver()
+
+    # =====SESSION=====
+
+    def connect(self, mode=0):
+        """
+        Connects to the slave and reads its communication parameters
+
+        :return -1 if an ERROR occurs
+        :return 1 if connected
+        """
+        _res = self.command(bytes((CONNECT, mode)))
+        if _res == -1:
+            return -1
+        self.byte_order = '>' if _res[2] & 0x01 else '<'
+        self.max_cto = _res[3]
+        self.max_dto = int.from_bytes(_res[4:6], 'big' if self.byte_order == '>' else 'little')
+        return 1
+
+    def disconnect(self):
+        _res = self.command(bytes((DISCONNECT,)))
+        return _res if _res == -1 else 1
+
+    def get_status(self):
+        """
+        :return -1 if an ERROR occurs
+        :return the current session status byte
+        """
+        _res = self.command(bytes((GET_STATUS,)))
+        return _res if _res == -1 else _res[1]
+
+    # =====MEMORY=====
+
+    def upload(self, address, size, ext=0):
+        """
+        Reads slave memory, with SHORT_UPLOAD when it fits in one response and UPLOAD otherwise
+
+        :return -1 if an ERROR occurs
+        :return the memory contents as bytes
+        """
+        _chunk = self.max_cto - 1
+        if size <= _chunk:
+            _res = self.command(bytes((SHORT_UPLOAD, size, 0, ext)) + self._address(address))
+            return _res if _res == -1 else bytes(_res[1:1 + size])
+        if self.set_mta(address, ext) == -1:
+            return -1
+        _data = bytearray()
+        while len(_data) < size:
+            _n = min(_chunk, size - len(_data))
+            _res = self.command(bytes((UPLOAD, _n)))
+            if _res == -1:
+                return -1
+            _data += _res[1:1 + _n]
+        return bytes(_data)
+
+    def download(self, address, data, ext=0):
+        """
+        Writes slave memory
+
+        :return -1 if an ERROR occurs
+        :return 1 if the memory was written
+        """
+        if self.set_mta(address, ext) == -1:
+            return -1
+        _chunk = self.max_cto - 2
+        for i in range(0, len(data), _chunk):
+            _part = bytes(data[i:i + _chunk])
+            if self.command(bytes((DOWNLOAD, len(_part))) + _part) == -1:
+                return -1
+        return 1
+
+    def set_mta(self, address, ext=0):
+        _res = self.command(bytes((SET_MTA, 0, 0, ext)) + self._address(address))
+        return _res if _res == -1 else 1
+
+    # =====DAQ=====
+
+    def add_daq_list(self, event, signals, prescaler=1):
+        """
+        Adds a DAQ list to the configuration sent by start_daq()
+
+        :param event the event channel number that triggers the DAQ list (e.g. a 10 ms raster)
+        :param signals a list of DAQSignal objects, packed into as few ODTs as MAX_DTO allows
+        :param prescaler sample every n-th event
+        """
+        _odts = [[]]
+        _free = self.max_dto - 1 # First byte is the PID
+        for _signal in signals:
+            if _signal.size > self.max_dto - 1:
+                raise ValueError("Signal {} does not fit in a DTO".format(_signal.name))
+            if _signal.size > _free:
+                _odts.append([])
+                _free = self.max_dto - 1
+            _odts[-1].append(_signal)
+            _free -= _signal.size
+        self._daq_lists.append((event, prescaler, _odts))
+
+    def clear_daq_lists(self):
+        self._daq_lists = []
+
+    def start_daq(self):
+        """
+        Sends the DAQ list configuration to the slave and starts all DAQ lists synchronously
+
+        :return -1 if an ERROR occurs
+        :return 1 if measurement is running
+        """
+        _cmds = [bytes((FREE_DAQ,)), bytes((ALLOC_DAQ, 0)) + self._word(len(self._daq_lists))]
+        for i, (_event, _prescaler, _odts) in enumerate(self._daq_lists):
+            _cmds.append(bytes((ALLOC_ODT, 0)) + self._word(i) + bytes((len(_odts),)))
+        for i, (_event, _prescaler, _odts) in enumerate(self._daq_lists):
+            for j, _odt in enumerate(_odts):
+                _cmds.append(bytes((ALLOC_ODT_ENTRY, 0)) + self._word(i) + bytes((j, len(_odt))))
+        for i, (_event, _prescaler, _odts) in enumerate(self._daq_lists):
+            for j, _odt in enumerate(_odts):
+                _cmds.append(bytes((SET_DAQ_PTR, 0)) + self._word(i) + bytes((j, 0)))
+                for _signal in _odt:
+                    _cmds.append(bytes((WRITE_DAQ, 0xFF, _signal.size, _signal.ext)) + self._address(_signal.address))
+            _cmds.append(bytes((SET_DAQ_LIST_MODE, 0)) + self._word(i) + self._word(_event) + bytes((_prescaler, 0)))
+        for _cmd in _cmds:
+            if self.command(_cmd) == -1:
+                return -1
+
+        _odts_by_pid = {}
+        for i, (_event, _prescaler, _odts) in enumerate(self._daq_lists):
+            _res = self.command(bytes((START_STOP_DAQ_LIST, 2)) + self._word(i)) # Select for synchronous start
+            if _res == -1:
+                return -1
+            for j, _odt in enumerate(_odts):
+                _odts_by_pid[_res[1] + j] = _ODT(_odt, self._unpacker(_odt))
+        self._odts = _odts_by_pid
+        _res = self.command(bytes((START_STOP_SYNCH, 1)))
+        return _res if _res == -1 else 1
+
+    def stop_daq(self):
+        """
+        Stops all DAQ lists. Measurements received so far stay available to take_measurements().
+        """
+        _res = self.command(bytes((START_STOP_SYNCH, 0)))
+        return _res if _res == -1 else 1
+
+    def take_measurements(self):
+        """
+        Returns the measurements received since the last call and starts new columns
+
+        :return a dict of signal name -> (timestamps, values), both array('d') of equal length
+        """
+        _out = {}
+        for _odt in self._odts.values():
+            _columns = [array('d') for _ in _odt.signals]
+            _appenders = tuple(c.append for c in _columns)
+            _timestamps = array('d')
+            with self._daq_lock:
+                _timestamps, _odt.timestamps = _odt.timestamps, _timestamps
+                _columns, _odt.columns = _odt.columns, _columns
+                _odt.appenders = _appenders
+            for _signal, _column in zip(_odt.signals, _columns):
+                _out[_signal.name] = (_timestamps, _column)
+        return _out
+
+    # =====UTILITY=====
+
+    def command(self, payload):
+        """
+        Sends a command packet and waits for the response
+
+        :return -1 if an ERROR occurs (timeout or error packet, see last_error)
+        :return the response packet as bytes
+        """
+        with self._command_lock:
+            self.last_error = None
+            while not self._responses.empty():
+                self._responses.get_nowait()
+            if self.pcan.transmit_frames([CanFrame(self.cmd_id, self.ext, False, len(payload), payload)]) == -1:
+                return -1
+            try:
+                _res = self._responses.get(timeout=self.timeout)
+            except Empty:
+                return -1
+            if _res[0] != PID_RES:
+                self.last_error = _res[1] if len(_res) > 1 else None
+                return -1
+            return _res
+
+    def close(self):
+        self.pcan.remove_listener(self._on_frames)
+
+    def _on_frames(self, frames):
+        _odts = self._odts
+        for _frame in frames:
+            if _frame.ext != self.ext or _frame.rtr or not _frame.data:
+                continue
+            _pid = _frame.data[0]
+            if _frame.id == self.daq_id and _pid < PID_SERV:
+                _odt = _odts.get(_pid)
+                if _odt is not None:
+                    try:
+                        _values = _odt.unpack_from(_frame.data, 1)
+                    except struct.error: # Frame shorter than the ODT
+                        continue
+                    with self._daq_lock:
+                        _odt.timestamps.append(_frame.timestamp)
+                        for _append, _value in zip(_odt.appenders, _values):
+                            _append(_value)
+            elif _frame.id == self.res_id and _pid in (PID_RES, PID_ERR):
+                self._responses.put(_frame.data)
+
+    def _unpacker(self, signals):
+        _layout = self.byte_order + ''.join(s.fmt for s in signals)
+        _unpacker = self._struct_cache.get(_layout)
+        if _unpacker is None:
+            _unpacker = self._struct_cache[_layout] = struct.Struct(_layout)
+        return _unpacker
+
+    def _address(self, address):
+        return address.to_bytes(4, 'big' if self.byte_order == '>' else 'little')
+
+    def _word(self, n):
+        return n.to_bytes(2, 'big' if self.byte_order == '>' else 'little')
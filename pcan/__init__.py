@@ -0,0 +1,5 @@
+"""
+Headless command line tools for the PCAN-RS-232, usable without a display (no tkinter import).
+
+Run with: python -m pcan <command> --port <port> [options]
+"""
@@ -0,0 +1,232 @@
+import argparse
+import os
+import sys
+import time
+from pcan.common import (BITRATES, BatchWriter, add_device_arguments, install_signal_handlers, open_channel,
+                         open_device, parse_frame)
+from pcan import analyze, convert, db, dump, gen, query, record, replay, stats, trigger
+from pcan.formats import candump_log
+
+UART_BAUDRATES = (230400, 115200, 57600, 38400, 19200, 9600, 2400) # Index is the U command argument
+
+
+# =====COMMANDS=====
+
+def capture(args):
+    """
+    Writes received frames to stdout or a file as candump log lines until stopped
+    """
+    _pcan = open_device(args)
+    if _pcan is None:
+        return 1
+    _stop = install_signal_handlers()
+    _writer = BatchWriter(sys.stdout.buffer if args.output == '-' else open(args.output, 'wb', buffering=1 << 20),
+                          flush_interval=args.flush_interval)
+    _count = 0
+    _start = time.monotonic()
+    _deadline = _start + args.duration if args.duration else float('inf')
+    try:
+        if open_channel(_pcan, args) == -1:
+            return 1
+        while not _stop.is_set() and time.monotonic() < _deadline:
+            _frames = _pcan.read_frames() # Receive loop on this thread, no receiver thread needed
+            if not _frames:
+                _writer.tick()
+                continue
+            if args.count and _count + len(_frames) >= args.count:
+                _frames = _frames[:args.count - _count]
+                _stop.set()
+            _writer.write(''.join(map(candump_log, _frames)))
+            _count += len(_frames)
+    finally:
+        _writer.close()
+        _pcan.close_channel()
+        _pcan.close()
+    _elapsed = time.monotonic() - _start
+    print("Captured {} frames in {:.1f} s ({:.0f} frames/s)".format(_count, _elapsed, _count / _elapsed if _elapsed else 0), file=sys.stderr)
+    return 0
+
+
+def send(args):
+    """
+    Transmits the frames given on the command line, optionally repeated
+    """
+    try:
+        _frames = [parse_frame(f) for f in args.frames]
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    _pcan = open_device(args)
+    if _pcan is None:
+        return 1
+    _stop = install_signal_handlers()
+    _failed = 0
+    try:
+        if open_channel(_pcan, args) == -1:
+            return 1
+        for i in range(args.repeat):
+            if _stop.is_set():
+                break
+            if args.batch:
+                _failed += _pcan.transmit_frames(_frames) == -1
+            else:
+                _failed += sum(_pcan.transmit_frames([f]) == -1 for f in _frames)
+            if args.interval and i < args.repeat - 1:
+                _stop.wait(args.interval)
+    finally:
+        _pcan.close_channel()
+        _pcan.close()
+    if _failed:
+        print("FAILED to send {} {}".format(_failed, 'batches' if args.batch else 'frames'), file=sys.stderr)
+        return 1
+    return 0
+
+
+def configure(args):
+    """
+    Applies the requested settings, in the order the device accepts them (channel closed)
+    """
+    _pcan = open_device(args)
+    if _pcan is None:
+        return 1
+    _steps = []
+    if args.bitrate is not None:
+        _steps.append(("CAN bitrate", lambda: _pcan.set_can_bitrate(BITRATES.index(args.bitrate))))
+    if args.acceptance_code is not None:
+        _steps.append(("acceptance code", lambda: _pcan.set_acceptance_code_register(args.acceptance_code)))
+    if args.acceptance_mask is not None:
+        _steps.append(("acceptance mask", lambda: _pcan.set_acceptance_mask_register(args.acceptance_mask)))
+    if args.filter_mode is not None:
+        _steps.append(("filter mode", lambda: _pcan.set_filter_mode(args.filter_mode == 'single')))
+    if args.timestamps is not None:
+        _steps.append(("timestamps", lambda: _pcan.enable_timestamps(args.timestamps == 'on')))
+    if args.auto_poll is not None:
+        _steps.append(("auto poll", lambda: _pcan.set_auto_poll(args.auto_poll == 'on')))
+    if args.auto_startup is not None:
+        _steps.append(("auto startup", lambda: _pcan.set_auto_startup(args.auto_startup == 'on')))
+    if args.save:
+        _steps.append(("EEPROM save", lambda: _pcan.write_to_eeprom('0')))
+    if args.uart_baudrate is not None: # Last, the port follows the device to the new baudrate
+        _steps.append(("UART baudrate", lambda: _pcan.set_uart_bitrate(UART_BAUDRATES.index(args.uart_baudrate))))
+
+    _failed = 0
+    try:
+        _pcan.close_channel() # Settings are only accepted with the channel closed
+        for _name, _step in _steps:
+            if _step() == -1:
+                print("FAILED to set {}".format(_name), file=sys.stderr)
+                _failed += 1
+            else:
+                print("Set {}".format(_name))
+    finally:
+        _pcan.close()
+    return 1 if _failed else 0
+
+
+def info(args):
+    """
+    Prints the serial number, versions and status flags of the device
+    """
+    _pcan = open_device(args)
+    if _pcan is None:
+        return 1
+    try:
+        _sn = _pcan.get_serial_number()
+        _version = _pcan.get_version_info()
+        _status = _pcan.get_status_flags()
+    finally:
+        _pcan.close()
+    if _sn == -1 or _version == -1:
+        print("FAILED to get PCAN info", file=sys.stderr)
+        return 1
+    print("Serial number:    {}".format(_sn))
+    print("Hardware version: {}".format(_version[0]))
+    print("Software version: {}".format(_version[1]))
+    print("Status flags:     {}".format('unavailable' if _status == -1 else _status))
+    return 0
+
+
+# =====ARGUMENTS=====
+
+def build_parser():
+    _parser = argparse.ArgumentParser(prog='python -m pcan', description="Headless PCAN-RS-232 tools")
+    _commands = _parser.add_subparsers(dest='command', metavar='command')
+    _commands.required = True
+
+    _p = _commands.add_parser('analyze', help="per-ID statistics, period and signal range checks of captures, on all cores")
+    analyze.add_arguments(_p)
+
+    _p = _commands.add_parser('capture', help="write received frames to stdout or a file")
+    add_device_arguments(_p)
+    _p.add_argument('-o', '--output', default='-', help="output file, - for stdout (default)")
+    _p.add_argument('-n', '--count', type=int, default=0, help="stop after this many frames")
+    _p.add_argument('-t', '--duration', type=float, default=0, help="stop after this many seconds")
+    _p.add_argument('--flush-interval', type=float, default=0.5, help="seconds between output flushes when idle")
+    _p.set_defaults(func=capture)
+
+    _p = _commands.add_parser('convert', help="convert logs and captures between candump, ASC, TRC and CSV")
+    convert.add_arguments(_p)
+
+    _p = _commands.add_parser('db', help="store frames and DBC signals in an SQLite database with batched transactions")
+    db.add_arguments(_p)
+
+    _p = _commands.add_parser('dump', help="print received frames as candump, log, ASC or CSV, with ID filters")
+    dump.add_arguments(_p)
+
+    _p = _commands.add_parser('gen', help="generate CAN load and report the achieved rate and errors")
+    gen.add_arguments(_p)
+
+    _p = _commands.add_parser('query', help="select frames from capture directories by ID, time and content, using the indexes")
+    query.add_arguments(_p)
+
+    _p = _commands.add_parser('record', help="record frames into rotating binary capture segments")
+    record.add_arguments(_p)
+
+    _p = _commands.add_parser('replay', help="replay a capture onto the bus with its original timing")
+    replay.add_arguments(_p)
+
+    _p = _commands.add_parser('stats', help="live per-ID rate, period, jitter and payload changes, flagging silent IDs")
+    stats.add_arguments(_p)
+
+    _p = _commands.add_parser('trigger', help="keep a ring of recent frames and save it around trigger events")
+    trigger.add_arguments(_p)
+
+    _p = _commands.add_parser('send', help="transmit frames, e.g. 123#DEADBEEF 12345678#R")
+    add_device_arguments(_p)
+    _p.add_argument('frames', nargs='+', help="frames in candump notation or PCAN transmit commands")
+    _p.add_argument('-r', '--repeat', type=int, default=1, help="number of times the frames are sent")
+    _p.add_argument('-i', '--interval', type=float, default=0, help="seconds between repeats")
+    _p.add_argument('--batch', action='store_true', help="send all frames in one serial write")
+    _p.set_defaults(func=send)
+
+    _p = _commands.add_parser('configure', help="change the device settings")
+    add_device_arguments(_p)
+    _p.add_argument('--uart-baudrate', type=int, choices=UART_BAUDRATES, help="switch the device UART baudrate")
+    _p.add_argument('--acceptance-code', help="acceptance code register, 8 hex digits (AC0-AC3)")
+    _p.add_argument('--acceptance-mask', help="acceptance mask register, 8 hex digits (AM0-AM3)")
+    _p.add_argument('--filter-mode', choices=('single', 'dual'))
+    _p.add_argument('--timestamps', choices=('on', 'off'))
+    _p.add_argument('--auto-poll', choices=('on', 'off'))
+    _p.add_argument('--auto-startup', choices=('on', 'off'))
+    _p.add_argument('--save', action='store_true', help="save the settings to EEPROM")
+    _p.set_defaults(func=configure)
+
+    _p = _commands.add_parser('info', help="print device information")
+    add_device_arguments(_p)
+    _p.set_defaults(func=info)
+    return _parser
+
+
+def main(argv=None):
+    _args = build_parser().parse_args(argv)
+    try:
+        return _args.func(_args)
+    except BrokenPipeError: # Output piped into a command that exited (e.g. head)
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno()) # Keep the interpreter's final flush quiet
+        return 0
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == '__main__':
+    sys.exit(main())
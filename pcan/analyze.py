@@ -0,0 +1,94 @@
+import argparse
+import sys
+import time
+from lib.CaptureAnalyzer import (CHUNK_RECORDS, CaptureAnalyzer, IdStatistics, PeriodCheck, RangeCheck,
+                                 SignalExtraction)
+from lib.FrameArray import np
+
+
+def parse_period(text):
+    """
+    :return the ((id, ext), max gap in s) pair of a period limit given as <id>=<ms>, id in hex
+    """
+    _id, _sep, _ms = text.partition('=')
+    try:
+        _id = int(_id, 16)
+        return (_id, _id > 0x7FF), float(_ms) / 1000
+    except ValueError:
+        raise ValueError("Invalid period limit (expected <id>=<ms>, id in hex): {}".format(text))
+
+
+def analyze(args):
+    try:
+        _limits = dict(parse_period(p) for p in args.period)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    if args.export and not args.dbc:
+        print("--export needs --dbc", file=sys.stderr)
+        return 1
+    _analyses = [IdStatistics()]
+    if _limits:
+        _analyses.append(PeriodCheck(_limits))
+    if args.dbc:
+        _analyses.append(RangeCheck(args.dbc))
+    if args.export:
+        _analyses.append(SignalExtraction(args.dbc, args.message or None))
+
+    _start = time.perf_counter()
+    try:
+        _results = CaptureAnalyzer(_analyses, args.jobs, args.chunk_records).run(args.capture, args.prefix)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    _elapsed = time.perf_counter() - _start
+
+    _stats = _results.pop(0)
+    _count = sum(s.count for s in _stats)
+    print("{} frames, {} IDs, analyzed in {:.2f} s ({:.0f} frames/s)".format(
+        _count, len(_stats), _elapsed, _count / _elapsed if _elapsed else 0))
+    for _s in _stats:
+        print(_s)
+    if _limits:
+        _late = _results.pop(0)
+        print("\n{} period violations".format(len(_late)))
+        for _v in _late[:args.max_violations]:
+            print("  {:>8X}  {:.6f}  gap {:.3f} ms".format(_v.id, _v.previous, _v.gap * 1000))
+    if args.dbc:
+        _ranges = _results.pop(0)
+        print("\n{} signals out of range".format(len(_ranges)))
+        for _v in _ranges:
+            print("  {}.{}: {} values in [{:g}, {:g}], first at {:.6f}".format(
+                _v.message, _v.signal, _v.count, _v.lowest, _v.highest, _v.first))
+    if args.export:
+        _columns = _results.pop(0)
+        np.savez(args.export, **{"{}.{}".format(m, s): col for m, cols in _columns.items() for s, col in cols.items()})
+        print("\nSignals of {} messages written to {}".format(len(_columns), args.export))
+    return 0
+
+
+def add_arguments(parser):
+    parser.add_argument('capture', help="capture segment or directory of segments")
+    parser.add_argument('--prefix', default='', help="only analyze the segments whose name starts with this")
+    parser.add_argument('-p', '--period', action='append', default=[], help="largest allowed gap of a cyclic ID, <id>=<ms> with the id in hex, repeatable")
+    parser.add_argument('--dbc', help="DBC file, checks the signal ranges")
+    parser.add_argument('--export', help="write the decoded signals to this .npz file (needs --dbc)")
+    parser.add_argument('-m', '--message', action='append', default=[], help="only export this message, repeatable")
+    parser.add_argument('--max-violations', type=int, default=20, help="period violations printed (default: %(default)s)")
+    parser.add_argument('-j', '--jobs', type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument('--chunk-records', type=int, default=CHUNK_RECORDS, help="records per chunk (default: %(default)s)")
+    parser.set_defaults(func=analyze)
+
+
+def main(argv=None):
+    _parser = argparse.ArgumentParser(prog='pcan-analyze', description="Analyze captures on all CPU cores")
+    add_arguments(_parser)
+    _args = _parser.parse_args(argv)
+    try:
+        return _args.func(_args)
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+import os
+import signal
+import sys
+import threading
+import time
+from serial import SerialException
+from lib.CanFrame import CanFrame
+from lib.PCAN_RS_232 import PCAN_RS_232
+
+DEFAULT_PORT = os.environ.get('PCAN_PORT', 'COM1')     # Overridden with --port or the PCAN_PORT variable
+DEFAULT_BAUDRATE = 57600
+BITRATES = ('10k', '20k', '50k', '100k', '125k', '250k', '500k', '800k', '1M') # Index is the S command argument
+
+
+def add_device_arguments(parser):
+    """
+    Adds the arguments selecting and configuring the PCAN device to an argparse parser
+    """
+    parser.add_argument('-p', '--port', default=DEFAULT_PORT, help="serial port of the PCAN-RS-232 (default: %(default)s)")
+    parser.add_argument('-b', '--baudrate', type=int, default=DEFAULT_BAUDRATE, help="serial baudrate (default: %(default)s)")
+    parser.add_argument('--timeout', type=float, default=1, help="seconds to wait for a command reply (default: %(default)s)")
+    parser.add_argument('--bitrate', choices=BITRATES, help="set the CAN bitrate before opening the channel")
+    parser.add_argument('--listen-only', action='store_true', help="open the CAN channel in listen-only mode")
+
+
+def open_device(args):
+    """
+    Opens the serial port of the PCAN device
+
+    :return the PCAN_RS_232, None if the port could not be opened (the error is printed)
+    """
+    try:
+        return PCAN_RS_232(args.port, args.baudrate, args.timeout)
+    except SerialException as e:
+        print("Could not open {}: {}".format(args.port, e), file=sys.stderr)
+        return None
+
+
+def open_channel(pcan, args):
+    """
+    Sets the CAN bitrate if requested and opens the CAN channel
+
+    :return -1 if an ERROR occurs (the error is printed)
+    :return 1 if the channel is open
+    """
+    if args.bitrate is not None and pcan.set_can_bitrate(BITRATES.index(args.bitrate)) == -1:
+        print("FAILED to set CAN bitrate", file=sys.stderr)
+        return -1
+    _res = pcan.open_channel_listen() if args.listen_only else pcan.open_channel()
+    if _res == -1: # Typically the channel was left open (e.g. auto startup), close and retry once
+        pcan.close_channel()
+        _res = pcan.open_channel_listen() if args.listen_only else pcan.open_channel()
+        if _res == -1:
+            print("FAILED to open CAN channel", file=sys.stderr)
+    return _res
+
+
+def parse_frame(text):
+    """
+    Parses a frame given on the command line, in candump notation or as a PCAN transmit command
+    Example: '123#DEADBEEF'    - standard data frame
+             '12345678#00FF'   - extended data frame (more than 3 ID digits)
+             '123#R4'          - standard request frame with DLC 4
+             't1234DEADBEEF'   - PCAN transmit command
+
+    :return the CanFrame
+    :raise ValueError if text is not a valid frame
+    """
+    if text[:1] in ('t', 'T', 'r', 'R') and '#' not in text:
+        return CanFrame.from_message(text.encode('ascii'))
+    _id, _sep, _data = text.partition('#')
+    if not _sep or not 1 <= len(_id) <= 8:
+        raise ValueError("Invalid frame: {}".format(text))
+    _ext = len(_id) > 3
+    _id = int(_id, 16)
+    if _id > (0x1FFFFFFF if _ext else 0x7FF):
+        raise ValueError("Invalid CAN ID: {}".format(text))
+    if _data[:1] in ('R', 'r'):
+        _dlc = int(_data[1:] or '0')
+        if not 0 <= _dlc <= 8:
+            raise ValueError("Invalid DLC: {}".format(text))
+        return CanFrame(_id, _ext, True, _dlc)
+    _data = bytes.fromhex(_data.replace('.', ''))
+    if len(_data) > 8:
+        raise ValueError("More than 8 data bytes: {}".format(text))
+    return CanFrame(_id, _ext, False, len(_data), _data)
+
+
+def install_signal_handlers(callback=None):
+    """
+    Makes SIGINT and SIGTERM request a clean stop instead of raising in the middle of a write
+
+    :param callback called when a stop is requested, e.g. to stop a blocking operation
+
+    :return a threading.Event set when a stop was requested
+    """
+    _stop = threading.Event()
+    def _handler(signum, frame):
+        if _stop.is_set(): # Second signal, give up on a clean stop
+            raise KeyboardInterrupt
+        _stop.set()
+        if callback is not None:
+            callback()
+    signal.signal(signal.SIGINT, _handler)
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, _handler)
+    return _stop
+
+
+class BatchWriter:
+    """
+    Collects output text in a preallocated buffer and writes it to a binary stream in large chunks.
+
+    Writing every line to a terminal or pipe costs a system call per line; batching keeps the
+    writes few and large so the output keeps up with the serial link. The buffer is allocated
+    once and reused. Pending text is written when the buffer is full or flush_interval seconds
+    have passed.
+    """
+
+    def __init__(self, stream, flush_size=1 << 16, flush_interval=0.5):
+        """
+        :param stream a binary stream, e.g. sys.stdout.buffer or a file opened with 'wb'
+        :param flush_size size of the buffer in bytes
+        :param flush_interval seconds after which collected text is written anyway
+        """
+        self.stream = stream
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._buffer = bytearray(flush_size)
+        self._view = memoryview(self._buffer)
+        self._length = 0
+        self._last_flush = time.monotonic()
+
+    def write(self, text):
+        """
+        :param text ASCII text, e.g. the lines rendered from one batch of frames
+        """
+        _data = text.encode('ascii')
+        _n = len(_data)
+        if self._length + _n > self.flush_size:
+            self.flush()
+            if _n > self.flush_size: # Larger than the buffer, write it as it is
+                self.stream.write(_data)
+                return
+        self._view[self._length:self._length + _n] = _data
+        self._length += _n
+        self.tick()
+
+    def tick(self):
+        """
+        Writes the collected text if flush_interval has passed, call when idle
+        """
+        if self._length and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._length:
+            self.stream.write(self._view[:self._length])
+            self._length = 0
+        self.stream.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        if self.stream is not sys.stdout.buffer:
+            self.stream.close()
@@ -0,0 +1,107 @@
+import argparse
+import itertools
+import os
+import sys
+import time
+from lib.CaptureFile import EXTENSION
+from lib.CaptureReader import CaptureReader
+from lib.ColumnarCapture import CHUNK_RECORDS, CODECS, EXTENSION as COLUMNAR_EXTENSION, ColumnarReader, ColumnarWriter
+from lib.LogFormats import READERS, ReadErrors, convert, format_of, read_log, write_log
+from pcan.filters import compile_filters, parse_filter
+
+
+def convert_logs(args):
+    try:
+        _match = compile_filters([parse_filter(f) for f in args.filter])
+        _archive = args.destination.endswith(COLUMNAR_EXTENSION)
+        _to = None if _archive else format_of(args.destination, args.to)
+        _columnar = args.source.endswith(COLUMNAR_EXTENSION)
+        _capture = not _columnar and (os.path.isdir(args.source) or args.source.endswith(EXTENSION))
+        _from = None if _capture or _columnar else format_of(args.source, args.from_)
+        _errors = ReadErrors()
+        _start = time.perf_counter()
+        if _archive: # Columnar capture (lib.ColumnarCapture)
+            _count = archive(args, _capture, _columnar, _from, _match, _errors)
+        elif _capture or _columnar: # Binary capture segments (pcan record) or a columnar capture
+            with (ColumnarReader(args.source) if _columnar else CaptureReader(args.source)) as _reader:
+                _frames = _reader.frames()
+                if _match is not None:
+                    _frames = (f for f in _frames if _match(f))
+                _count = write_log(_frames, args.destination, _to)
+        else:
+            _count = convert(args.source, args.destination, _from, _to, _match, _errors)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    _elapsed = time.perf_counter() - _start
+    print("Converted {} frames in {:.2f} s ({:.0f} frames/s)".format(_count, _elapsed, _count / _elapsed if _elapsed else 0),
+          file=sys.stderr)
+    if _errors.count:
+        print("Skipped {} malformed lines, e.g. {}".format(_errors.count, ' | '.join(_errors.lines)), file=sys.stderr)
+    return 0
+
+
+def archive(args, capture, columnar, source_format, match, errors=None):
+    """
+    Writes the source frames into a columnar capture and prints the compression achieved
+
+    :param errors an optional ReadErrors counting the malformed lines of a log source
+
+    :return the number of frames written
+    """
+    with ColumnarWriter(args.destination, {'source': os.path.basename(os.path.normpath(args.source))},
+                        args.chunk_records, args.codec) as _writer:
+        if capture and match is None: # Record arrays straight from the mapped segments
+            with CaptureReader(args.source) as _reader:
+                _size = sum(os.path.getsize(s.path) for s in _reader.segments)
+                for _records in _reader.slice():
+                    _writer.write_array(_records)
+        else:
+            if capture or columnar:
+                _reader = ColumnarReader(args.source) if columnar else CaptureReader(args.source)
+                _frames = _reader.frames()
+            else:
+                _reader = None
+                _frames = read_log(args.source, source_format, errors)
+            _size = sum(os.path.getsize(s.path) for s in _reader.segments) if capture else os.path.getsize(args.source)
+            if match is not None:
+                _frames = (f for f in _frames if match(f))
+            try:
+                while True:
+                    _batch = list(itertools.islice(_frames, 10000))
+                    if not _batch:
+                        break
+                    _writer.write(_batch)
+            finally:
+                if _reader is not None:
+                    _reader.close()
+    _archived = os.path.getsize(args.destination)
+    print("{:.1f} MB -> {:.1f} MB ({:.1f}x)".format(_size / (1 << 20), _archived / (1 << 20), _size / _archived if _archived else 0),
+          file=sys.stderr)
+    return _writer.count
+
+
+def add_arguments(parser):
+    parser.add_argument('source', help="log file (.log, .asc, .trc, .csv), capture segment, capture directory or "
+                                       "columnar capture (.ccap)")
+    parser.add_argument('destination', help="log file to write (.log, .asc, .trc, .csv), or .ccap for a columnar capture")
+    parser.add_argument('--from', dest='from_', choices=sorted(READERS), help="source format (default: from the extension)")
+    parser.add_argument('--to', choices=sorted(READERS), help="destination format (default: from the extension)")
+    parser.add_argument('-f', '--filter', action='append', default=[], help="ID filter <id>:<mask> or <id>~<mask>, repeatable")
+    parser.add_argument('--codec', choices=sorted(CODECS), default='zlib', help="columnar capture compression (default: %(default)s)")
+    parser.add_argument('--chunk-records', type=int, default=CHUNK_RECORDS, help="records per columnar chunk (default: %(default)s)")
+    parser.set_defaults(func=convert_logs)
+
+
+def main(argv=None):
+    _parser = argparse.ArgumentParser(prog='pcan-convert', description="Convert between candump, ASC, TRC and CSV logs and columnar captures")
+    add_arguments(_parser)
+    _args = _parser.parse_args(argv)
+    try:
+        return _args.func(_args)
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+import argparse
+import sqlite3
+import sys
+import time
+from lib.CaptureQuery import CaptureQuery
+from lib.CaptureWriter import device_metadata
+from lib.FrameArray import array_to_frames
+from lib.SQLiteSink import SQLiteSink
+from pcan.common import add_device_arguments, install_signal_handlers, open_channel, open_device
+from pcan.dump import program_hardware_filter
+from pcan.filters import FrameFilter, acceptance_registers, combine_filters, hardware_filters, parse_filter
+
+
+def open_sink(args, metadata):
+    """
+    :return the SQLiteSink for the arguments, None (error printed) if the database or DBC can not be opened
+    """
+    try:
+        return SQLiteSink(args.database, args.dbc, metadata, args.batch_interval, max_pending=args.max_pending,
+                          block=not args.drop, create_indexes=not args.no_index)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print("FAILED to open {}: {}".format(args.database, e), file=sys.stderr)
+        return None
+
+
+def load(args, where):
+    """
+    Bulk loads the frames of a capture directory or segment
+    """
+    try:
+        _query = CaptureQuery(args.load)
+        _results = _query.select(where=where)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return None
+    _sink = open_sink(args, {'source': args.load, 'where': where} if where else {'source': args.load})
+    if _sink is None:
+        return None
+    _stop = install_signal_handlers()
+    try:
+        for _records in _results:
+            _sink.write(list(array_to_frames(_records)))
+            if _stop.is_set() or _sink.error is not None:
+                break
+    finally:
+        _results.close()
+        _sink.close()
+    return _sink
+
+
+def record(args, filters, where):
+    """
+    Stores received frames until stopped
+    """
+    _where = FrameFilter(where) if where else None
+    _match = combine_filters(filters, _where)
+    _hw_filters = hardware_filters(filters, _where)
+    _pcan = open_device(args)
+    if _pcan is None:
+        return None
+    _stop = install_signal_handlers()
+    _sink = None
+    _hw_filter = False
+    try:
+        _metadata = device_metadata(_pcan, bitrate=args.bitrate, listen_only=args.listen_only, filters=args.filter)
+        if where:
+            _metadata['where'] = where
+        if args.hw_filter and _match is not None and program_hardware_filter(_pcan, _hw_filters) == 1:
+            _hw_filter = True
+            _metadata['acceptance_code'], _metadata['acceptance_mask'] = acceptance_registers(_hw_filters)
+        if open_channel(_pcan, args) == -1:
+            return None
+        _sink = open_sink(args, _metadata)
+        if _sink is None:
+            return None
+        if _match is None:
+            _pcan.add_listener(_sink.write)
+        else:
+            _pcan.add_listener(lambda frames: _sink.write([f for f in frames if _match(f)]))
+        _pcan.start_receiver()
+        _deadline = time.monotonic() + args.duration if args.duration else float('inf')
+        while not _stop.wait(1) and time.monotonic() < _deadline and _pcan.receiver_alive and _sink.error is None:
+            pass
+    finally:
+        _pcan.stop_receiver()
+        if _sink is not None:
+            _sink.close()
+        _pcan.close_channel()
+        if _hw_filter: # Leave the module accepting everything again
+            _pcan.set_acceptance_code_register('00000000')
+            _pcan.set_acceptance_mask_register('FFFFFFFF')
+        _pcan.close()
+    return _sink
+
+
+def db(args):
+    try:
+        _filters = [parse_filter(f) for f in args.filter]
+        if args.where:
+            FrameFilter(args.where) # Reported here, before the device or database is opened
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    if args.load and _filters:
+        print("ID filters only apply to received frames, use --where with --load", file=sys.stderr)
+        return 1
+    _start = time.monotonic()
+    _sink = load(args, args.where) if args.load else record(args, _filters, args.where)
+    if _sink is None:
+        return 1
+    _elapsed = time.monotonic() - _start
+    if _sink.error is not None:
+        print("FAILED to write {}: {}".format(args.database, _sink.error), file=sys.stderr)
+    print("Stored {} frames and {} signal values as run {} of {} in {:.1f} s ({:.0f} frames/s, {} transactions){}".format(
+        _sink.count, _sink.signal_count, _sink.run, args.database, _elapsed, _sink.count / _elapsed if _elapsed else 0,
+        _sink.transactions, ", {} frames dropped".format(_sink.dropped) if _sink.dropped else ''), file=sys.stderr)
+    return 1 if _sink.error is not None else 0
+
+
+def add_arguments(parser):
+    add_device_arguments(parser)
+    parser.add_argument('database', help="SQLite database file, created if needed; each invocation adds a run")
+    parser.add_argument('filter', nargs='*', help="ID filters <id>:<mask> or <id>~<mask> (inverted) in hex")
+    parser.add_argument('-w', '--where', metavar='EXPR', help="filter expression (see lib.FrameFilter), combined with the ID filters")
+    parser.add_argument('--dbc', help="also store the signals of the messages defined in this DBC file")
+    parser.add_argument('--load', metavar='CAPTURE', help="load a capture segment or directory instead of receiving")
+    parser.add_argument('-T', '--duration', type=float, default=0, help="stop after this many seconds")
+    parser.add_argument('--batch-interval', type=float, default=0.5, help="seconds between transactions (default: %(default)s)")
+    parser.add_argument('--max-pending', type=int, default=500000,
+                        help="frames queued for the database before receiving waits (default: %(default)s)")
+    parser.add_argument('--drop', action='store_true', help="drop frames instead of waiting when the queue is full")
+    parser.add_argument('--no-index', action='store_true', help="do not create the ID and signal indexes at the end")
+    parser.add_argument('--hw-filter', action='store_true', help="also program the ID filters (or the IDs the expression "
+                                                                 "is restricted to) into the acceptance registers")
+    parser.set_defaults(func=db)
+
+
+def main(argv=None):
+    _parser = argparse.ArgumentParser(prog='pcan-db', description="Store CAN traffic and DBC signals in an SQLite database")
+    add_arguments(_parser)
+    _args = _parser.parse_args(argv)
+    try:
+        return _args.func(_args)
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == '__main__':
+    sys.exit(main())
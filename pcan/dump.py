@@ -0,0 +1,162 @@
+import argparse
+import os
+import sys
+import time
+from pcan.common import BatchWriter, add_device_arguments, install_signal_handlers, open_channel, open_device
+from pcan.filters import FrameFilter, acceptance_registers, combine_filters, hardware_filters, parse_filter
+from pcan.formats import FORMATS
+
+TIMESTAMP_MODES = ('absolute', 'delta', 'zero', 'device', 'none')
+DEFAULT_TIMESTAMPS = {'candump': 'none', 'log': 'absolute', 'asc': 'zero', 'csv': 'absolute'}
+
+
+class Timestamper:
+    """
+    Converts frame timestamps to the requested mode:
+        absolute - host reception time (seconds since the epoch)
+        delta    - seconds since the previous frame shown
+        zero     - seconds since the first frame shown
+        device   - PCAN millisecond timestamps (enable with configure --timestamps on), unwrapped
+                   across the one minute roll over and counted from the first frame shown.
+                   Frames without one fall back to the host time.
+        none     - no timestamp
+    """
+
+    def __init__(self, mode):
+        self.mode = mode
+        self._first = None
+        self._last = None
+        self._device_last = None
+        self._device_offset = 0
+
+    def stamp(self, frame):
+        _mode = self.mode
+        if _mode == 'none':
+            return None
+        if _mode == 'absolute':
+            return frame.timestamp
+        _ts = frame.timestamp
+        if _mode == 'device' and frame.device_timestamp is not None:
+            _ms = frame.device_timestamp
+            if self._device_last is not None and _ms < self._device_last: # Rolled over
+                self._device_offset += 60000
+            self._device_last = _ms
+            _ts = (_ms + self._device_offset) / 1000
+        if self._first is None:
+            self._first = self._last = _ts
+        if _mode == 'delta':
+            _delta = _ts - self._last
+            self._last = _ts
+            return _delta
+        return _ts - self._first
+
+
+def program_hardware_filter(pcan, filters):
+    """
+    Programs the acceptance registers (single filter mode) to pass the filtered IDs only
+
+    :return -1 if an ERROR occurs or the filters can not be expressed in the registers (the reason is printed)
+    :return 1 if the registers are set
+    """
+    _registers = acceptance_registers(filters)
+    if _registers is None:
+        print("Filters can not be programmed into the acceptance registers, filtering in software only", file=sys.stderr)
+        return -1
+    pcan.close_channel() # Registers are only accepted with the channel closed
+    if pcan.set_filter_mode(True) == -1 or pcan.set_acceptance_code_register(_registers[0]) == -1 \
+            or pcan.set_acceptance_mask_register(_registers[1]) == -1:
+        print("FAILED to program the acceptance registers, filtering in software only", file=sys.stderr)
+        return -1
+    print("Acceptance code {} mask {}".format(*_registers), file=sys.stderr)
+    return 1
+
+
+def dump(args):
+    try:
+        _filters = [parse_filter(f) for f in args.filter]
+        _where = FrameFilter(args.where) if args.where else None
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    _header, _line, _footer = FORMATS[args.format]
+    _timestamper = Timestamper(args.timestamps or DEFAULT_TIMESTAMPS[args.format])
+    _stamp = _timestamper.stamp
+    _match = combine_filters(_filters, _where)
+
+    _pcan = open_device(args)
+    if _pcan is None:
+        return 1
+    _stop = install_signal_handlers()
+    _writer = BatchWriter(sys.stdout.buffer if args.output == '-' else open(args.output, 'wb'), args.buffer_size,
+                          args.flush_interval)
+    _hw_filter = args.hw_filter and _match is not None and program_hardware_filter(_pcan, hardware_filters(_filters, _where)) == 1
+    _count = 0
+    _start = time.time()
+    _deadline = time.monotonic() + args.duration if args.duration else float('inf')
+    try:
+        if open_channel(_pcan, args) == -1:
+            return 1
+        if _header is not None:
+            _writer.write(_header(_start, _timestamper.mode == 'delta'))
+        while not _stop.is_set() and time.monotonic() < _deadline:
+            _frames = _pcan.read_frames()
+            if _match is not None and _frames:
+                _frames = [f for f in _frames if _match(f)]
+            if not _frames:
+                _writer.tick()
+                continue
+            if args.count and _count + len(_frames) >= args.count:
+                _frames = _frames[:args.count - _count]
+                _stop.set()
+            _writer.write(''.join([_line(f, _stamp(f)) for f in _frames])) # One render and copy per batch
+            _count += len(_frames)
+        if _footer is not None:
+            _writer.write(_footer())
+    finally:
+        _writer.close()
+        _pcan.close_channel()
+        if _hw_filter: # Leave the module accepting everything again
+            _pcan.set_acceptance_code_register('00000000')
+            _pcan.set_acceptance_mask_register('FFFFFFFF')
+        _pcan.close()
+    if not args.quiet:
+        _elapsed = time.time() - _start
+        print("Dumped {} frames in {:.1f} s ({:.0f} frames/s)".format(_count, _elapsed, _count / _elapsed if _elapsed else 0), file=sys.stderr)
+    return 0
+
+
+def add_arguments(parser):
+    add_device_arguments(parser)
+    parser.add_argument('filter', nargs='*', help="ID filters <id>:<mask> or <id>~<mask> (inverted) in hex, "
+                                                  "frames matching any filter are shown")
+    parser.add_argument('-w', '--where', metavar='EXPR', help="filter expression, e.g. 'id in 0x300..0x3FF and data[0] & 0x80' "
+                                                             "(see lib.FrameFilter), combined with the ID filters")
+    parser.add_argument('-f', '--format', choices=sorted(FORMATS), default='candump', help="output format (default: %(default)s)")
+    parser.add_argument('-t', '--timestamps', choices=TIMESTAMP_MODES, help="timestamp mode (default depends on the format)")
+    parser.add_argument('-o', '--output', default='-', help="output file, - for stdout (default)")
+    parser.add_argument('-n', '--count', type=int, default=0, help="stop after this many frames")
+    parser.add_argument('-T', '--duration', type=float, default=0, help="stop after this many seconds")
+    parser.add_argument('--hw-filter', action='store_true', help="also program the ID filters (or the IDs the expression "
+                                                                 "is restricted to) into the PCAN acceptance registers so "
+                                                                 "rejected frames never cross the serial link")
+    parser.add_argument('--buffer-size', type=int, default=1 << 16, help="output buffer size in bytes (default: %(default)s)")
+    parser.add_argument('--flush-interval', type=float, default=0.2, help="seconds between output flushes when idle")
+    parser.add_argument('-q', '--quiet', action='store_true', help="no summary on stderr")
+    parser.set_defaults(func=dump)
+
+
+def main(argv=None):
+    _parser = argparse.ArgumentParser(prog='pcan-dump', description="Dump CAN traffic received by a PCAN-RS-232")
+    add_arguments(_parser)
+    _args = _parser.parse_args(argv)
+    try:
+        return _args.func(_args)
+    except BrokenPipeError: # Output piped into a command that exited (e.g. head)
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+from lib.FrameFilter import FrameFilter, IdFilter, acceptance_registers # Re-exported for the CLI tools
+
+
+def parse_filter(text):
+    """
+    Parses a filter given as <id>:<mask> or <id>~<mask> (inverted), in hex.
+    IDs with more than 3 digits or above 0x7FF are extended. A bare <id> matches that ID only.
+
+    :return the IdFilter
+    :raise ValueError if text is not a valid filter
+    """
+    _invert = '~' in text
+    _id, _sep, _mask = text.partition('~' if _invert else ':')
+    try:
+        _ext = len(_id) > 3 or int(_id, 16) > 0x7FF
+        _full = 0x1FFFFFFF if _ext else 0x7FF
+        _id = int(_id, 16)
+        _mask = int(_mask, 16) if _sep else _full
+    except ValueError:
+        raise ValueError("Invalid filter: {}".format(text))
+    if _id > _full:
+        raise ValueError("Invalid CAN ID in filter: {}".format(text))
+    return IdFilter(_id, _mask & _full, _ext, _invert)
+
+
+def compile_filters(filters):
+    """
+    Builds a predicate accepting the frames that match any of the filters
+
+    :return a function taking a CanFrame and returning True if it passes, None if there are no filters
+    """
+    if not filters:
+        return None
+    if all(not f.invert and f.mask == (0x1FFFFFFF if f.ext else 0x7FF) for f in filters):
+        _keys = frozenset((f.id, f.ext) for f in filters) # Exact IDs only, one set lookup per frame
+        return lambda frame: (frame.id, frame.ext) in _keys
+    _filters = tuple((f.id & f.mask, f.mask, f.ext, f.invert) for f in filters)
+    def _match(frame):
+        _id = frame.id
+        _ext = frame.ext
+        for _code, _mask, _f_ext, _invert in _filters:
+            if ((_id & _mask) == _code and _ext == _f_ext) != _invert:
+                return True
+        return False
+    return _match
+
+
+def combine_filters(filters, where=None):
+    """
+    Builds a predicate accepting the frames that match any of the ID filters and the filter expression
+
+    :param filters IdFilters, frames must match one of them (none for any ID)
+    :param where a lib.FrameFilter, None for no expression
+
+    :return a function taking a CanFrame and returning True if it passes, None if there is nothing to filter
+    """
+    _match = compile_filters(filters)
+    if where is None:
+        return _match
+    _where = where.match
+    if _match is None:
+        return _where
+    return lambda frame: _match(frame) and _where(frame)
+
+
+def hardware_filters(filters, where=None):
+    """
+    :return the IdFilters to program into the acceptance registers: the ID filters if given, else
+            the IDs the filter expression is restricted to (see lib.FrameFilter.id_filters()), None if neither
+    """
+    if filters:
+        return filters
+    return where.id_filters() if where is not None else None
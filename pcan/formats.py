@@ -0,0 +1,27 @@
+from lib.LogFormats import INTERFACE, CSV_HEADER, asc_footer, asc_header, asc_line, candump_log, csv_line
+
+# Output formats: each has a header(start time, delta), a line(frame, timestamp) and a footer() function.
+# The timestamp passed to line() is already converted to the requested mode (see pcan.dump), None for no timestamp.
+# The file formats themselves (and their readers) live in lib.LogFormats.
+
+
+def candump_line(frame, timestamp):
+    """
+    :return the candump screen line of a frame, e.g. ' (0.001000)  pcan0  123   [4]  DE AD BE EF'
+    """
+    _id = "{:08X}".format(frame.id) if frame.ext else "{:>8X}".format(frame.id)
+    _data = 'remote request' if frame.rtr else frame.data.hex(' ').upper()
+    _line = "  {}  {}   [{}]  {}\n".format(INTERFACE, _id, frame.dlc, _data)
+    return _line if timestamp is None else " ({:.6f}){}".format(timestamp, _line)
+
+
+def csv_header(start, delta=False):
+    return CSV_HEADER
+
+
+FORMATS = {
+    'candump':  (None, candump_line, None),
+    'log':      (None, candump_log, None),
+    'asc':      (asc_header, asc_line, asc_footer),
+    'csv':      (csv_header, csv_line, None),
+}
@@ -0,0 +1,195 @@
+import argparse
+import os
+import random
+import sys
+import time
+from lib.CanFrame import CanFrame
+from pcan.common import add_device_arguments, install_signal_handlers, open_channel, open_device
+
+# Status flag bits reported by get_status_flags()
+STATUS_FLAGS = (
+    (0x01, "CAN receive FIFO full"),
+    (0x02, "CAN transmit FIFO full"),
+    (0x04, "Error warning"),
+    (0x08, "Data overrun"),
+    (0x20, "Error passive"),
+    (0x40, "Arbitration lost"),
+    (0x80, "Bus error (e.g. no ACK)"),
+)
+
+
+class FrameGenerator:
+    """
+    Produces the frames to send. Each field is 'r' (random), 'i' (incrementing) or a fixed value.
+    """
+
+    def __init__(self, id='r', dlc='r', data='r', ext=False, seed=None):
+        """
+        :param id 'r', 'i' or the ID in hex
+        :param dlc 'r', 'i' or the DLC (0-8)
+        :param data 'r', 'i' or the payload in hex (its length sets the DLC)
+        :param ext True to send extended (29-bit) frames
+        """
+        self.ext = ext
+        self._max_id = 0x1FFFFFFF if ext else 0x7FF
+        self._random = random.Random(seed)
+        self._id_mode = id if id in ('r', 'i') else 'fixed'
+        self._id = 0 if self._id_mode != 'fixed' else int(id, 16)
+        if self._id > self._max_id:
+            raise ValueError("CAN ID out of range: {}".format(id))
+        self._data_mode = data if data in ('r', 'i') else 'fixed'
+        self._data = bytes.fromhex(data) if self._data_mode == 'fixed' else b''
+        if len(self._data) > 8:
+            raise ValueError("More than 8 data bytes: {}".format(data))
+        self._dlc_mode = dlc if dlc in ('r', 'i') else 'fixed'
+        self._dlc = len(self._data) if self._data_mode == 'fixed' else (0 if self._dlc_mode != 'fixed' else int(dlc))
+        if not 0 <= self._dlc <= 8:
+            raise ValueError("Invalid DLC: {}".format(dlc))
+        self._counter = 0
+
+    def next(self):
+        """
+        :return the next CanFrame
+        """
+        if self._id_mode == 'r':
+            _id = self._random.randint(0, self._max_id)
+        else:
+            _id = self._id
+            if self._id_mode == 'i':
+                self._id = 0 if self._id == self._max_id else self._id + 1
+
+        if self._data_mode == 'fixed':
+            _dlc = self._dlc
+        elif self._dlc_mode == 'r':
+            _dlc = self._random.randint(0, 8)
+        else:
+            _dlc = self._dlc
+            if self._dlc_mode == 'i':
+                self._dlc = (self._dlc + 1) % 9
+
+        if self._data_mode == 'r':
+            _data = self._random.getrandbits(64).to_bytes(8, 'little')[:_dlc]
+        elif self._data_mode == 'i':
+            _data = self._counter.to_bytes(8, 'little')[:_dlc]
+            self._counter = (self._counter + 1) & 0xFFFFFFFFFFFFFFFF
+        else:
+            _data = self._data
+        return CanFrame(_id, self.ext, False, _dlc, _data)
+
+
+class LoadStats:
+    """
+    Counts transmitted frames, rejected frames and raised status flags
+    """
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.end = None         # Set when sending stops
+        self.sent = 0           # Frames acknowledged by the PCAN module
+        self.rejected = 0       # Frames answered with BEL (e.g. transmit FIFO full, bus off)
+        self.status_reads = 0
+        self.flag_counts = {_bit: 0 for _bit, _name in STATUS_FLAGS}
+
+    def add_status(self, flags):
+        self.status_reads += 1
+        for _bit in self.flag_counts:
+            if flags & _bit:
+                self.flag_counts[_bit] += 1
+
+    def report(self):
+        _elapsed = (self.end or time.monotonic()) - self.start
+        _lines = ["Sent {} frames in {:.2f} s: {:.0f} frames/s".format(self.sent, _elapsed, self.sent / _elapsed if _elapsed else 0),
+                  "Rejected (BEL): {}".format(self.rejected)]
+        if self.status_reads:
+            _lines.append("Status flags raised in {} reads:".format(self.status_reads))
+            _lines += ["  {:<26} {}".format(_name, self.flag_counts[_bit]) for _bit, _name in STATUS_FLAGS]
+        return '\n'.join(_lines)
+
+
+def generate(args):
+    try:
+        _generator = FrameGenerator(args.id, args.dlc, args.data, args.ext, args.seed)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    _pcan = open_device(args)
+    if _pcan is None:
+        return 1
+    _stop = install_signal_handlers()
+    _stats = LoadStats()
+    _interval = args.batch / args.rate if args.rate else 0 # Seconds per batch
+    try:
+        if open_channel(_pcan, args) == -1:
+            return 1
+        _pcan.start_receiver() # Keeps received frames from being mistaken for transmit replies
+        _stats.start = time.monotonic()
+        _next_send = _stats.start
+        _next_status = _stats.start + args.status_interval if args.status_interval else float('inf')
+        _next_report = _stats.start + 1
+        _deadline = _stats.start + args.duration if args.duration else float('inf')
+        while not _stop.is_set():
+            _n = args.batch if not args.count else min(args.batch, args.count - _stats.sent - _stats.rejected)
+            _now = time.monotonic()
+            if _n <= 0 or _now >= _deadline:
+                break
+            if _interval:
+                if _now < _next_send:
+                    _stop.wait(_next_send - _now)
+                    continue
+                _next_send = max(_next_send + _interval, _now - 1) # Do not burst more than 1 s of backlog
+            _replies = _pcan.send_messages([_generator.next().to_message() for _ in range(_n)])
+            _rejected = _replies.count(-1)
+            _stats.sent += _n - _rejected
+            _stats.rejected += _rejected
+            if _now >= _next_status:
+                _flags = _pcan.get_status_flags()
+                if _flags != -1:
+                    _stats.add_status(int(_flags, 16))
+                _next_status = _now + args.status_interval
+            if args.verbose and _now >= _next_report:
+                print("{:.0f} s: {} sent, {} rejected".format(_now - _stats.start, _stats.sent, _stats.rejected), file=sys.stderr)
+                _next_report += 1
+        _stats.end = time.monotonic()
+        if args.status_interval: # Final read so short runs report the flags too
+            _flags = _pcan.get_status_flags()
+            if _flags != -1:
+                _stats.add_status(int(_flags, 16))
+    finally:
+        _pcan.stop_receiver()
+        _pcan.close_channel()
+        _pcan.close()
+    print(_stats.report())
+    return 0
+
+
+def add_arguments(parser):
+    add_device_arguments(parser)
+    parser.add_argument('-I', '--id', default='r', help="'r' random, 'i' incrementing or the ID in hex (default: r)")
+    parser.add_argument('-L', '--dlc', default='r', help="'r' random, 'i' incrementing or the DLC (default: r)")
+    parser.add_argument('-D', '--data', default='r', help="'r' random, 'i' incrementing or the payload in hex (default: r)")
+    parser.add_argument('-e', '--ext', action='store_true', help="send extended (29-bit) frames")
+    parser.add_argument('-r', '--rate', type=float, default=0, help="target frames/s, 0 for as fast as possible (default)")
+    parser.add_argument('-B', '--batch', type=int, default=1, help="frames per serial write (default: %(default)s)")
+    parser.add_argument('-n', '--count', type=int, default=0, help="stop after this many frames")
+    parser.add_argument('-T', '--duration', type=float, default=0, help="stop after this many seconds")
+    parser.add_argument('--status-interval', type=float, default=1, help="seconds between status flag reads, 0 to disable")
+    parser.add_argument('--seed', type=int, help="random seed, for repeatable runs")
+    parser.add_argument('-v', '--verbose', action='store_true', help="print progress every second")
+    parser.set_defaults(func=generate)
+
+
+def main(argv=None):
+    _parser = argparse.ArgumentParser(prog='pcan-gen', description="Generate CAN load through a PCAN-RS-232")
+    add_arguments(_parser)
+    _args = _parser.parse_args(argv)
+    try:
+        return _args.func(_args)
+    except BrokenPipeError:
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+from lib.CaptureQuery import CaptureQuery
+from lib.FrameArray import FRAME_DTYPE, array_to_frames, np
+from pcan.common import BatchWriter
+from pcan.dump import DEFAULT_TIMESTAMPS, Timestamper
+from pcan.formats import FORMATS
+
+
+def parse_id(text):
+    """
+    :return the (id, ext) pair of an ID given in hex, extended if it has more than 3 digits or is above 0x7FF
+    """
+    try:
+        _id = int(text, 16)
+    except ValueError:
+        raise ValueError("Invalid CAN ID (expected hex): {}".format(text))
+    _ext = len(text) > 3 or _id > 0x7FF
+    if _id > (0x1FFFFFFF if _ext else 0x7FF):
+        raise ValueError("Invalid CAN ID: {}".format(text))
+    return _id, _ext
+
+
+def parse_time(text):
+    """
+    :return the timestamp of a time given in seconds since the epoch or as an ISO date and time (local time)
+    """
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise ValueError("Invalid time (expected seconds since the epoch or YYYY-MM-DDTHH:MM:SS): {}".format(text))
+
+
+def query(args):
+    try:
+        _ids = [parse_id(i) for i in args.id] or None
+        _t0 = parse_time(args.start) if args.start else None
+        _t1 = parse_time(args.stop) if args.stop else None
+        _changed = [int(b) for c in args.changed for b in c.split(',')] if args.changed else None
+        _start = time.perf_counter()
+        _query = CaptureQuery(args.capture, args.prefix)
+        _results = _query.select(_ids, _t0, _t1, args.where, _changed)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    _count = 0
+    if args.export:
+        _parts = []
+        for _records in _results:
+            _parts.append(_records)
+            _count += len(_records)
+            if args.count and _count >= args.count:
+                _results.close()
+                break
+        _records = np.concatenate(_parts)[:args.count or None] if _parts else np.zeros(0, FRAME_DTYPE)
+        np.savez(args.export, **{n: _records[n] for n in _records.dtype.names})
+        _count = len(_records)
+    elif args.count_only:
+        _count = sum(len(r) for r in _results)
+    else:
+        _header, _line, _footer = FORMATS[args.format]
+        _timestamper = Timestamper(args.timestamps or DEFAULT_TIMESTAMPS[args.format])
+        _stamp = _timestamper.stamp
+        _writer = BatchWriter(sys.stdout.buffer if args.output == '-' else open(args.output, 'wb'))
+        try:
+            if _header is not None:
+                _writer.write(_header(_t0 or _query.start or 0.0, _timestamper.mode == 'delta'))
+            for _records in _results:
+                if args.count and _count + len(_records) >= args.count:
+                    _records = _records[:args.count - _count]
+                _writer.write(''.join([_line(f, _stamp(f)) for f in array_to_frames(_records)]))
+                _count += len(_records)
+                if args.count and _count >= args.count:
+                    break
+            if _footer is not None:
+                _writer.write(_footer())
+        finally:
+            _results.close()
+            _writer.close()
+    _elapsed = time.perf_counter() - _start
+    _stats = _query.stats
+    if args.count_only:
+        print(_count)
+    if not args.quiet:
+        print("{} frames in {:.2f} s; read {} of {} segments, {} of {} blocks in range".format(
+            _count, _elapsed, _stats.segments_read, _stats.segments, _stats.blocks_read, _stats.blocks), file=sys.stderr)
+    return 0
+
+
+def add_arguments(parser):
+    parser.add_argument('capture', help="capture segment or directory of segments")
+    parser.add_argument('--prefix', default='', help="only query the segments whose name starts with this")
+    parser.add_argument('-i', '--id', action='append', default=[], help="CAN ID in hex (extended if more than 3 digits), repeatable")
+    parser.add_argument('--from', dest='start', help="start time, seconds since the epoch or YYYY-MM-DDTHH:MM:SS")
+    parser.add_argument('--to', dest='stop', help="end time (exclusive), seconds since the epoch or YYYY-MM-DDTHH:MM:SS")
+    parser.add_argument('-w', '--where', metavar='EXPR', help="filter expression (see lib.FrameFilter)")
+    parser.add_argument('-c', '--changed', action='append', metavar='BYTES', help="only frames whose payload byte(s) "
+                        "changed from the previous frame of the ID, e.g. 2 or 0,1, repeatable")
+    parser.add_argument('-f', '--format', choices=sorted(FORMATS), default='log', help="output format (default: %(default)s)")
+    parser.add_argument('-t', '--timestamps', choices=('absolute', 'delta', 'zero', 'none'),
+                        help="timestamp mode (default depends on the format)")
+    parser.add_argument('-o', '--output', default='-', help="output file, - for stdout (default)")
+    parser.add_argument('-n', '--count', type=int, default=0, help="stop after this many frames")
+    parser.add_argument('--count-only', action='store_true', help="only print the number of matching frames")
+    parser.add_argument('--export', help="write the matching records to this .npz file (one array per field)")
+    parser.add_argument('-q', '--quiet', action='store_true', help="no summary on stderr")
+    parser.set_defaults(func=query)
+
+
+def main(argv=None):
+    _parser = argparse.ArgumentParser(prog='pcan-query', description="Query capture directories by ID, time and content")
+    add_arguments(_parser)
+    _args = _parser.parse_args(argv)
+    try:
+        return _args.func(_args)
+    except BrokenPipeError: # Output piped into a command that exited (e.g. head)
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+import argparse
+import sys
+import time
+from lib.CaptureWriter import CaptureWriter, device_metadata
+from lib.FrameArray import RECORD_SIZE
+from pcan.common import add_device_arguments, install_signal_handlers, open_channel, open_device
+from pcan.dump import program_hardware_filter
+from pcan.filters import FrameFilter, acceptance_registers, combine_filters, hardware_filters, parse_filter
+
+
+def record(args):
+    try:
+        _filters = [parse_filter(f) for f in args.filter]
+        _where = FrameFilter(args.where) if args.where else None
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    _match = combine_filters(_filters, _where)
+    _hw_filters = hardware_filters(_filters, _where)
+    _pcan = open_device(args)
+    if _pcan is None:
+        return 1
+    _stop = install_signal_handlers()
+    _writer = None
+    _hw_filter = False
+    try:
+        _metadata = device_metadata(_pcan, bitrate=args.bitrate, listen_only=args.listen_only, filters=args.filter)
+        if args.where:
+            _metadata['where'] = args.where
+        if args.hw_filter and _match is not None and program_hardware_filter(_pcan, _hw_filters) == 1:
+            _hw_filter = True
+            _metadata['acceptance_code'], _metadata['acceptance_mask'] = acceptance_registers(_hw_filters)
+        if open_channel(_pcan, args) == -1:
+            return 1
+        _writer = CaptureWriter(args.directory, args.prefix, int(args.max_mb * (1 << 20)), args.max_minutes * 60,
+                                _metadata, args.fsync_interval)
+        if _match is None:
+            _pcan.add_listener(_writer.write)
+        else:
+            _pcan.add_listener(lambda frames: _writer.write([f for f in frames if _match(f)]))
+        _pcan.start_receiver()
+        _deadline = time.monotonic() + args.duration if args.duration else float('inf')
+        while not _stop.wait(1) and time.monotonic() < _deadline and _pcan.receiver_alive:
+            pass
+    finally:
+        _pcan.stop_receiver()
+        if _writer is not None:
+            _writer.close()
+        _pcan.close_channel()
+        if _hw_filter: # Leave the module accepting everything again
+            _pcan.set_acceptance_code_register('00000000')
+            _pcan.set_acceptance_mask_register('FFFFFFFF')
+        _pcan.close()
+    print("Recorded {} frames into {} segments ({:.1f} MB)".format(
+        _writer.count, len(_writer.segments), _writer.count * RECORD_SIZE / (1 << 20)), file=sys.stderr)
+    return 0
+
+
+def add_arguments(parser):
+    add_device_arguments(parser)
+    parser.add_argument('filter', nargs='*', help="ID filters <id>:<mask> or <id>~<mask> (inverted) in hex")
+    parser.add_argument('-w', '--where', metavar='EXPR', help="filter expression (see lib.FrameFilter), combined with the ID filters")
+    parser.add_argument('-d', '--directory', default='logs', help="directory the segments are written to (default: %(default)s)")
+    parser.add_argument('--prefix', default='capture', help="segment file name prefix (default: %(default)s)")
+    parser.add_argument('--max-mb', type=float, default=256, help="segment size limit in MB, 0 for none (default: %(default)s)")
+    parser.add_argument('--max-minutes', type=float, default=60, help="segment duration limit, 0 for none (default: %(default)s)")
+    parser.add_argument('--fsync-interval', type=float, default=1, help="seconds between fsyncs (default: %(default)s)")
+    parser.add_argument('-T', '--duration', type=float, default=0, help="stop after this many seconds")
+    parser.add_argument('--hw-filter', action='store_true', help="also program the ID filters (or the IDs the expression "
+                                                                 "is restricted to) into the acceptance registers")
+    parser.set_defaults(func=record)
+
+
+def main(argv=None):
+    _parser = argparse.ArgumentParser(prog='pcan-record', description="Record CAN traffic into binary capture segments")
+    add_arguments(_parser)
+    _args = _parser.parse_args(argv)
+    try:
+        return _args.func(_args)
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import argparse
+import sys
+from lib.CaptureReader import CaptureReader
+from lib.CaptureReplayer import CaptureReplayer
+from pcan.common import add_device_arguments, install_signal_handlers, open_channel, open_device
+from pcan.filters import compile_filters, parse_filter
+
+
+def parse_remap(text):
+    """
+    :return the (old ID, new ID) pair of a remap given as <old>=<new> in hex
+    """
+    _old, _sep, _new = text.partition('=')
+    try:
+        return int(_old, 16), int(_new, 16)
+    except ValueError:
+        raise ValueError("Invalid remap (expected <old>=<new> in hex): {}".format(text))
+
+
+def replay(args):
+    try:
+        _match = compile_filters([parse_filter(f) for f in args.filter])
+        _remap = dict(parse_remap(r) for r in args.remap) or None
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    try:
+        _reader = CaptureReader(args.capture)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    if not len(_reader):
+        print("No frames in {}".format(args.capture), file=sys.stderr)
+        return 1
+    _t0 = _reader.start + args.start
+    _t1 = _reader.start + args.end if args.end else None
+    _pcan = open_device(args)
+    if _pcan is None:
+        return 1
+    _replayer = CaptureReplayer(_pcan, 0 if args.asap else args.speed, _match, _remap,
+                                args.batch_window / 1000 if args.batch_window is not None else None, args.max_batch)
+    _stop = install_signal_handlers(_replayer.stop)
+    try:
+        if open_channel(_pcan, args) == -1:
+            return 1
+        for i in range(args.loop):
+            if _stop.is_set():
+                break
+            print(_replayer.replay(_reader.frames(_t0, _t1)))
+    finally:
+        _pcan.stop_receiver()
+        _pcan.close_channel()
+        _pcan.close()
+        _reader.close()
+    return 0
+
+
+def add_arguments(parser):
+    add_device_arguments(parser)
+    parser.add_argument('capture', help="capture segment or directory of segments")
+    parser.add_argument('-f', '--filter', action='append', default=[], help="ID filter <id>:<mask> or <id>~<mask>, repeatable")
+    parser.add_argument('-m', '--remap', action='append', default=[], help="send ID <old> as <new>, given as <old>=<new> in hex, repeatable")
+    parser.add_argument('-s', '--speed', type=float, default=1, help="speed factor (default: %(default)s)")
+    parser.add_argument('--asap', action='store_true', help="send as fast as possible, ignoring the timing")
+    parser.add_argument('--start', type=float, default=0, help="seconds into the capture to start at")
+    parser.add_argument('--end', type=float, default=0, help="seconds into the capture to stop at, 0 for the end")
+    parser.add_argument('--batch-window', type=float, help="ms of deadlines sent in one serial write (default: one frame time)")
+    parser.add_argument('--max-batch', type=int, default=16, help="largest number of frames per serial write (default: %(default)s)")
+    parser.add_argument('--loop', type=int, default=1, help="number of times the capture is replayed")
+    parser.set_defaults(func=replay)
+
+
+def main(argv=None):
+    _parser = argparse.ArgumentParser(prog='pcan-replay', description="Replay a capture onto the bus through a PCAN-RS-232")
+    add_arguments(_parser)
+    _args = _parser.parse_args(argv)
+    try:
+        return _args.func(_args)
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+import argparse
+import os
+import sys
+import time
+from lib.FrameStatistics import FrameStatistics
+from pcan.common import add_device_arguments, install_signal_handlers, open_channel, open_device
+from pcan.filters import compile_filters, parse_filter
+
+CLEAR_SCREEN = '\033[H\033[J'
+
+
+def format_table(stats, overdue, now):
+    """
+    :return the statistics table, overdue IDs marked with '!' and their silence
+    """
+    _lines = []
+    for _s in stats:
+        _line = str(_s)
+        if (_s.id, _s.ext) in overdue:
+            _line += "  ! silent {:.0f} ms".format((now - _s.last) * 1000)
+        _lines.append(_line)
+    return '\n'.join(_lines) + '\n'
+
+
+def stats(args):
+    try:
+        _match = compile_filters([parse_filter(f) for f in args.filter])
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    _pcan = open_device(args)
+    if _pcan is None:
+        return 1
+    _stats = FrameStatistics()
+    _stop = install_signal_handlers()
+    _clear = CLEAR_SCREEN if sys.stdout.isatty() else '\n' # Redraw on a terminal, blank line between tables otherwise
+    try:
+        if open_channel(_pcan, args) == -1:
+            return 1
+        if _match is None:
+            _pcan.add_listener(_stats.update)
+        else:
+            _pcan.add_listener(lambda frames: _stats.update([f for f in frames if _match(f)]))
+        _pcan.start_receiver()
+        _deadline = time.monotonic() + args.duration if args.duration else float('inf')
+        while not _stop.wait(args.interval) and time.monotonic() < _deadline and _pcan.receiver_alive:
+            _overdue = {(s.id, s.ext) for s in _stats.overdue(factor=args.overdue_factor)}
+            sys.stdout.write(_clear + format_table(_stats.snapshot(), _overdue, time.time()))
+            sys.stdout.flush()
+    finally:
+        _pcan.stop_receiver()
+        _pcan.close_channel()
+        _pcan.close()
+    _overdue = {(s.id, s.ext) for s in _stats.overdue(factor=args.overdue_factor)}
+    sys.stdout.write(_clear + format_table(_stats.snapshot(), _overdue, time.time()))
+    return 0
+
+
+def add_arguments(parser):
+    add_device_arguments(parser)
+    parser.add_argument('filter', nargs='*', help="ID filters <id>:<mask> or <id>~<mask> (inverted) in hex")
+    parser.add_argument('-i', '--interval', type=float, default=1, help="seconds between table updates (default: %(default)s)")
+    parser.add_argument('-T', '--duration', type=float, default=0, help="stop after this many seconds")
+    parser.add_argument('--overdue-factor', type=float, default=3,
+                        help="flag IDs silent for this many periods (default: %(default)s)")
+    parser.set_defaults(func=stats)
+
+
+def main(argv=None):
+    _parser = argparse.ArgumentParser(prog='pcan-stats', description="Live per-ID rate, period, jitter and payload changes")
+    add_arguments(_parser)
+    _args = _parser.parse_args(argv)
+    try:
+        return _args.func(_args)
+    except BrokenPipeError: # Output piped into a command that exited (e.g. head)
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == '__main__':
+    sys.exit(main())
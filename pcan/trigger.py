@@ -0,0 +1,82 @@
+import argparse
+import sys
+import time
+from lib.CaptureWriter import device_metadata
+from lib.FrameFilter import FrameFilter
+from lib.TriggerCapture import TriggerCapture
+from pcan.common import add_device_arguments, install_signal_handlers, open_channel, open_device
+
+def trigger(args):
+    try:
+        _triggers = {t: FrameFilter(t).match for t in args.trigger}
+        _status_mask = int(args.status, 16) if args.status else 0
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    if not _triggers and not _status_mask:
+        print("No trigger given (use -e and/or --status)", file=sys.stderr)
+        return 1
+    _pcan = open_device(args)
+    if _pcan is None:
+        return 1
+    _stop = install_signal_handlers()
+    _capture = None
+    try:
+        # Enough for the pre-trigger window at the highest frame rate of the serial link (6 characters per frame)
+        _capacity = args.capacity or int(args.pre * _pcan.baudrate / 10 / 6) + 1024
+        _capture = TriggerCapture(args.directory, _triggers, args.pre, args.post, _capacity, args.prefix,
+                                  device_metadata(_pcan, bitrate=args.bitrate, listen_only=args.listen_only),
+                                  args.max_events, on_event=lambda e: print("{} at {:.6f}: {} frames in {}".format(
+                                      e.name, e.time, e.count, e.path), file=sys.stderr))
+        if open_channel(_pcan, args) == -1:
+            return 1
+        _pcan.add_listener(_capture.update)
+        _pcan.start_receiver()
+        _deadline = time.monotonic() + args.duration if args.duration else float('inf')
+        while not _stop.wait(args.status_interval if _status_mask else 0.1) and time.monotonic() < _deadline \
+                and _pcan.receiver_alive:
+            if _status_mask and _capture.armed:
+                _flags = _pcan.get_status_flags()
+                if _flags != -1 and int(_flags, 16) & _status_mask:
+                    _capture.fire("status {}".format(_flags))
+            _capture.tick()
+            if args.max_events and len(_capture.events) >= args.max_events:
+                break
+    finally:
+        _pcan.stop_receiver()
+        if _capture is not None:
+            _capture.close()
+        _pcan.close_channel()
+        _pcan.close()
+    print("{} captures written to {}".format(len(_capture.events), args.directory), file=sys.stderr)
+    return 0
+
+
+def add_arguments(parser):
+    add_device_arguments(parser)
+    parser.add_argument('-e', '--trigger', action='append', default=[],
+                        help="trigger filter expression (see lib.FrameFilter), e.g. \"id == 0x7E8 and data[1] == 0x7F\", repeatable")
+    parser.add_argument('--status', help="status flags (hex mask) that fire a capture, e.g. 80 for bus errors")
+    parser.add_argument('--status-interval', type=float, default=0.5, help="seconds between status polls (default: %(default)s)")
+    parser.add_argument('-d', '--directory', default='triggers', help="directory the captures are written to (default: %(default)s)")
+    parser.add_argument('--prefix', default='trigger', help="capture file name prefix (default: %(default)s)")
+    parser.add_argument('--pre', type=float, default=5, help="seconds kept before the trigger (default: %(default)s)")
+    parser.add_argument('--post', type=float, default=5, help="seconds recorded after the trigger (default: %(default)s)")
+    parser.add_argument('--capacity', type=int, default=0, help="frames held in the ring (default: enough for --pre at full link rate)")
+    parser.add_argument('-n', '--max-events', type=int, default=0, help="stop after this many captures")
+    parser.add_argument('-T', '--duration', type=float, default=0, help="stop after this many seconds")
+    parser.set_defaults(func=trigger)
+
+
+def main(argv=None):
+    _parser = argparse.ArgumentParser(prog='pcan-trigger', description="Capture the traffic around trigger events")
+    add_arguments(_parser)
+    _args = _parser.parse_args(argv)
+    try:
+        return _args.func(_args)
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -54,29 +54,32 @@ class ButtonFrame(Frame):
         self.acceptance_window = AcceptanceRegWindow(self.master, True)
 
     def autopoll_callback(self):
-        self._autopoll = not self._autopoll
-        _res = self.master.update_auto_poll(self._autopoll)
-
-        # TODO: Verify button image with actual hardware autopoll status?
-        if _res != -1: # Auto poll command successfully sent
-            if self._autopoll:
-                self.autopoll_button.config(relief=SUNKEN)
-            else: 
-                self.autopoll_button.config(relief=RAISED)
+        _en = not self._autopoll
+        def _done(_res):
+            # TODO: Verify button image with actual hardware autopoll status?
+            if _res != -1: # Auto poll command successfully sent
+                self._autopoll = _en
+                if self._autopoll:
+                    self.autopoll_button.config(relief=SUNKEN)
+                else:
+                    self.autopoll_button.config(relief=RAISED)
+        self.master.update_auto_poll(_en, _done)
 
     def autostartup_callback(self):
         if not self._autostartup:
             _result = messagebox.askquestion('Auto Startup','Do you want to enable auto startup (this will prevent CAN transmisions)') 
             if _result: # User would like to enable auto startup from it being disabled
-                self._autostartup = True
-                _res = self.master.update_auto_startup(self._autostartup) # Send enable auto startup command
-                if _res != -1: # Auto startup command successfully sent
-                    self.autostartup_button.config(relief=SUNKEN, bg="red") # Depress the button and make it red
+                def _done(_res):
+                    if _res != -1: # Auto startup command successfully sent
+                        self._autostartup = True
+                        self.autostartup_button.config(relief=SUNKEN, bg="red") # Depress the button and make it red
+                self.master.update_auto_startup(True, _done) # Send enable auto startup command
         else:
-            self._autostartup = False
-            _res = self.master.update_auto_startup(self._autostartup) # Send disable auto startup command
-            if _res != -1: # Auto startup command successfully sent
-                self.autostartup_button.config(relief=RAISED, bg="SystemButtonFace") # Release the button and make it green
+            def _done(_res):
+                if _res != -1: # Auto startup command successfully sent
+                    self._autostartup = False
+                    self.autostartup_button.config(relief=RAISED, bg="SystemButtonFace") # Release the button and make it green
+            self.master.update_auto_startup(False, _done) # Send disable auto startup command
 
     def can_baudrate_callback(self):
         self.baudrate_window = OptionsPopup(self.master, 1)
@@ -85,14 +88,20 @@ class ButtonFrame(Frame):
         self.baudrate_window = OptionsPopup(self.master, 0)
 
     def filter_callback(self):
-        if self.master.update_filter_mode(not self._filter_mode) != -1: # Filter command successfully sent
-            self._filter_mode = not self._filter_mode
-        self.filter_button.config(relief=SUNKEN) if self._filter_mode else self.filter_button.config(relief=RAISED)
+        _mode = not self._filter_mode
+        def _done(_res):
+            if _res != -1: # Filter command successfully sent
+                self._filter_mode = _mode
+            self.filter_button.config(relief=SUNKEN) if self._filter_mode else self.filter_button.config(relief=RAISED)
+        self.master.update_filter_mode(_mode, _done)
 
     def timestamp_callback(self):
-        if self.master.update_timestamp(not self._timestamp) != -1: # Filter command successfully sent
-            self._timestamp = not self._timestamp
-        self.timestamp_button.config(relief=SUNKEN) if self._timestamp else self.timestamp_button.config(relief=RAISED)
+        _en = not self._timestamp
+        def _done(_res):
+            if _res != -1: # Timestamp command successfully sent
+                self._timestamp = _en
+            self.timestamp_button.config(relief=SUNKEN) if self._timestamp else self.timestamp_button.config(relief=RAISED)
+        self.master.update_timestamp(_en, _done)
 
     def eeprom_write_callback(self):
         self.baudrate_window = OptionsPopup(self.master, 2)
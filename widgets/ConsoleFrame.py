@@ -1,57 +1,224 @@
-import threading
-from tkinter import Button, Frame, StringVar, Text
-from tkinter.constants import COMMAND, END
+import mmap
 from datetime import datetime
-import serial
+from tkinter import Button, Entry, Frame, Label, Scrollbar, Text, filedialog, messagebox
+from tkinter.font import nametofont
+from tkinter.constants import BOTH, DISABLED, END, LEFT, NORMAL, RIGHT, TOP, X, Y
+from lib.CaptureFile import EXTENSION, read_segment_info
+from lib.FrameArray import RECORD_SIZE, unpack_frame
+from lib.FrameFilter import FrameFilter
+from lib.FrameRing import FrameRing
 
 class ConsoleFrame(Frame):
-    def __init__(self, master, *args, **kwargs):
+    UPDATE_INTERVAL = 33        # ms between console updates (~30 Hz)
+    HISTORY_DEPTH = 100000      # Frames kept for scroll-back
+
+    def __init__(self, master, history=HISTORY_DEPTH, *args, **kwargs):
+        """
+        :param history the number of received frames kept for scroll-back
+        """
         super().__init__(master=master, *args, **kwargs)
         self.master = master
-        self.alive = True
-        self.connected = False
+        self._ser = None
+        self._update_job = None
 
         # Initialize frame-specific variables
-        self.serial_output = StringVar() # Holds the latest output from the serial port
-        self.serial_output.trace_add('write', self.serial_output_observer)
+        self.history = FrameRing(history)   # Received frames, written directly by the receiver thread
+        self.where = None                   # FrameFilter received frames must match to be kept, None for all
+        self._capture = None                # Mapped capture segment being browsed instead of the live history
+        self._capture_rows = 0
+        self._capture_header = 0
+        self._top = 0                       # Index of the first visible row
+        self._follow = True                 # Keep the newest frame in view
+        self._rendered = None               # (top, total) of the rows on screen
 
         # Initialize widgets
-        self.console = Text(self, bg="black", fg="white")
+        self.filter_bar = Frame(self)
+        self.filter_label = Label(self.filter_bar, text="Filter:")
+        self.filter_entry = Entry(self.filter_bar)
+        self.filter_entry.bind('<Return>', self._on_filter)
+        self._entry_bg = self.filter_entry.cget('bg')
+        self.open_button = Button(self.filter_bar, text="Open capture...", command=self._on_open_capture)
+        self.live_button = Button(self.filter_bar, text="Live", command=self.close_capture, state=DISABLED)
+        self.console = Text(self, bg="black", fg="white", wrap='none')
+        self.scrollbar = Scrollbar(self, command=self._on_scroll)
+        self.console.bind('<MouseWheel>', self._on_mouse_wheel)
+        self.console.bind('<Button-4>', lambda e: self._scroll_rows(-3))
+        self.console.bind('<Button-5>', lambda e: self._scroll_rows(3))
 
         # Place widgets
-        self.console.pack()
+        self.filter_label.pack(side=LEFT)
+        self.live_button.pack(side=RIGHT, padx=(3, 0))
+        self.open_button.pack(side=RIGHT, padx=(3, 0))
+        self.filter_entry.pack(side=LEFT, fill=X, expand=True)
+        self.filter_bar.pack(side=TOP, fill=X, pady=(0, 3))
+        self.scrollbar.pack(side=RIGHT, fill=Y)
+        self.console.pack(side=LEFT, fill=BOTH, expand=True)
 
     def begin(self, s):
+        if self._ser is not None: # Re-initialized with new settings, stop listening to the old device
+            self._ser.remove_listener(self._receive)
         self._ser = s
-        self._start_reader()
+        self._ser.add_listener(self._receive)
+        self._ser.start_receiver()
+        if self._update_job is None:
+            self._update_job = self.after(self.UPDATE_INTERVAL, self._update_console)
 
-    # ===OBSERVERS===
+    def set_filter(self, text):
+        """
+        Keeps only the received frames matching a filter expression (see lib.FrameFilter), e.g.
+        'id in 0x300..0x3FF and data[0] & 0x80'. Applies to frames received from now on.
 
-    def serial_output_observer(self, *args):
-        _now = datetime.now()
-        print(_now) # Debug
-        _frame = self.master.pcan.parse_frame_message(self.serial_output.get())
-        self.console.insert(END, "{} | {} | {} | {} | {}".format(_now, _frame[0], _frame[1], _frame[2], _frame[3]))
-        self.console.see(END)
+        :param text the filter expression, empty or None to keep all frames
+        :raise ValueError if the expression is invalid
+        """
+        self.where = FrameFilter(text) if text and text.strip() else None
 
-    # ===TERMINAL FUNCTIONS===
+    def _receive(self, frames):
+        """
+        Adds received frames to the history (listener, called from the receiver thread)
+        """
+        _where = self.where # Read once, the filter may be replaced by the Tk thread
+        self.history.extend(frames if _where is None else [f for f in frames if _where.match(f)])
+
+    def _on_filter(self, event=None):
+        try:
+            self.set_filter(self.filter_entry.get())
+        except ValueError:
+            self.filter_entry.configure(bg="#F8C8C8") # Keep the previous filter
+            return
+        self.filter_entry.configure(bg=self._entry_bg)
+
+    # ===CAPTURE BROWSING===
+
+    def open_capture(self, path):
+        """
+        Browses a capture segment (see lib.CaptureFile) instead of the live history. Only the
+        visible rows are read from the file.
 
-    def _start_reader(self):
-        """Start reader thread"""
-        self._reader_alive = True
-        # start serial->console thread
-        self.receiver_thread = threading.Thread(target=self.reader, name='rx')
-        self.receiver_thread.daemon = True
-        self.receiver_thread.start()
-        
-    def reader(self):
-        """loop and copy serial->console"""
+        :raise OSError if the file can not be read
+        :raise ValueError if the file is not a capture segment
+        """
+        with open(path, 'rb') as f:
+            _map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) # ValueError if empty
         try:
-            while self.alive and not self.connected:
-                self.connected = True
-                data = self._ser.read(self._ser.in_waiting or 1) # read all that is there or wait for one byte
-                if data: # If data is present, write to console
-                    self.serial_output.set(data)
-        except serial.SerialException: # If borked, kill thread
-            self.alive = False
-            raise       # XXX handle instead of re-raise?
+            _info = read_segment_info(_map)
+        except ValueError:
+            _map.close()
+            raise
+        self.close_capture()
+        self._capture = _map
+        self._capture_header = _info.header_size
+        self._capture_rows = _info.count # Excludes the footer of a closed segment
+        self.live_button.configure(state=NORMAL)
+        self._top = 0
+        self._follow = False
+        self._rendered = None
+
+    def close_capture(self):
+        """
+        Returns to the live history
+        """
+        if self._capture is not None:
+            self._capture.close()
+            self._capture = None
+        self.live_button.configure(state=DISABLED)
+        self._follow = True
+        self._rendered = None
+
+    def _on_open_capture(self):
+        _path = filedialog.askopenfilename(parent=self, title="Open capture segment",
+                                           filetypes=[("Capture segments", "*" + EXTENSION), ("All files", "*")])
+        if not _path:
+            return
+        try:
+            self.open_capture(_path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Open capture", "Can not open {}:\n{}".format(_path, e), parent=self)
+
+    # ===TERMINAL FUNCTIONS===
+
+    def _total_rows(self):
+        return self._capture_rows if self._capture is not None else len(self.history)
+
+    def _visible_rows(self):
+        _height = self.console.winfo_height()
+        if _height <= 1: # Not mapped yet
+            return int(self.console.cget('height'))
+        return max(1, _height // nametofont(self.console.cget('font')).metrics('linespace'))
+
+    def _rows(self, start, stop):
+        """
+        :return the CanFrame objects of rows start to stop, from the capture file or the history
+        """
+        if self._capture is None:
+            return self.history.slice(start, stop)
+        stop = min(stop, self._capture_rows)
+        if start >= stop:
+            return []
+        _offset = self._capture_header
+        return [unpack_frame(self._capture, _offset + i * RECORD_SIZE) for i in range(start, stop)]
+
+    def _update_console(self):
+        """
+        Tk timer callback: redraws the visible window if it changed. Only the rows on screen are
+        formatted, so the cost does not depend on the frame rate or the history depth.
+        """
+        _total = self._total_rows()
+        _visible = self._visible_rows()
+        if self._follow:
+            self._top = max(0, _total - _visible)
+        if self._capture is None and len(self.history) == self.history.capacity:
+            _key = (self._top, self.history.total) # Full ring: rows shift even though the count does not change
+        else:
+            _key = (self._top, _total)
+        if _key != self._rendered:
+            self._render(_total, _visible)
+            self._rendered = _key
+        self._update_job = self.after(self.UPDATE_INTERVAL, self._update_console)
+
+    def _render(self, total, visible):
+        _text = ''.join(self.format_frame(f) for f in self._rows(self._top, self._top + visible))
+        self.console.config(state=NORMAL)
+        self.console.delete('1.0', END)
+        self.console.insert('1.0', _text)
+        self.console.config(state=DISABLED)
+        if total:
+            self.scrollbar.set(self._top / total, min(1.0, (self._top + visible) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _scroll_to(self, top):
+        _total = self._total_rows()
+        _visible = self._visible_rows()
+        self._top = max(0, min(int(top), _total - _visible))
+        self._follow = self._capture is None and self._top >= _total - _visible
+        self._rendered = None
+
+    def _scroll_rows(self, n):
+        self._scroll_to(self._top + n)
+
+    def _on_scroll(self, *args):
+        """
+        Scrollbar command: ('moveto', fraction) or ('scroll', n, 'units'|'pages')
+        """
+        if args[0] == 'moveto':
+            self._scroll_to(float(args[1]) * self._total_rows())
+        elif args[0] == 'scroll':
+            _n = int(args[1])
+            self._scroll_rows(_n * self._visible_rows() if args[2] == 'pages' else _n)
+
+    def _on_mouse_wheel(self, event):
+        self._scroll_rows(-3 if event.delta > 0 else 3)
+        return 'break'
+
+    @staticmethod
+    def format_frame(frame):
+        """
+        :return the console line for a CanFrame
+        """
+        if frame.ext:
+            _type = 'R' if frame.rtr else 'T'
+        else:
+            _type = 'r' if frame.rtr else 't'
+        return "{} | {} | {:08X} | {} | {}\n".format(
+            datetime.fromtimestamp(frame.timestamp).strftime('%H:%M:%S.%f')[:-3], _type, frame.id, frame.dlc, frame.data.hex().upper())
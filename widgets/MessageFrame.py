@@ -149,11 +149,17 @@ class MessageFrame(Frame):
         self.master.transmit_message((_type + _id + _dlc + _data + '\r').encode("utf-8"))
 
     def open_callback(self):
-        if self.master.update_pcan_open(True):
+        self.master.update_pcan_open(True, self._open_done)
+
+    def close_callback(self):
+        self.master.update_pcan_open(False, self._close_done)
+
+    def _open_done(self, success):
+        if success:
             self._open = True
             self.open_button.configure(relief=SUNKEN, bg="lime")
 
-    def close_callback(self):
-        if self.master.update_pcan_open(False):
+    def _close_done(self, success):
+        if success:
             self._open = False
             self.open_button.configure(relief=RAISED, bg="SystemButtonFace")
\ No newline at end of file
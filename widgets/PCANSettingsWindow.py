@@ -38,6 +38,11 @@ class PCANSettingsWindow(Toplevel):
         self.set_button.grid(row=3, column=0, columnspan=2, sticky="NSEW", padx=5, pady=5)
 
     def close_window(self):
-        if self.master.update_pcan_settings():
-            self.destroy()
+        def _done(_opened):
+            if _opened:
+                self.destroy()
+            else:
+                self.set_button.configure(state=NORMAL)
+        self.set_button.configure(state=DISABLED) # Until the device is opened on the executor
+        self.master.update_pcan_settings(done=_done)
     
\ No newline at end of file
@@ -0,0 +1,143 @@
+from bisect import bisect_left
+from tkinter import Frame, Scrollbar
+from tkinter.constants import BOTH, LEFT, RIGHT, Y
+from tkinter.ttk import Treeview
+from lib.FrameStatistics import FrameStatistics
+
+class TraceFrame(Frame):
+    """
+    Bus monitor view with one row per CAN ID showing the last data, frame count, period and jitter.
+
+    The receiver thread only updates the statistics of each ID (see lib.FrameStatistics); the
+    Tk timer then updates the rows of the IDs received since the last tick in place. The cost of
+    a tick depends on the number of IDs that changed, not on the number of frames received, so the
+    view keeps up with a busy bus. Bytes that changed since the previous refresh are marked with
+    '*' and the row highlighted; cyclic IDs that stopped or are late are highlighted in red.
+    """
+    UPDATE_INTERVAL = 100   # ms between table updates
+    OVERDUE_TICKS   = 10    # Table updates between overdue checks
+    COLUMNS = (('id', "ID", 80), ('type', "Type", 40), ('dlc', "DLC", 35), ('data', "Data", 220),
+               ('count', "Count", 70), ('period', "Period (ms)", 80), ('jitter', "Jitter (ms)", 75),
+               ('max_gap', "Max gap (ms)", 85))
+
+    def __init__(self, master, *args, **kwargs):
+        super().__init__(master=master, *args, **kwargs)
+        self.master = master
+        self._ser = None
+        self._update_job = None
+
+        # Initialize frame-specific variables
+        self.statistics = FrameStatistics() # Written by the receiver thread
+        self._shown = {}            # (id, ext) -> data shown in the row
+        self._order = []            # Sorted keys, in row order
+        self._highlighted = set()   # Keys whose row carries the 'changed' tag
+        self._overdue = set()       # Keys whose row carries the 'overdue' tag
+        self._ticks = 0
+
+        # Initialize widgets
+        self.table = Treeview(self, columns=[c[0] for c in self.COLUMNS], show='headings', selectmode='browse')
+        for _name, _text, _width in self.COLUMNS:
+            self.table.heading(_name, text=_text)
+            self.table.column(_name, width=_width, minwidth=_width, stretch=_name == 'data', anchor='w')
+        self.table.tag_configure('changed', background="#FFF3B0")
+        self.table.tag_configure('overdue', background="#F8C8C8")
+        self.scrollbar = Scrollbar(self, command=self.table.yview)
+        self.table.configure(yscrollcommand=self.scrollbar.set)
+
+        # Place widgets
+        self.scrollbar.pack(side=RIGHT, fill=Y)
+        self.table.pack(side=LEFT, fill=BOTH, expand=True)
+
+    def begin(self, s):
+        if self._ser is not None: # Re-initialized with new settings, stop listening to the old device
+            self._ser.remove_listener(self.statistics.update)
+        self._ser = s
+        self._ser.add_listener(self.statistics.update)
+        self._ser.start_receiver()
+        if self._update_job is None:
+            self._update_job = self.after(self.UPDATE_INTERVAL, self._update_table)
+
+    def clear(self):
+        """
+        Removes all rows and resets the counters
+        """
+        self.statistics.clear()
+        self.table.delete(*self.table.get_children())
+        self._shown = {}
+        self._order = []
+        self._highlighted = set()
+        self._overdue = set()
+
+    # ===TRACE FUNCTIONS===
+
+    def _update_table(self):
+        """
+        Tk timer callback: updates the rows of the IDs received since the last tick
+        """
+        _dirty = self.statistics.take_dirty()
+        _updates = [(k, self.statistics.get(*k)) for k in _dirty]
+
+        for _key in self._highlighted - _dirty: # Unchanged since the last tick, remove the highlight
+            if self.table.exists(self._iid(_key)):
+                self.table.item(self._iid(_key), tags=())
+        _highlighted = set()
+
+        for _key, _stats in _updates:
+            _iid = self._iid(_key)
+            _previous = self._shown.get(_key)
+            _values = self._row_values(_stats, _previous)
+            if _previous is None: # New ID, insert in ID order
+                _index = bisect_left(self._order, _key)
+                self._order.insert(_index, _key)
+                self.table.insert('', _index, iid=_iid, values=_values)
+            else:
+                _tags = ()
+                if _stats.data != _previous:
+                    _tags = ('changed',)
+                    _highlighted.add(_key)
+                self.table.item(_iid, values=_values, tags=_tags)
+            self._shown[_key] = _stats.data
+        self._highlighted = _highlighted
+        self._overdue -= _dirty # Received again, the tag was replaced above
+
+        self._ticks += 1
+        if self._ticks % self.OVERDUE_TICKS == 0:
+            self._update_overdue()
+        self._update_job = self.after(self.UPDATE_INTERVAL, self._update_table)
+
+    def _update_overdue(self):
+        """
+        Highlights the rows of the cyclic IDs that went silent
+        """
+        _overdue = {(s.id, s.ext) for s in self.statistics.overdue()}
+        for _key in _overdue - self._overdue:
+            if self.table.exists(self._iid(_key)):
+                self.table.item(self._iid(_key), tags=('overdue',))
+        self._overdue = _overdue
+
+    @staticmethod
+    def _iid(key):
+        return "{}{:08X}".format('x' if key[1] else 's', key[0])
+
+    @staticmethod
+    def _row_values(stats, previous):
+        """
+        :return the column values of an ID's row, bytes that differ from previous marked with '*'
+        """
+        _data = stats.data
+        if previous is None or stats.rtr:
+            _text = ' '.join("{:02X} ".format(b) for b in _data)
+        else:
+            _text = ' '.join("{:02X}{}".format(b, '*' if i >= len(previous) or b != previous[i] else ' ')
+                             for i, b in enumerate(_data))
+        if stats.ext:
+            _type = 'R' if stats.rtr else 'T'
+        else:
+            _type = 'r' if stats.rtr else 't'
+        if stats.gaps:
+            _period, _jitter, _max_gap = ("{:.1f}".format(stats.period * 1000), "{:.2f}".format(stats.jitter * 1000),
+                                          "{:.1f}".format(stats.max_gap * 1000))
+        else:
+            _period = _jitter = _max_gap = ''
+        return ("{:08X}".format(stats.id) if stats.ext else "{:03X}".format(stats.id), _type, stats.dlc, _text,
+                stats.count, _period, _jitter, _max_gap)